@@ -0,0 +1,110 @@
+"""Micro-benchmark of the RCON response parsers.
+
+Compares rcon.parsers against matching each line with an uncompiled
+re.search and converting the groups, which is how the responses used to
+be parsed. Run from the repository root:
+
+    python -m benchmarks.parsers --players 100
+"""
+
+import argparse
+import re
+import timeit
+
+from rcon.fake_server import FakeSquadServer
+from rcon.parsers import ResponseParser, DISCONNECTED_HEADER
+
+
+def disconnected_lines(amount):
+    return [f"ID: {100 + i} | SteamID: {76561198100000000 + i} | Since Disconnect: 0{i % 10}m.{i:02d}s | Name: Left {i}"
+            for i in range(amount)]
+
+
+def baseline_players(res):
+    players = []
+    for line in res.split("\n"):
+        if not line.strip() or len(line) < 20: continue
+        if "----- Active Players -----" in line: continue
+        elif DISCONNECTED_HEADER in line: break
+        try:
+            re_res = re.search(r'ID: (\d+) \| SteamID: (\d{17}|N/A) \| Name: (.*) \| Team ID: (\d+|N/A) \| Squad ID: (\d+|N/A)( \| Is Leader: (True|False) \| Role: (.*))?', line).groups()
+        except:
+            continue
+        if re_res[1] == "N/A":
+            continue
+        data = dict(player_id=int(re_res[0]), steam_id=int(re_res[1]), name=str(re_res[2]))
+        try: data['team_id'] = int(re_res[3].strip())
+        except: data['team_id'] = 0
+        try: data['squad_id'] = int(re_res[4].strip())
+        except: data['squad_id'] = -1
+        if re_res[5]:
+            data['role'] = re_res[7]
+        players.append(data)
+    return players
+
+
+def baseline_squads(res):
+    squads = []
+    team_id = None
+    for line in res.split("\n"):
+        if line.startswith("Team ID"):
+            try: team_id = int(re.search(r'Team ID: ([12]) \((.*)\)', line).group(1))
+            except: continue
+        elif line.startswith("ID") and team_id:
+            try: re_res = re.search(r'ID: (\d*) \| Name: (.*) \| Size: (\d*) \| Locked: (True|False)( \| Creator Name: (.*) \| Creator Steam ID: (\d{17}))?', line).groups()
+            except: continue
+            data = dict(squad_id=int(re_res[0]), name=str(re_res[1]), locked=re_res[3] == "True")
+            if re_res[4]:
+                data['creator_name'] = str(re_res[5])
+                data['creator_steam_id'] = int(re_res[6])
+            squads.append(data)
+    return squads
+
+
+def baseline_maps(current_map, next_map):
+    try:
+        return re.match(r"Current map is (.+), Next map is (.+)", next_map).groups()
+    except:
+        try: current_layer = re.match(r"Current level is (.+), layer is (.+)", current_map).group(2)
+        except: current_layer = None
+        try: next_layer = re.match(r"Next level is (.+), layer is (.+)", next_map).group(2)
+        except: next_layer = None
+        return current_layer, next_layer
+
+
+def best(func, args):
+    """Return the fastest of a few timings, the others are mostly noise of the machine"""
+    return min(timeit.repeat(func, number=args.number, repeat=args.repeat))
+
+
+def report(name, number, baseline, parsed):
+    print(f"{name:<16} baseline {baseline / number * 1e6:>8.1f}us   parsers {parsed / number * 1e6:>8.1f}us   "
+          f"{baseline / parsed:>5.2f}x")
+
+
+def main(args):
+    server = FakeSquadServer(players=args.players)
+    players = server.list_players() + "\n" + "\n".join(disconnected_lines(15))
+    squads = server.list_squads()
+    current_map, next_map = server.show_current_map(), server.show_next_map()
+
+    parser = ResponseParser()
+    (records, disconnected) = parser.players(players)
+    assert len(records) == len(baseline_players(players)) == args.players
+    assert sum(len(team.squads) for team in parser.squads(squads)) == len(baseline_squads(squads))
+    assert parser.maps(current_map, next_map) == baseline_maps(current_map, next_map)
+    print(f"{args.players} players, {len(disconnected)} disconnected, {len(baseline_squads(squads))} squads")
+
+    n = args.number
+    report("ListPlayers", n, best(lambda: baseline_players(players), args), best(lambda: parser.players(players), args))
+    report("ListSquads", n, best(lambda: baseline_squads(squads), args), best(lambda: parser.squads(squads), args))
+    report("ShowMaps", n, best(lambda: baseline_maps(current_map, next_map), args),
+           best(lambda: parser.maps(current_map, next_map), args))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--players", type=int, default=100, help="amount of synthetic players")
+    parser.add_argument("--number", type=int, default=2000, help="amount of times each response is parsed")
+    parser.add_argument("--repeat", type=int, default=5, help="amount of timings to take the fastest of")
+    main(parser.parse_args())
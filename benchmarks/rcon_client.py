@@ -0,0 +1,73 @@
+"""Benchmark the RCON client against a local fake Squad server.
+
+Run from the repository root:
+
+    python -m benchmarks.rcon_client --players 100 --latency 0.03
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+from rcon.commands import Rcon
+from rcon.fake_server import FakeSquadServer
+
+
+POLL_COMMANDS = ["ShowCurrentMap", "ShowNextMap", "ListPlayers", "ListSquads"]
+
+
+async def timed(coro):
+    start = time.perf_counter()
+    await coro
+    return time.perf_counter() - start
+
+
+async def bench_sequential(rcon, commands):
+    for command in commands:
+        await rcon.exec_command(command)
+
+
+async def bench_concurrent(rcon, commands):
+    await asyncio.gather(*[rcon.exec_command(command) for command in commands])
+
+
+async def bench_poll(rcon, rounds):
+    latencies = []
+    for _ in range(rounds):
+        latencies.append(await timed(rcon.exec_many(POLL_COMMANDS)))
+    return latencies
+
+
+def report(name, amount, seconds):
+    print(f"{name:<32} {amount:>6} cmds {seconds:>8.3f}s {amount / seconds:>10.1f} cmds/s")
+
+
+async def main(args):
+    server = await FakeSquadServer(password="bench", players=args.players, latency=args.latency,
+                                   chunk_size=args.chunk_size, chat_in_responses=args.chat).start()
+    try:
+        commands = ["ListPlayers"] * args.commands
+        for pipelined in (False, True):
+            rcon = Rcon("127.0.0.1", server.port, "bench", pipelined=pipelined)
+            await rcon.connect()
+            mode = "pipelined" if pipelined else "unpipelined"
+            report(f"sequential ({mode})", len(commands), await timed(bench_sequential(rcon, commands)))
+            report(f"concurrent ({mode})", len(commands), await timed(bench_concurrent(rcon, commands)))
+            latencies = await bench_poll(rcon, args.rounds)
+            print(f"{'poll cycle (' + mode + ')':<32} p50 {statistics.median(latencies) * 1000:.1f}ms, "
+                  f"max {max(latencies) * 1000:.1f}ms over {args.rounds} rounds")
+            await rcon.close()
+    finally:
+        await server.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--players", type=int, default=100, help="amount of synthetic players")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds of latency per packet")
+    parser.add_argument("--commands", type=int, default=200, help="amount of commands per run")
+    parser.add_argument("--rounds", type=int, default=20, help="amount of poll cycles")
+    parser.add_argument("--chunk-size", type=int, default=None, help="split responses into chunks of this size")
+    parser.add_argument("--chat", action="store_true", help="interleave chat packets with responses")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,49 @@
+"""Replay a recorded RCON capture through ServerInstance.update.
+
+Captures are recorded by setting rcon_capture_dir in config.txt. Run from
+the directory of the bot, so that the instance of the capture is known:
+
+    python -m benchmarks.replay_capture captures/1-20240131-235959.rcap
+"""
+
+import argparse
+import asyncio
+import time
+
+from rcon.cache import ServerInstance, ConnectionLost
+from rcon.connection import RconError
+from rcon.recorder import ReplayRcon, read_capture, capture_instance_id, DIRECTION_RECEIVED
+
+
+async def main(args):
+    instance_id = args.instance_id if args.instance_id is not None else capture_instance_id(args.capture)
+
+    records = [record for connection in read_capture(args.capture).values() for record in connection]
+    received = [record for record in records if record.direction == DIRECTION_RECEIVED]
+    print(f"{len(records)} packets, of which {len(received)} received "
+          f"({sum(len(record.body) for record in received) // 1024}KB)")
+
+    rcon = ReplayRcon(args.capture, instance_id=instance_id)
+    start = time.perf_counter()
+    await rcon.connect()
+    inst = await ServerInstance.create(instance_id, rcon)
+    durations = [time.perf_counter() - start]
+    while True:
+        start = time.perf_counter()
+        try:
+            await inst.update()
+        except (RconError, ConnectionLost, OSError):
+            # The capture ran out
+            break
+        durations.append(time.perf_counter() - start)
+    await rcon.close()
+
+    print(f"Replayed {len(durations)} updates in {sum(durations):.3f}s, "
+          f"{sum(durations) / len(durations) * 1000:.2f}ms per update")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("capture", help="path to the capture file")
+    parser.add_argument("--instance-id", type=int, default=None, help="defaults to the name of the capture file")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,133 @@
+"""Memory footprint of the players and squads kept for each server.
+
+Feeds the responses of a number of synthetic servers through
+ServerInstance._parse_players and _parse_squads, the way every poll does,
+and measures the memory the instances keep with tracemalloc, both before
+and after the name index for fuzzy lookups is built by a search. The
+baseline keeps the same responses the way they used to be kept: a list of
+dict backed players, and squads with lists of steam IDs.
+
+Every server has its own player and squad names. Roles and factions are
+shared between servers, like the ones of the game are. The bot's database
+is created in a temporary directory. Run from the repository root:
+
+    python -m benchmarks.roster_memory --servers 50 --players 100
+"""
+
+import argparse
+import os
+import tempfile
+import tracemalloc
+from datetime import datetime
+
+# The modules that open instances.db in the working directory do so when imported
+_cwd = os.getcwd()
+os.chdir(tempfile.mkdtemp())
+from rcon import instances, logs, permissions
+os.chdir(_cwd)
+
+from rcon.cache import ServerInstance
+from rcon.fake_server import FakeSquadServer
+from rcon.parsers import ResponseParser
+
+
+class BaselinePlayer():
+    def __init__(self, steam_id, name, team_id, squad_id, player_id, online_since=None, score=0, role="Unknown"):
+        self.steam_id = steam_id
+        self.name = name
+        self.team_id = team_id
+        self.squad_id = squad_id
+        self.player_id = player_id
+        self.online_since = online_since if online_since else datetime.now()
+        self.score = score
+        self.role = role
+
+
+class BaselineSquad():
+    def __init__(self, id, name, player_ids, locked, creator_name=None, creator_steam_id=None):
+        self.id = id
+        self.name = name
+        self.player_ids = player_ids
+        self.locked = locked
+        self.creator = creator_steam_id if creator_steam_id else player_ids[0]
+        self.creator_name = creator_name
+
+
+def server_responses(server_id, players):
+    """Return the ListPlayers and ListSquads responses of a synthetic server with its own names"""
+    server = FakeSquadServer(players=players)
+    for player in server.players:
+        player.name = f"Server {server_id} Player {player.player_id}"
+    squads = server.list_squads().replace("| Name: Squad ", f"| Name: Server {server_id} Squad ")
+    return server.list_players(), squads
+
+
+def keep_baseline(responses):
+    parser = ResponseParser()
+    servers = []
+    for (players_res, squads_res) in responses:
+        players = [BaselinePlayer(p.steam_id, p.name, p.team_id or 0, p.squad_id or -1, p.player_id, role=p.role)
+                   for p in parser.players(players_res)[0]]
+        squads = [BaselineSquad(s.squad_id, s.name, [p.steam_id for p in players if p.team_id == team.team_id and p.squad_id == s.squad_id],
+                                s.locked, s.creator_name, s.creator_steam_id)
+                  for team in parser.squads(squads_res) for s in team.squads]
+        unassigned = [[p.steam_id for p in players if p.team_id == team_id and p.squad_id == -1] for team_id in (1, 2)]
+        servers.append((players, squads, unassigned))
+    return servers
+
+
+def keep_instances(responses):
+    servers = []
+    for i, (players_res, squads_res) in enumerate(responses):
+        inst = ServerInstance(i, None)
+        inst._parse_players(inst.parser.players(players_res)[0])
+        inst._parse_squads(squads_res)
+        servers.append(inst)
+    return servers
+
+
+def measure(keep, responses):
+    """Return the memory kept by keep(responses), and the kept objects"""
+    tracemalloc.start()
+    kept = keep(responses)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size, kept
+
+
+def measure_instances(responses):
+    """Return the memory kept by the instances, before and after their names are searched"""
+    tracemalloc.start()
+    kept = keep_instances(responses)
+    size = tracemalloc.get_traced_memory()[0]
+    # The name index for fuzzy lookups is built by the first search, see rcon.roster.NameIndex
+    for inst in kept:
+        inst.get_player("Player", related_names=True)
+    with_names = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size, with_names
+
+
+def main(args):
+    for i in range(args.servers):
+        # The join logs of an instance are written to the database
+        instances.cur.execute('INSERT INTO instances (instance_id, name) VALUES (?, ?)', (i, f"Server {i}"))
+    instances.db.commit()
+    responses = [server_responses(i, args.players) for i in range(args.servers)]
+    players = args.servers * args.players
+
+    baseline, kept = measure(keep_baseline, responses)
+    del kept
+    size, with_names = measure_instances(responses)
+
+    print(f"{args.servers} servers with {args.players} players each, in bytes per player")
+    print(f"{'baseline':<30} {baseline / players:>6.0f}")
+    print(f"{'ServerInstance':<30} {size / players:>6.0f}   {size / baseline:.2f}x the baseline")
+    print(f"{'  once names are searched':<30} {with_names / players:>6.0f}   {with_names / baseline:.2f}x the baseline")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--servers", type=int, default=50, help="amount of synthetic servers")
+    parser.add_argument("--players", type=int, default=100, help="amount of synthetic players per server")
+    main(parser.parse_args())
@@ -37,6 +37,12 @@ async def command_prefix(bot, msg):
 bot = commands.Bot(intents=intents, command_prefix=command_prefix, case_insensitive=True)
 bot.remove_command('help')
 
+@bot.before_invoke
+async def activate_instance(ctx):
+    # Idle instances are suspended, connect the selected one again before it is used
+    if ctx.guild:
+        await bot.cache.activate_selected(ctx.author, ctx.guild.id)
+
 @bot.group(invoke_without_command=True, aliases=['cog'])
 @commands.is_owner()
 async def module(ctx):
@@ -142,7 +148,6 @@ async def load_extensions():
             except Exception as e:
                 print(f"{cog} can not be loaded:")
                 raise e
-bot.setup_hook = load_extensions
 
 # Setup logger
 import logging
@@ -153,13 +158,12 @@ logging.info('Launching bot...')
 
 # Initialize cache
 from rcon.cache import Cache
-for i in range(10):
-    try:
-        bot.cache = Cache()
-    except:
-        logging.error('Failed to build the cache on attempt #%s', i+1)
-    else:
-        break
+async def setup_hook():
+    # Instances connect in the background, those that can't be reached are retried by their supervisor
+    bot.cache = Cache()
+    bot.connecting = asyncio.create_task(bot.cache.connect_instances())
+    await load_extensions()
+bot.setup_hook = setup_hook
 
 # Run the bot
 with open("token.txt", "r") as f:
@@ -14,7 +14,7 @@ from utils import Config
 config = Config()
 
 from rcon.commands import RconCommandError
-from rcon.cache import CacheNotFound, ConnectionLost
+from rcon.cache import CacheNotFound, ConnectionLost, ServerUnreachable
 from rcon.map_rotation import MapRotationError
 
 def convert_time(seconds):
@@ -89,6 +89,8 @@ class _events(commands.Cog):
             await ctx.send(f"{error_emoji} The game server returned an error!\n`{str(error)}`")
         elif isinstance(error, ConnectionLost):
             await ctx.send(f"{error_emoji} Connection to the server was lost! Try reconnecting using `r!inst reconnect`\n`{str(error)}`.")
+        elif isinstance(error, ServerUnreachable):
+            await ctx.send(f"{error_emoji} The server can't be reached right now! Reconnecting in the background...\n`{str(error)}`")
         elif isinstance(error, CacheNotFound):
             await ctx.send(f"{error_emoji} This instance was shut down! Try reconnecting using `r!inst reconnect`.")
         elif isinstance(error, MapRotationError):
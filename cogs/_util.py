@@ -5,6 +5,8 @@ from random import randint
 import os
 import ast
 
+from rcon import metrics
+from rcon.instances import Instance
 from utils import Config
 config = Config()
 
@@ -235,6 +237,36 @@ class _util(commands.Cog):
                     pass
             await ctx.send("DMs sent")
 
+    @commands.command(description="View RCON latency percentiles per server", usage="r!rcon_stats", hidden=True)
+    @commands.is_owner()
+    async def rcon_stats(self, ctx):
+        servers = sorted(metrics.registry.servers.values(), key=lambda m: m.total.percentile(99), reverse=True)
+        if not servers:
+            await ctx.send("No RCON commands were executed yet")
+            return
+
+        embed = discord.Embed(title="RCON statistics", description="Latency per command in ms, slowest servers first")
+        for server in servers[:25]:
+            try: name = Instance(server.name).name
+            except: name = str(server.name)
+
+            lines = ["{: <20} {: >5} {: >6} {: >6} {: >6}".format("Command", "Count", "p50", "p95", "p99")]
+            for verb, hist in sorted(server.commands.items(), key=lambda item: item[1].count, reverse=True)[:8]:
+                lines.append("{: <20} {: >5} {: >6.0f} {: >6.0f} {: >6.0f}".format(
+                    verb[:20], hist.count, hist.percentile(50) * 1000, hist.percentile(95) * 1000, hist.percentile(99) * 1000))
+            errors = sum(server.errors.values())
+            lines.append("")
+            lines.append(f"In: {server.bytes_in // 1024}KB/{server.packets_in} pkts, Out: {server.bytes_out // 1024}KB/{server.packets_out} pkts")
+            lines.append(f"Chat: {server.chat_packets}, Reconnects: {server.reconnects}, Errors: {errors}")
+            for priority, hist in server.queue_waits.items():
+                lines.append(f"Queue {priority}: max {server.queue_depths.get(priority, 0)} waiting, p99 wait {hist.percentile(99) * 1000:.0f}ms")
+            if server.worker_jobs.count:
+                lines.append(f"Worker: {server.worker_jobs.count} jobs, p99 {server.worker_jobs.percentile(99) * 1000:.0f}ms, "
+                             f"max {server.worker_backlog} waiting, {server.worker_failures} failed, "
+                             f"{server.worker_dropped} dropped, {server.worker_restarts} restarts")
+            embed.add_field(name=name, value="```" + "\n".join(lines)[:1000] + "```", inline=False)
+        await ctx.send(embed=embed)
+
 
 
 async def setup(bot):
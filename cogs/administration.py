@@ -1,13 +1,13 @@
 import discord
 from discord.ext import commands, tasks
 import json
-from ast import literal_eval
 import os
 from pathlib import Path
 
 from rcon.commands import Rcon
 from rcon.instances import check_perms, Instance
 from rcon.map_rotation import MAPS_SQUAD, MAPS_BTW, MAPS_PS
+from rcon.scheduler import PRIORITY_INTERACTIVE
 
 from utils import Config, base_embed
 config = Config()
@@ -24,14 +24,11 @@ class administration(commands.Cog):
     @check_perms(execute=True)
     async def execute(self, ctx, *, cmd):
         inst = self.bot.cache.instance(ctx.author, ctx.guild.id)
-        res = inst.rcon.exec_command(cmd)
-        res = literal_eval(res)
-        if not res: # An empty list was received
+        res = await inst.rcon.exec_command(cmd, PRIORITY_INTERACTIVE)
+        if not res:
             res = "Empty response received"
-        else:
-            res = res[0].strip(b'\x00\x01').decode('utf-8')
-            if len(res) > 1018: # too big to be sent in one embed field
-                res = res[:1015] + "..."
+        elif len(res) > 1018: # too big to be sent in one embed field
+            res = res[:1015] + "..."
 
         embed = base_embed(inst.id, title="Command executed")
         embed.add_field(name="Request", value=f"`{cmd}`", inline=False)
@@ -43,7 +40,7 @@ class administration(commands.Cog):
     @check_perms(config=True)
     async def player_limit(self, ctx, limit: int):
         inst = self.bot.cache.instance(ctx.author, ctx.guild.id)
-        res = inst.rcon.set_max_player_limit(limit)
+        res = await inst.rcon.set_max_player_limit(limit)
 
         embed = base_embed(inst.id, title="Max player limit changed", description=res)
         await ctx.send(embed=embed)
@@ -52,7 +49,7 @@ class administration(commands.Cog):
     @check_perms(password=True)
     async def password(self, ctx, password: str = ""):
         inst = self.bot.cache.instance(ctx.author, ctx.guild.id)
-        res = inst.rcon.set_password(password)
+        res = await inst.rcon.set_password(password)
 
         embed = base_embed(inst.id, title="Password updated", description=res)
         await ctx.send(embed=embed)
@@ -67,7 +64,7 @@ class administration(commands.Cog):
             raise commands.BadArgument('%s needs to be a percentage' % percentage)
 
         inst = self.bot.cache.instance(ctx.author, ctx.guild.id)
-        res = inst.rcon.set_clockspeed(percentage)
+        res = await inst.rcon.set_clockspeed(percentage)
 
         embed = base_embed(inst.id, title="Server clockspeed adjusted", description=res)
         await ctx.send(embed=embed)
@@ -119,7 +116,7 @@ class administration(commands.Cog):
         content = str(await attachment.read(), 'utf-8')
         content = json.loads(content)
 
-        inst.import_rotation(content=content)
+        await inst.import_rotation(content=content)
         with open(Path(f'rotations/{str(inst.id)}.json'), 'w+') as f:
             f.write(json.dumps(content, indent=2))
 
@@ -159,7 +156,7 @@ class administration(commands.Cog):
             await ctx.send(':no_entry_sign: Upload a custom rotation first using `r!rotation upload`!')
             return
         
-        inst.import_rotation(fp=path)
+        await inst.import_rotation(fp=path)
         Instance(inst.id).set_uses_custom_rotation(1)
 
         embed = base_embed(inst.id, title="Enabled Custom Map Rotation", color=discord.Color.green())
@@ -159,11 +159,23 @@ class instances(commands.Cog):
         embed.set_author(name=str(ctx.author), icon_url=ctx.author.avatar.url)
 
         for i, (inst, perms) in enumerate(instances):
+            supervisor = self.bot.cache.supervisors.get(inst.id)
             try: self.bot.cache.instance(inst.id, by_inst_id=True)
-            except: availability = "\🔴"
-            else: availability = "\🟢"
+            except:
+                if supervisor and supervisor.is_running:
+                    availability = "\🟠"
+                    status = str(supervisor)
+                elif inst.id in self.bot.cache.suspended:
+                    availability = "\⚪"
+                    status = "Idle, connects when used"
+                else:
+                    availability = "\🔴"
+                    status = "Disconnected"
+            else:
+                availability = "\🟢"
+                status = "Connected"
             perms = ", ".join([perm for perm, val in perms.to_dict().items() if val])
-            embed.add_field(name=f"{str(i+1)} | {inst.name} {availability}", value=f"> **Perms:** {perms}")
+            embed.add_field(name=f"{str(i+1)} | {inst.name} {availability}", value=f"> **Status:** {status}\n> **Perms:** {perms}")
         embed = add_empty_fields(embed)
 
         await ctx.send(embed=embed)
@@ -195,7 +207,7 @@ class instances(commands.Cog):
         instance_id = self.bot.cache._get_selected_instance(ctx.author)
         inst = Instance(instance_id)
 
-        res = self.bot.cache._connect_instance(inst, return_exception=True)
+        res = await self.bot.cache._connect_instance(inst, return_exception=True)
         if isinstance(res, Exception): # Instance could not be connected
             raise res
         else: # Instance was successfully connected
@@ -208,7 +220,7 @@ class instances(commands.Cog):
         instance_id = self.bot.cache._get_selected_instance(ctx.author)
         inst = Instance(instance_id)
 
-        self.bot.cache.instances[instance_id] = None
+        await self.bot.cache._disconnect_instance(instance_id)
         embed = base_embed(instance_id, title="Instance was shut down")
         await ctx.send(embed=embed)
     
@@ -237,7 +249,7 @@ class instances(commands.Cog):
         else:
             if isinstance(msg.channel, discord.TextChannel): await msg.clear_reactions()
             embed = base_embed(inst.id, title="Instance deleted")
-            self.bot.cache.delete_instance(instance_id)
+            await self.bot.cache.delete_instance(instance_id)
             await msg.edit(embed=embed)
     ### r!instance create
     @instance_command.command(name="create", aliases=["add"])
@@ -373,11 +385,11 @@ class instances(commands.Cog):
                     msg = await ctx.author.send("Trying to establish a connection...")
                     try:
                         if operation == 0:
-                            inst = add_instance(game=values[0], address=values[1], port=values[2], password=values[3], name=values[4], owner_id=ctx.author.id)
+                            inst = await add_instance(game=values[0], address=values[1], port=values[2], password=values[3], name=values[4], owner_id=ctx.author.id)
                             inst.config['guild_id'] = ctx.guild.id
                             inst.store_config()
                         elif operation == 1:
-                            inst = edit_instance(inst.id, game=values[0], address=values[1], port=values[2], password=values[3], name=values[4])
+                            inst = await edit_instance(inst.id, game=values[0], address=values[1], port=values[2], password=values[3], name=values[4])
                     except RconAuthError as e:
                         await ctx.author.send(f"Unable to connect to the server: {str(e)}")
                         await asyncio.sleep(3)
@@ -388,7 +400,8 @@ class instances(commands.Cog):
                         confirmation = ""
                     else:
                         await msg.edit(content="Connection established!")
-                        self.bot.cache._connect_instance(inst)
+                        self.bot.cache.touch(inst.id)
+                        await self.bot.cache._connect_instance(inst)
                         embed = base_embed(inst.id, description="You can now customize your instance further by setting permissions and changing config options. See `r!inst help` for more information.", color=discord.Color.green())
                         if operation == 0: embed.title = "Instance created!"
                         elif operation == 1: embed.title = "Instance edited!"
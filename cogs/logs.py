@@ -1,13 +1,14 @@
+import functools
 import discord
 from discord.ext import commands, tasks
-from datetime import datetime, timedelta
-import re
+from datetime import datetime
 
 from rcon.commands import Rcon
 from rcon.instances import check_perms, Instance
 from rcon.logs import ServerLogs, format_log
-from rcon.connection import RconAuthError, RconError
-from rcon.cache import ConnectionLost
+from rcon.connection import RconError
+from rcon.events import PlayerJoined, PlayerLeft, MapChanged, Teamkill, ChatMessage
+from rcon.workers import InstanceWorkers
 
 import logging
 
@@ -16,7 +17,8 @@ config = Config()
 
 
 SECONDS_BETWEEN_CACHE_REFRESH = 30
-SECONDS_BETWEEN_CHECKS = 15
+# Seconds between checks for instances that are due to be polled, see rcon.polling
+SECONDS_BETWEEN_CHECKS = 5
 
 
 class logs(commands.Cog):
@@ -26,9 +28,31 @@ class logs(commands.Cog):
         self.bot = bot
         self.last_seen_id = {}
         self.trigger_cooldowns = {}
-
-        self.check_server.add_exception_type(Exception)
-        self.check_server.start()
+        # Instance ID -> (joins, leaves) that have yet to be sent
+        self.pending_joins = {}
+        # Every instance is checked and logged from its own task, so that one slow
+        # server or rate limited channel doesn't hold up the others
+        self.workers = InstanceWorkers(self.check_server, SECONDS_BETWEEN_CHECKS)
+
+        self.subscriptions = [
+            # Chat and teamkills are forwarded right away, instead of after the next poll
+            (ChatMessage, functools.partial(self._submit, self.on_chat_message, urgent=True)),
+            (Teamkill, functools.partial(self._submit, self.on_teamkill, urgent=True)),
+            (PlayerJoined, self.on_player_joined),
+            (PlayerLeft, self.on_player_left),
+            (MapChanged, functools.partial(self._submit, self.on_map_changed)),
+        ]
+        for event_type, callback in self.subscriptions:
+            self.bot.cache.events.subscribe(event_type, callback)
+
+        self.sync_workers.add_exception_type(Exception)
+        self.sync_workers.start()
+
+    def cog_unload(self):
+        for event_type, callback in self.subscriptions:
+            self.bot.cache.events.unsubscribe(event_type, callback)
+        self.sync_workers.cancel()
+        self.workers.stop()
 
 
     @commands.command(description="Read all chat messages", usage="r!chat")
@@ -87,226 +111,235 @@ class logs(commands.Cog):
 
 
     async def _query(self, inst):
-        # Execute a command to receive new chat packets.
-        # We can use this opportunity to update the cache,
-        # though we don't want to overdo this.
+        # Chat is received in the background, but we can use this
+        # opportunity to update the cache, though we don't want
+        # to overdo this.
         if (datetime.now() - inst.last_updated).total_seconds() > SECONDS_BETWEEN_CACHE_REFRESH:
-            inst.update()
-        else:
-            inst.rcon.exec_command("a")
-
-        # Grab all the new chat messages
-        new_chat_messages = inst.rcon.get_player_chat()
-        inst.rcon.clear_player_chat()
-
-        # Parse incoming messages
-        # '[ChatAll] [SteamID:12345678901234567] [FP] Clan Member 1 : Hello world!'
-        # '[ChatAdmin] ASQKillDeathRuleset : Player S.T.A.L.K.E.R%s Team Killed Player NUKE'
-        # '[SteamID:76561198129591637] (WTH) Dylan has possessed admin camera.'
-        for message in new_chat_messages:
-            raw_data = {}
-            if message.startswith('[ChatAdmin] ASQKillDeathRuleset'):
-                # The message is a logged teamkill
-                p1_name, p2_name = re.search(r'\[ChatAdmin\] ASQKillDeathRuleset : Player (.*) Team Killed Player (.*)', message).groups()
-                p1 = inst.get_player(p1_name)
-                p2 = inst.get_player(p2_name)
-                p1_output = f"{p1_name} ({p1.steam_id})" if p1 else p1_name
-                p2_output = f"{p2_name} ({p2.steam_id})" if p2 else p2_name
-
-                message = f"{p1_output} team killed {p2_output}"
-                ServerLogs(inst.id).add("teamkill", message)
-                continue
+            await inst.update()
+
+    def _get_log_channel(self, instance_id, key):
+        """Return the channel an instance logs to, or None if it isn't set"""
+        config = Instance(instance_id).config
+        guild = self.bot.get_guild(config['guild_id'])
+        return guild.get_channel(config[key]) if guild else None
+
+    async def _submit(self, handler, event, urgent=False):
+        """Handle the event from the worker of its instance"""
+        self.workers.submit(event.instance_id, functools.partial(handler, event), urgent)
+
+    async def on_teamkill(self, event):
+        p1_output = f"{event.attacker_name} ({event.attacker.steam_id})" if event.attacker else event.attacker_name
+        p2_output = f"{event.victim_name} ({event.victim.steam_id})" if event.victim else event.victim_name
+        message = f"{p1_output} team killed {p2_output}"
+        ServerLogs(event.instance_id).add("teamkill", message)
+
+        channel_teamkills = self._get_log_channel(event.instance_id, 'channel_log_teamkills')
+        if channel_teamkills:
+            embed = base_embed(event.instance_id)
+            embed.set_footer(text=f"Recorded at {event.timestamp.strftime('%a, %b %d, %Y %I:%M %p')}")
+            embed.color = discord.Color.dark_red()
+            embed.description = message
+            await channel_teamkills.send(embed=embed)
+
+    async def on_player_joined(self, event):
+        self._queue_join_log(event.instance_id, 0, f"{event.player.name} connected")
+
+    async def on_player_left(self, event):
+        self._queue_join_log(event.instance_id, 1, f"{event.player.name} disconnected after {str(event.online_time)} minutes")
+
+    def _queue_join_log(self, instance_id, index, message):
+        pending = self.pending_joins.get(instance_id)
+        if pending is None:
+            # Everything that joins or leaves until the worker gets to it is sent at once
+            if not self.workers.submit(instance_id, functools.partial(self._send_join_logs, instance_id)):
+                return
+            pending = self.pending_joins[instance_id] = ([], [])
+        pending[index].append(message)
+
+    async def _send_join_logs(self, instance_id):
+        joins, leaves = self.pending_joins.pop(instance_id)
+        channel_joins = self._get_log_channel(instance_id, 'channel_log_joins')
+        if not channel_joins:
+            return
+
+        embed = base_embed(instance_id)
+        embed.set_footer(text=f"Recorded at {datetime.now().strftime('%a, %b %d, %Y %I:%M %p')}")
+        if joins:
+            embed.color = discord.Color.dark_green()
+            embed.description = "\n".join(joins)
+            await channel_joins.send(embed=embed)
+        if leaves:
+            embed.color = None
+            embed.description = "\n".join(leaves)
+            await channel_joins.send(embed=embed)
+
+    async def on_map_changed(self, event):
+        channel_match = self._get_log_channel(event.instance_id, 'channel_log_match')
+        if channel_match:
+            message = f"Map changed from {event.old_map} to {event.new_map}."
+            if event.duration is not None:
+                message += f" The match lasted {str(event.duration)} minutes."
             else:
-                try: raw_data['channel'], raw_data['steam_id'], raw_data['name'], raw_data['message'] = re.search(r'\[(.+)\] \[SteamID:(\d{17})\] (.*) : (.*)', message).groups()
-                except: continue
-
-            player = inst.get_player(int(raw_data['steam_id']))
-            if player:
-                faction = inst.team1.faction_short if player.team_id == 1 else inst.team2.faction_short
-                squad = player.squad_id
-
-                if raw_data['channel'] == "ChatAdmin":
-                    continue
-
-                if raw_data['channel'] == "ChatAll":
-                    channel = "All"
-                elif raw_data['channel'] == "ChatTeam":
-                    channel = faction
-                elif raw_data['channel'] == "ChatSquad":
-                    channel = f"{faction}/Squad{str(squad)}"
-                else:
-                    channel = raw_data['channel']
+                message += " Match duration is unknown."
+            embed = base_embed(event.instance_id)
+            embed.color = discord.Color.from_rgb(255,255,255)
+            embed.title = message
+            embed.set_footer(text=f"Recorded at {event.timestamp.strftime('%a, %b %d, %Y %I:%M %p')}")
+            await channel_match.send(embed=embed)
+
+    async def on_chat_message(self, event):
+        inst = self.bot.cache.instances.get(event.instance_id)
+        if not inst:
+            return
+
+        player = event.player
+        if player:
+            faction = inst.team1.faction_short if player.team_id == 1 else inst.team2.faction_short
+            squad = player.squad_id
+
+            if event.channel == "ChatAdmin":
+                return
+
+            if event.channel == "ChatAll":
+                channel = "All"
+            elif event.channel == "ChatTeam":
+                channel = faction
+            elif event.channel == "ChatSquad":
+                channel = f"{faction}/Squad{str(squad)}"
             else:
-                channel = "Unknown"
-            
-            name = raw_data['name']
-            text = raw_data['message']
-
-            message = f"[{channel}] {name}: {text}"
-            ServerLogs(inst.id).add("chat", message)
-
-
-            # Do stuff with new messages
-            instance = Instance(inst.id)
-            config = instance.config
-            guild = self.bot.get_guild(config["guild_id"])
-
-            if guild:
-
-                # Trigger words
-                trigger_channel = guild.get_channel(config["chat_trigger_channel_id"])
-                trigger_words = config["chat_trigger_words"].split(",")
-                if trigger_channel and trigger_words:
-                    trigger_mentions = config["chat_trigger_mentions"]
-                    for word in trigger_words:
-                        word = word.strip().lower()
-                        if word in text.lower():
-
-                            try:
-                                last_attempt = self.trigger_cooldowns[player.steam_id]
-                                cooldown = int(config['chat_trigger_cooldown'] - (datetime.now() - last_attempt).total_seconds())
-                            except KeyError:
-                                cooldown = -1
-                            if cooldown == 0:
-                                # The player sent multiple admin reports in the same period.
-                                # Let's not ping the admins twice, because why would we?
-                                trigger_mentions = ""
-                            
-                            if cooldown > 0:
-                                # The player tried sending admin reports too fast and is still in cooldown
-                                inst.rcon.warn(player.steam_id, f"You're sending reports too fast! Please wait {str(cooldown)}s and try again.")
-                                description = f"{name}: {discord.utils.escape_markdown(text)}"
-                                embed = base_embed(inst.id, description=description)
-                                embed.set_footer(text=f"Cooldown was active for this player ({str(cooldown)}s). He was asked to try again.")
-                                await trigger_channel.send(embed=embed)
-
-                            elif len(text.split()) < 3 and config["chat_trigger_require_reason"]:
-                                # The player didn't include a reason, which is required
-                                inst.rcon.warn(player.steam_id, f"Please include a reason in your '{word}' report and try again.")
-                                description = f"{name}: {discord.utils.escape_markdown(text)}"
-                                embed = base_embed(inst.id, description=description)
-                                embed.set_footer(text="No reason was included in this report. The player was asked to try again.")
-                                await trigger_channel.send(embed=embed)
-
-                            else:
-                                self.trigger_cooldowns[player.steam_id] = datetime.now()
-                                description = f"{name}: {discord.utils.escape_markdown(text)}"
-                                embed = base_embed(inst.id, title="New Report", description=description, color=discord.Color.red())
-                                if player: embed.set_footer(text="Team ID: %s • Squad ID: %s • Player ID: %s" % (player.team_id, player.squad_id, player.player_id))
-                                await trigger_channel.send(trigger_mentions, embed=embed)
-                                if config['chat_trigger_confirmation']:
-                                    inst.rcon.warn(player.steam_id, config['chat_trigger_confirmation'])
-                            
-                            break
-                
-                # Auto log
-                chat_channel = guild.get_channel(config["channel_log_chat"])
-                if chat_channel:
-                    embed = base_embed(instance)
-                    title = "{: <20} {}".format("["+channel+"]", name)
-                    embed.add_field(name=title, value=discord.utils.escape_markdown(text))
-                    
-                    embed.set_footer(text=f"Recorded at {datetime.now().strftime('%a, %b %d, %Y %I:%M %p')}")
-
-                    if not player or channel == "Unknown":
-                        embed.color = None
-                    elif raw_data['channel'] == "ChatAll":
-                        embed.color = discord.Color.dark_gray()
-                    elif raw_data['channel'] == "ChatTeam":
-                        if player.team_id == 1: embed.color = discord.Color.from_rgb(66, 194, 245)
-                        else: embed.color = discord.Color.from_rgb(240, 36, 53)
-                    elif raw_data['channel'] == "ChatSquad":
-                        if player.team_id == 1: embed.color = discord.Color.from_rgb(0, 100, 255)
-                        else: embed.color = discord.Color.from_rgb(201, 4, 24)
-        
-                    await chat_channel.send(embed=embed)
+                channel = event.channel
+        else:
+            channel = "Unknown"
 
+        name = event.name
+        text = event.message
+
+        message = f"[{channel}] {name}: {text}"
+        ServerLogs(inst.id).add("chat", message)
+
+
+        # Do stuff with new messages
+        instance = Instance(inst.id)
+        config = instance.config
+        guild = self.bot.get_guild(config["guild_id"])
+
+        if guild:
+
+            # Trigger words
+            trigger_channel = guild.get_channel(config["chat_trigger_channel_id"])
+            trigger_words = config["chat_trigger_words"].split(",")
+            if trigger_channel and trigger_words:
+                trigger_mentions = config["chat_trigger_mentions"]
+                for word in trigger_words:
+                    word = word.strip().lower()
+                    if word in text.lower():
 
-    @tasks.loop(seconds=SECONDS_BETWEEN_CHECKS)
-    async def check_server(self):
-        try:
-            for inst in self.bot.cache.instances.values():
-                if inst:
-                    try:
-                        await self._query(inst)
                         try:
-                            max_id = self.last_seen_id[inst.id]
+                            last_attempt = self.trigger_cooldowns[player.steam_id]
+                            cooldown = int(config['chat_trigger_cooldown'] - (datetime.now() - last_attempt).total_seconds())
                         except KeyError:
-                            max_id = ServerLogs(inst.id)._get_max_log_id()
-                            new_max_id = max_id
-                            new_logs = []
+                            cooldown = -1
+                        if cooldown == 0:
+                            # The player sent multiple admin reports in the same period.
+                            # Let's not ping the admins twice, because why would we?
+                            trigger_mentions = ""
+
+                        if cooldown > 0:
+                            # The player tried sending admin reports too fast and is still in cooldown
+                            await inst.rcon.warn(player.steam_id, f"You're sending reports too fast! Please wait {str(cooldown)}s and try again.")
+                            description = f"{name}: {discord.utils.escape_markdown(text)}"
+                            embed = base_embed(inst.id, description=description)
+                            embed.set_footer(text=f"Cooldown was active for this player ({str(cooldown)}s). He was asked to try again.")
+                            await trigger_channel.send(embed=embed)
+
+                        elif len(text.split()) < 3 and config["chat_trigger_require_reason"]:
+                            # The player didn't include a reason, which is required
+                            await inst.rcon.warn(player.steam_id, f"Please include a reason in your '{word}' report and try again.")
+                            description = f"{name}: {discord.utils.escape_markdown(text)}"
+                            embed = base_embed(inst.id, description=description)
+                            embed.set_footer(text="No reason was included in this report. The player was asked to try again.")
+                            await trigger_channel.send(embed=embed)
+
                         else:
-                            new_max_id, new_logs = ServerLogs(inst.id).get_logs_after(max_id)
-
-                        config = Instance(inst.id).config
-                        guild = self.bot.get_guild(config['guild_id'])
-                        if guild and new_logs:
-                            # Note: Chat logs are handled alongside the triggers
-                            channel_joins = guild.get_channel(config['channel_log_joins'])
-                            channel_match = guild.get_channel(config['channel_log_match'])
-                            channel_rcon = guild.get_channel(config['channel_log_rcon'])
-                            channel_teamkills = guild.get_channel(config['channel_log_teamkills'])
-
-                            if channel_rcon:
-                                default_embed = base_embed(inst.id)
-                                logs = [log for log in new_logs if log['category'] == 'rcon']
-                                for log in logs:
-                                    embed = default_embed
-                                    embed.color = discord.Color.teal()
-                                    embed.title = log['message']
-                                    embed.set_footer(text=f"Recorded at {log['timestamp'].strftime('%a, %b %d, %Y %I:%M %p')}")
-                                    await channel_rcon.send(embed=embed)
-                            if channel_joins:
-                                default_embed = base_embed(inst.id)
-                                logs = [log for log in new_logs if log['category'] == 'joins']
-                                if logs:
-                                    joins = [log['message'] for log in logs if log['message'].endswith(' connected')]
-                                    leaves = [log['message'] for log in logs if not log['message'].endswith(' connected')]
-
-                                    embed = default_embed
-                                    embed.set_footer(text=f"Recorded at {logs[-1]['timestamp'].strftime('%a, %b %d, %Y %I:%M %p')}")
-
-                                    if joins:    
-                                        embed.color = discord.Color.dark_green()
-                                        embed.description = "\n".join(joins)
-                                        await channel_joins.send(embed=embed)
-                                    if leaves:    
-                                        embed.color = None
-                                        embed.description = "\n".join(leaves)
-                                        await channel_joins.send(embed=embed)
-                            if channel_match:
-                                default_embed = base_embed(inst.id)
-                                logs = [log for log in new_logs if log['category'] == 'match']
-                                for log in logs:
-                                    embed = default_embed
-                                    embed.color = discord.Color.from_rgb(255,255,255)
-                                    embed.title = log['message']
-                                    embed.set_footer(text=f"Recorded at {log['timestamp'].strftime('%a, %b %d, %Y %I:%M %p')}")
-                                    await channel_match.send(embed=embed)
-                            if channel_teamkills:
-                                default_embed = base_embed(inst.id)
-                                logs = [log for log in new_logs if log['category'] == 'teamkill']
-                                if logs:
-                                    embed = default_embed
-                                    embed.set_footer(text=f"Recorded at {logs[-1]['timestamp'].strftime('%a, %b %d, %Y %I:%M %p')}")
-
-                                    embed.color = discord.Color.dark_red()
-                                    embed.description = "\n".join([log['message'] for log in logs])
-                                    await channel_teamkills.send(embed=embed)
-
-                        self.last_seen_id[inst.id] = new_max_id
-                    except Exception as e:
-                        logging.exception('Inst %s: Unhandled exception whilst updating: %s: %s', inst.id, e.__class__.__name__, e)
-                        if isinstance(e, (RconAuthError, ConnectionLost)) and (datetime.now() - timedelta(minutes=30)) > inst.last_updated:
-                            self.bot.cache.instances[inst.id] = None
-        except Exception as e:
-            logging.critical('Unhandled exception in instance update cycle: %s: %s', e.__class__.__name__, e)
-
-
-    @check_server.before_loop
-    async def before_check(self):
+                            self.trigger_cooldowns[player.steam_id] = datetime.now()
+                            description = f"{name}: {discord.utils.escape_markdown(text)}"
+                            embed = base_embed(inst.id, title="New Report", description=description, color=discord.Color.red())
+                            if player: embed.set_footer(text="Team ID: %s • Squad ID: %s • Player ID: %s" % (player.team_id, player.squad_id, player.player_id))
+                            await trigger_channel.send(trigger_mentions, embed=embed)
+                            if config['chat_trigger_confirmation']:
+                                await inst.rcon.warn(player.steam_id, config['chat_trigger_confirmation'])
+
+                        break
+
+            # Auto log
+            chat_channel = guild.get_channel(config["channel_log_chat"])
+            if chat_channel:
+                embed = base_embed(instance)
+                title = "{: <20} {}".format("["+channel+"]", name)
+                embed.add_field(name=title, value=discord.utils.escape_markdown(text))
+
+                embed.set_footer(text=f"Recorded at {datetime.now().strftime('%a, %b %d, %Y %I:%M %p')}")
+
+                if not player or channel == "Unknown":
+                    embed.color = None
+                elif event.channel == "ChatAll":
+                    embed.color = discord.Color.dark_gray()
+                elif event.channel == "ChatTeam":
+                    if player.team_id == 1: embed.color = discord.Color.from_rgb(66, 194, 245)
+                    else: embed.color = discord.Color.from_rgb(240, 36, 53)
+                elif event.channel == "ChatSquad":
+                    if player.team_id == 1: embed.color = discord.Color.from_rgb(0, 100, 255)
+                    else: embed.color = discord.Color.from_rgb(201, 4, 24)
+
+                await chat_channel.send(embed=embed)
+
+
+    @tasks.loop(seconds=SECONDS_BETWEEN_CHECKS)
+    async def sync_workers(self):
+        self.workers.sync([inst.id for inst in self.bot.cache.instances.values() if inst])
+        # Jobs of stopped workers never run
+        for instance_id in list(self.pending_joins):
+            if instance_id not in self.workers.workers:
+                del self.pending_joins[instance_id]
+
+    @sync_workers.before_loop
+    async def before_sync(self):
         await self.bot.wait_until_ready()
 
+    async def check_server(self, instance_id):
+        """Poll an instance if it is due, and send its new RCON logs. Runs in the worker of the instance."""
+        inst = self.bot.cache.instances.get(instance_id)
+        # Unreachable servers are reconnected by their supervisor
+        if not inst or not inst.rcon.is_available:
+            return
+
+        polling = self.bot.cache.polling
+        if polling.is_due(inst):
+            await inst.refresh(force=True)
+            polling.record_poll(inst)
+
+        # Joins, matches, teamkills and chat are sent as they happen, see the event subscribers
+        try:
+            max_id = self.last_seen_id[inst.id]
+        except KeyError:
+            max_id = ServerLogs(inst.id)._get_max_log_id()
+            new_max_id = max_id
+            new_logs = []
+        else:
+            new_max_id, new_logs = ServerLogs(inst.id).get_logs_after(max_id, category='rcon')
+
+        channel_rcon = self._get_log_channel(inst.id, 'channel_log_rcon') if new_logs else None
+        if channel_rcon:
+            default_embed = base_embed(inst.id)
+            for log in new_logs:
+                embed = default_embed
+                embed.color = discord.Color.teal()
+                embed.title = log['message']
+                embed.set_footer(text=f"Recorded at {log['timestamp'].strftime('%a, %b %d, %Y %I:%M %p')}")
+                await channel_rcon.send(embed=embed)
+
+        self.last_seen_id[inst.id] = new_max_id
+
 
 async def setup(bot):
     await bot.add_cog(logs(bot))
\ No newline at end of file
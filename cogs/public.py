@@ -1,10 +1,11 @@
 import discord
 from discord.ext import commands, tasks
+import asyncio
 import json
 from ast import literal_eval
 from datetime import datetime
 
-from rcon.instances import check_perms, get_available_instances, get_perms
+from rcon.instances import check_perms, get_available_instances, get_perms, Instance
 
 from utils import Config, get_player_input_type, add_empty_fields, base_embed, get_name
 config = Config()
@@ -32,17 +33,19 @@ class public(commands.Cog):
                 raise commands.BadArgument("No instance found with name or ID %s" % instance_id)
             if not perms.public:
                 raise commands.BadArgument("Missing required permissions for this instance")
-            inst = self.bot.cache.instance(inst.id, by_inst_id=True).update()
+            await self.bot.cache.activate(inst.id)
+            inst = await self.bot.cache.snapshot(inst.id, by_inst_id=True)
         else:
-            inst = self.bot.cache.instance(ctx.author, ctx.guild.id).update()
+            inst = await self.bot.cache.snapshot(ctx.author, ctx.guild.id)
         
         embed = self.create_server_embed(inst)
         await ctx.send(embed=embed)
     
     @commands.command(description="View statuses of all accessible servers", usage="r!servers")
     async def servers(self, ctx):
-        instances = get_available_instances(ctx.author, ctx.guild.id)
-        instances = [self.bot.cache.instance(inst.id, by_inst_id=True).update() for inst, perms in instances if perms.public]
+        instances = [inst for inst, perms in get_available_instances(ctx.author, ctx.guild.id) if perms.public]
+        await asyncio.gather(*[self.bot.cache.activate(inst.id) for inst in instances])
+        instances = await asyncio.gather(*[self.bot.cache.snapshot(inst.id, by_inst_id=True) for inst in instances])
         for inst in instances:      
             embed = self.create_server_embed(inst)
             await ctx.send(embed=embed)
@@ -72,7 +75,7 @@ class public(commands.Cog):
         if team_id not in [1, 2]:
             raise commands.BadArgument('team_id needs to be either 1 or 2')
         
-        inst = self.bot.cache.instance(ctx.author, ctx.guild.id).update()
+        inst = await self.bot.cache.snapshot(ctx.author, ctx.guild.id)
 
         def build_embed(team_id):
             if team_id == 1: team = inst.team1
@@ -138,7 +141,7 @@ class public(commands.Cog):
         if team_id not in [1, 2]:
             raise commands.BadArgument('team_id needs to be either 1 or 2')
         
-        inst = self.bot.cache.instance(ctx.author, ctx.guild.id).update()
+        inst = await self.bot.cache.snapshot(ctx.author, ctx.guild.id)
         if team_id == 1: team = inst.team1
         elif team_id == 2: team = inst.team2
         squad = None
@@ -172,6 +175,12 @@ class public(commands.Cog):
     async def player(self, ctx, *, name_or_id):
         player = self.bot.cache.instance(ctx.author, ctx.guild.id).get_player(name_or_id, related_names=True)
         if not player:
+            # They might be playing on one of the other servers
+            instance_ids = [inst.id for inst, perms in get_available_instances(ctx.author, ctx.guild.id) if perms.players]
+            results = self.bot.cache.find_players(name_or_id, instance_ids, limit=1)
+            if results:
+                (score, inst, player) = results[0]
+                raise commands.BadArgument(f"Couldn't find a player with this name or ID on this server, but {player.name} is online on {Instance(inst.id).name}")
             raise commands.BadArgument("Couldn't find a player with this name or ID currently online")
         
         inst_id = self.bot.cache._get_selected_instance(ctx.author, ctx.channel.id)
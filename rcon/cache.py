@@ -1,7 +1,10 @@
-import re
+import asyncio
+import functools
+import sys
+import time
+from array import array
 from datetime import datetime, timedelta
-from utils import get_player_input_type
-import difflib
+from utils import get_player_input_type, Config
 import os
 from pathlib import Path
 
@@ -11,10 +14,19 @@ import discord
 from discord.ext.commands import BadArgument
 
 from rcon import instances, logs, permissions
-from rcon.commands import Rcon
+from rcon.events import (
+    EventBus, PlayerJoined, PlayerLeft, TeamChanged, SquadCreated, SquadDisbanded, MapChanged, Teamkill, ChatMessage
+)
+from rcon.commands import Rcon, CACHE_TTL
+from rcon.pool import KEEPALIVE_INTERVAL
 from rcon.connection import RconAuthError
 from rcon.query import SourceQuery
+from rcon.supervisor import Supervisor
+from rcon.recorder import WireRecorder, capture_path
 from rcon.map_rotation import MapRotation, Map
+from rcon.parsers import ResponseParser, CHAT_RE, TEAMKILL_RE
+from rcon.roster import Roster, SIMILAR_NAME_CUTOFF
+from rcon.polling import PollScheduler
 
 DETACHMENT_PLAYER_LIMITS = {
     "Command": 2,
@@ -131,25 +143,208 @@ DIVISION_TYPES = {
     "The Peoples' Front Militia": "Light Infantry"
 }
 
+# Seconds that the bot waits for all instances to connect on startup. Instances that aren't connected by then are
+# retried in the background.
+STARTUP_DEADLINE = 15
+# Seconds without commands after which an instance that isn't monitored is disconnected
+IDLE_SUSPEND_AFTER = 60 * 60
+# Seconds between checks for idle instances
+IDLE_CHECK_INTERVAL = 60
+# Config values that need a live connection to the server, for logs or chat alerts
+MONITORING_CONFIG_KEYS = ("chat_trigger_channel_id", "channel_log_chat", "channel_log_joins",
+                          "channel_log_match", "channel_log_rcon", "channel_log_teamkills")
+# Seconds that the info of an instance is served as is by Cache.snapshot. Older info is still served, but refreshed in
+# the background.
+SNAPSHOT_MAX_AGE = 10
+
     
 class Cache():
     def __init__(self):
         self.instances = {}
+        self.selected_instance = {}
+        self.chat_listeners = []
+        # Typed events of all instances, see rcon.events
+        self.events = EventBus()
+        self.supervisors = {}
+        # Instances that are disconnected until they are used again
+        self.suspended = set()
+        # Time each instance was last used by a command
+        self.last_used = {}
+        self.polling = PollScheduler(self.last_used)
+        self._activating = {}
+        self._idle_checker = None
+        try: self.snapshot_max_age = float(Config().get('snapshot_max_age', SNAPSHOT_MAX_AGE))
+        except ValueError: self.snapshot_max_age = SNAPSHOT_MAX_AGE
+
+    async def connect_instances(self, deadline=STARTUP_DEADLINE):
+        """Connect all monitored instances at once, waiting at most the given amount of seconds.
+        Instances that fail or are still connecting by then are retried in the background.
+        All other instances are connected once they are used.
+
+        Every instance is known to the cache right away, and is available as soon as it is connected,
+        so this doesn't need to be awaited before the bot starts."""
+        if self._idle_checker is None:
+            self._idle_checker = asyncio.create_task(self._suspend_idle_instances())
+        tasks = {}
         for instance in instances.get_instances():
-            self._connect_instance(instance)
+            self.instances.setdefault(instance.id, None)
+            if self._is_monitored(instance):
+                tasks[asyncio.create_task(self._connect_instance(instance))] = instance
+            else:
+                self.suspended.add(instance.id)
+        if not tasks:
+            return
+        start = time.monotonic()
+        done, pending = await asyncio.wait(tasks, timeout=deadline)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.wait(pending)
+        for task in pending:
+            instance = tasks[task]
+            self.instances[instance.id] = None
+            self._get_supervisor(instance.id).mark_down(asyncio.TimeoutError('Did not connect within %ss' % deadline))
+        connected = len([inst for inst in self.instances.values() if inst])
+        logging.info('Connected %s/%s instances in %.1fs', connected, len(tasks), time.monotonic() - start)
 
-        self.selected_instance = {}
+    def _is_monitored(self, instance):
+        return any(instance.config.get(key) for key in MONITORING_CONFIG_KEYS)
+
+    def touch(self, instance_id):
+        """Mark an instance as used, postponing its suspension"""
+        self.last_used[instance_id] = time.monotonic()
 
-    def _connect_instance(self, instance, return_exception=False):
+    async def activate(self, instance_id):
+        """Connect a suspended instance. Concurrent calls wait for the same attempt."""
+        self.touch(instance_id)
+        if instance_id not in self.suspended:
+            return
+        task = self._activating.get(instance_id)
+        if task is None:
+            logging.info('Inst %s: Activating suspended instance', instance_id)
+            task = self._activating[instance_id] = asyncio.ensure_future(self._connect_instance(instances.Instance(instance_id)))
+            task.add_done_callback(lambda task: self._activating.pop(instance_id, None))
+        await asyncio.shield(task)
+
+    async def activate_selected(self, user, guild_id=None):
+        """Activate the instance the user has selected, if any"""
+        try: instance_id = self._get_selected_instance(user, guild_id)
+        except Exception: return
+        if instance_id in self.instances:
+            await self.activate(instance_id)
+
+    async def suspend(self, instance_id):
+        """Disconnect an instance until it is used again"""
+        logging.info('Inst %s: Suspending idle instance', instance_id)
+        await self._disconnect_instance(instance_id)
+        self.suspended.add(instance_id)
+
+    async def _suspend_idle_instances(self):
+        while True:
+            await asyncio.sleep(IDLE_CHECK_INTERVAL)
+            now = time.monotonic()
+            for instance_id, inst in list(self.instances.items()):
+                if instance_id in self.suspended or instance_id in self._activating:
+                    continue
+                if now - self.last_used.get(instance_id, float('-inf')) < IDLE_SUSPEND_AFTER:
+                    continue
+                try:
+                    if self._is_monitored(instances.Instance(instance_id)):
+                        continue
+                    await self.suspend(instance_id)
+                except Exception as e:
+                    logging.error('Inst %s: Failed to suspend: %s: %s', instance_id, e.__class__.__name__, e)
+
+    async def _connect_instance(self, instance, return_exception=False):
+        # Connecting isn't using, else every instance connected on startup or by its supervisor would count as active
+        self.suspended.discard(instance.id)
+        supervisor = self._get_supervisor(instance.id)
         try:
-            rcon = Rcon(instance.address, instance.port, instance.password, instance_id=instance.id)
+            await self._open_instance(instance)
         except Exception as e:
-            self.instances[instance.id] = None
+            # Keep retrying in the background
+            supervisor.mark_down(e)
             if return_exception: return e 
         else:
-            self.instances[instance.id] = ServerInstance(instance.id, rcon)
+            supervisor.mark_up()
         return self.instances[instance.id]
 
+    async def _open_instance(self, instance):
+        """Connect to the server of an instance. An instance that is being reconnected keeps
+        its roster and match state, so that only what changed during the outage is reported."""
+        inst = self.instances.get(instance.id)
+        if inst:
+            await inst.rcon.close()
+        # Record all RCON traffic when a capture directory is configured
+        config = Config()
+        capture_dir = config.get('rcon_capture_dir')
+        recorder = None
+        if capture_dir:
+            os.makedirs(capture_dir, exist_ok=True)
+            recorder = WireRecorder(capture_path(capture_dir, instance.id))
+        try: cache_ttl = float(config.get('rcon_cache_ttl', CACHE_TTL))
+        except ValueError: cache_ttl = CACHE_TTL
+        try: keepalive_interval = float(config.get('rcon_keepalive_interval', KEEPALIVE_INTERVAL)) or None
+        except ValueError: keepalive_interval = KEEPALIVE_INTERVAL
+        rcon = Rcon(instance.address, instance.port, instance.password, instance_id=instance.id, pipelined=True, recorder=recorder, cache_ttl=cache_ttl, keepalive_interval=keepalive_interval)
+        rcon.subscribe_chat(functools.partial(self._dispatch_chat, instance.id))
+        try:
+            await rcon.connect()
+            if inst:
+                inst.rcon = rcon
+                await inst.update()
+            else:
+                inst = await ServerInstance.create(instance.id, rcon, self.events)
+        except:
+            await rcon.close()
+            raise
+        # Only start reporting failures once connected, so that they don't count towards the attempt to reconnect
+        rcon.breaker = self._get_supervisor(instance.id).breaker
+        self.instances[instance.id] = inst
+        return inst
+
+    async def _reconnect_instance(self, instance_id):
+        await self._open_instance(instances.Instance(instance_id))
+
+    async def _close_instance(self, instance_id):
+        inst = self.instances.get(instance_id)
+        if inst:
+            await inst.rcon.close()
+        self.instances[instance_id] = None
+
+    async def _disconnect_instance(self, instance_id):
+        supervisor = self.supervisors.pop(instance_id, None)
+        if supervisor:
+            supervisor.stop()
+        await self._close_instance(instance_id)
+
+    def _get_supervisor(self, instance_id):
+        supervisor = self.supervisors.get(instance_id)
+        if not supervisor:
+            supervisor = Supervisor(instance_id, functools.partial(self._reconnect_instance, instance_id))
+            self.supervisors[instance_id] = supervisor
+        return supervisor
+
+    def add_chat_listener(self, callback):
+        """Call the given coroutine function with (instance_id, message) for each chat message of any instance."""
+        if callback not in self.chat_listeners:
+            self.chat_listeners.append(callback)
+
+    def remove_chat_listener(self, callback):
+        if callback in self.chat_listeners:
+            self.chat_listeners.remove(callback)
+
+    async def _dispatch_chat(self, instance_id, message):
+        self.polling.record_chat(instance_id)
+        for callback in list(self.chat_listeners):
+            try:
+                await callback(instance_id, message)
+            except Exception as e:
+                logging.exception('Inst %s: Unhandled exception whilst handling chat message: %s: %s', instance_id, e.__class__.__name__, e)
+        inst = self.instances.get(instance_id)
+        if inst:
+            inst.handle_chat(message)
+
     def _get_user_id(self, user):
         if isinstance(user, (discord.User, discord.Member)):
             user = user.id
@@ -190,31 +385,62 @@ class Cache():
 
         if instance_id in self.instances:
             inst = self.instances[instance_id]
+            supervisor = self.supervisors.get(instance_id)
+            if supervisor and not supervisor.breaker.is_closed:
+                raise ServerUnreachable("%s (%s)" % (supervisor, supervisor.breaker.last_error))
             if inst == None:
                 raise CacheNotFound("No cached data found for instance ID %s" % instance_id)
-            elif inst.rcon._sock == None:
+            elif not inst.rcon.is_connected:
                 inst = None
                 raise CacheNotFound("Socket disconnected, please reconnect using r!inst connect")
             return inst
         else:
             raise BadArgument("No instance cached with ID %s" % instance_id)
 
-    def update_all(self):
-        for i, inst in self.instances:
-            inst.update()
-            self.instances[i] = inst
+    async def snapshot(self, user, guild=None, by_inst_id=False, force=False):
+        """Like instance(), but makes sure the info of the instance isn't outdated.
+
+        Parameters:
+            force (bool) wait for the info to be updated, for commands that act on it
+
+        Info older than the snapshot_max_age config is refreshed in the
+        background, while the instance is returned right away.
+        """
+        inst = self.instance(user, guild, by_inst_id)
+        return await inst.refresh(self.snapshot_max_age, force)
 
-    def delete_instance(self, instance_id):
+    def find_players(self, query, instance_ids=None, limit=5, cutoff=SIMILAR_NAME_CUTOFF):
+        """Search the names of the players on all connected instances, or the given ones.
+
+        Returns a list of (score, ServerInstance, OnlinePlayer) tuples, best match first
+        """
+        results = []
+        for instance_id, inst in self.instances.items():
+            if inst and (instance_ids is None or instance_id in instance_ids):
+                results += [(score, inst, player) for score, player in inst.roster.names.search(query, limit, cutoff)]
+        results.sort(key=lambda result: result[0], reverse=True)
+        return results[:limit]
+
+    async def update_all(self):
+        for inst in self.instances.values():
+            if inst and inst.rcon.is_available:
+                await inst.update()
+
+    async def delete_instance(self, instance_id):
         if instance_id in self.instances:
+            await self._disconnect_instance(instance_id)
             del self.instances[instance_id]
+        self.polling.forget(instance_id)
         instances.Instance(instance_id).delete()
 
 class ServerInstance(MapRotation):
-    def __init__(self, instance_id, rcon):
+    def __init__(self, instance_id, rcon, events=None):
         logging.info('Registring new instance with ID %s', instance_id)
         
         self.id = instance_id
         self.rcon = rcon
+        self.parser = ResponseParser(instance_id)
+        self.events = events if events is not None else EventBus()
 
         self.map_rotation = None
         self.current_map = None
@@ -222,28 +448,39 @@ class ServerInstance(MapRotation):
         self.last_map_change = None
         self.is_transitioning = False
 
-        self.players = []
-        self.ids = []
+        self.roster = Roster()
 
         self.team1 = None
         self.team2 = None
 
-        self.update()
+        self.last_updated = None
+        self._updating = None
+        # Whether the running update bypasses the response cache of the Rcon
+        self._updating_fresh = False
+
+    @classmethod
+    async def create(cls, instance_id, rcon, events=None):
+        inst = cls(instance_id, rcon, events)
+        await inst.update()
 
-        path = Path(f'rotations/{str(self.id)}.json')
-        if os.path.exists(path) and instances.Instance(self.id).uses_custom_rotation:
-            try: self.import_rotation(fp=path)
+        path = Path(f'rotations/{str(inst.id)}.json')
+        if os.path.exists(path) and instances.Instance(inst.id).uses_custom_rotation:
+            try: await inst.import_rotation(fp=path)
             except: pass
+        return inst
+
+    @property
+    def players(self):
+        return self.roster.players
+
+    @property
+    def ids(self):
+        return list(self.roster.by_steam_id)
 
     def select(self, steam_id: int = None, name: str = None, team_id: int = None, squad_id: int = None, player_id: int = None, min_online_time: int = None, max_online_time: int = None):
-        pool = self.players
-        if pool and steam_id != None: pool = [player for player in pool if player.steam_id == steam_id]
-        if pool and name != None: pool = [player for player in pool if player.name == name]
-        if pool and team_id != None: pool = [player for player in pool if player.team_id == team_id]
-        if pool and squad_id != None: pool = [player for player in pool if player.squad_id == squad_id]
-        if pool and player_id != None: pool = [player for player in pool if player.player_id == player_id]
-        if pool and min_online_time != None: pool = [player for player in pool if player.min_online_time >= player.online_time()]
-        if pool and max_online_time != None: pool = [player for player in pool if player.max_online_time <= player.online_time()]
+        pool = self.roster.select(steam_id=steam_id, name=name, team_id=team_id, squad_id=squad_id, player_id=player_id)
+        if pool and min_online_time != None: pool = [player for player in pool if player.online_time() >= min_online_time]
+        if pool and max_online_time != None: pool = [player for player in pool if player.online_time() <= max_online_time]
         return pool
 
     def get_player(self, name_or_id: str, multi=False, related_names=False):
@@ -251,9 +488,7 @@ class ServerInstance(MapRotation):
         players = self.select(name=str(name_or_id))
 
         if related_names:
-            all_names = [player.name for player in self.players]
-            player_names = difflib.get_close_matches(name_or_id, all_names, cutoff=0.6, n=1)
-            players = [self.select(name=name)[0] for name in player_names]
+            players = [player for score, player in self.roster.names.search(str(name_or_id), limit=1, cutoff=SIMILAR_NAME_CUTOFF)]
 
         if input_type == "steam64id":
             players = self.select(steam_id=int(name_or_id)) + players
@@ -266,32 +501,76 @@ class ServerInstance(MapRotation):
             if players: player = players[0]
             return player
 
-    def update(self):
+    async def update(self):
         try:
             logging.info('Inst %s: Updating...', self.id)
-            self._parse_maps()
+            # Request everything at once, so that the commands can be pipelined.
+            # The player list is the largest response, so it is parsed while it comes in.
+            current_map, next_map, players, squads = await asyncio.gather(
+                self.rcon.show_current_map(), self.rcon.show_next_map(),
+                self.parser.stream_players(self.rcon.stream_lines("ListPlayers")), self.rcon.list_squads(),
+                return_exceptions=True
+            )
+            for res in (current_map, next_map):
+                if isinstance(res, Exception): raise res
+            await self._parse_maps(current_map, next_map)
             if not self.is_transitioning:
-                self._parse_players()
-                self._parse_squads()
+                for res in (players, squads):
+                    if isinstance(res, Exception): raise res
+                self._parse_players(players[0])
+                self._parse_squads(squads)
                 if self.map_rotation and self.next_map:
-                    self.validate_next_map()
+                    await self.validate_next_map()
             else:
                 logging.info('Inst %s: Map is transitioning', self.id)
             self.last_updated = datetime.now()
         except RconAuthError as e:
-            if (datetime.now() - timedelta(minutes=30)) > self.last_updated:
+            if self.last_updated and (datetime.now() - timedelta(minutes=30)) > self.last_updated:
                 logging.error('Inst %s: Failed to connect for 5 minutes, disconnecting...', self.id)
                 self = None
             raise ConnectionLost("Lost connection to RCON: " + str(e))
         
         return self
 
-    def _parse_players(self):
-        res = self.rcon.list_players()
+    async def refresh(self, max_age=SNAPSHOT_MAX_AGE, force=False):
+        """Return this instance, updating it first if forced or if it was never updated.
+        If its info is older than max_age seconds, it is updated in the background instead.
+        Forced updates don't use cached responses, so that commands can act on them."""
+        if force:
+            return await self._fresh_update()
+        if self.last_updated is None:
+            return await asyncio.shield(self._start_update())
+        if (datetime.now() - self.last_updated).total_seconds() > max_age:
+            self._start_update()
+        return self
 
+    async def _fresh_update(self):
+        """Update the instance with responses that weren't cached before this call"""
+        while self._updating is not None and not self._updating_fresh:
+            # The running update may be using cached responses, wait for it to finish first
+            await asyncio.wait([self._updating])
+        if self._updating is None:
+            self.rcon.invalidate_cache()
+        return await asyncio.shield(self._start_update(fresh=True))
+
+    def _start_update(self, fresh=False):
+        """Return a task that updates the instance, reusing the update that is already running"""
+        if self._updating is None:
+            self._updating_fresh = fresh
+            self._updating = asyncio.ensure_future(self.update())
+            self._updating.add_done_callback(self._update_done)
+        return self._updating
+
+    def _update_done(self, task):
+        self._updating = None
+        if not task.cancelled() and task.exception():
+            e = task.exception()
+            logging.warning('Inst %s: Failed to refresh: %s: %s', self.id, e.__class__.__name__, e)
+
+    def _parse_players(self, records):
         """
         We need to turn the data given by the server into a more feasible structure.
-        This is what the result from the server looks like:
+        The PlayerRecords are parsed from a response that looks like this:
 
         ----- Active Players -----
         ID: 0 | SteamID: 76561199023367826 | Name: (WTH) Heidegger | Team ID: 1 | Squad ID: N/A
@@ -303,58 +582,33 @@ class ServerInstance(MapRotation):
         Note that Team ID can be N/A during map change
         """
 
-        players = []
-        disconnected = []
-        
-        lines = res.split("\n")
-        for line in lines:
-            if not line.strip() or len(line) < 20: continue # Line is empty
-            if "----- Active Players -----" in line: continue # Skip this line
-            elif "----- Recently Disconnected Players [Max of 15] -----" in line: break # Stop parsing
-
-            else: # Parse line
-                try:
-                    re_res = re.search(r'ID: (\d+) \| SteamID: (\d{17}|N/A) \| Name: (.*) \| Team ID: (\d+|N/A) \| Squad ID: (\d+|N/A)( \| Is Leader: (True|False) | Role: (.*))?', line).groups()
-                except: # Unable to fetch all data, skip this line
-                    logging.error('Inst %s: Could not parse player line: %s', self.id, line)
-                    pass
-                else:
-                    if re_res[1] == "N/A":
-                        continue
-                    data = {}
-                    data['player_id'] = int(re_res[0])
-                    data['steam_id'] = int(re_res[1])
-                    data['name'] = str(re_res[2])
-                    try: data['team_id'] = int(re_res[3].strip())
-                    except: data['team_id'] = 0
-                    try: data['squad_id'] = int(re_res[4].strip())
-                    except: data['squad_id'] = -1
-
-                    if re_res[5]: # Is Squad v2.12
-                        data['role'] = re_res[7]
-
-                    player = OnlinePlayer(**data)
-                    players.append(player)
-        ids = [player.steam_id for player in players]
-
         """
-        Now that we've added all online players to a nice dict, lets compare them with what's cached.
-        Let's start off by getting a list of steam64id's that connected or disconnected. Then, we
-        update what's cached and do whatever else we like with this information.
+        Players that are already in the roster are updated in place, so that they keep their
+        online_since. Whoever is new connected, and whoever is missing disconnected.
         """
-        
-        connected = [player for player in players if int(player) not in self.ids]
-        disconnected = [player for player in self.players if int(player) not in ids]
-        if connected: logging.info('Inst %s: Connected: %s', self.id, ', '.join([player.name for player in connected]))
-        if connected: logging.info('Inst %s: Disonnected: %s', self.id, ', '.join([player.name for player in disconnected]))
 
-        # Update the cache
-        for i, player in enumerate(players):
-            old_player = self.select(steam_id=player.steam_id)
-            if old_player:
-                players[i].online_since = old_player[0].online_since
-        self.players = players
-        self.ids = ids
+        connected = []
+        ids = set()
+        for record in records:
+            ids.add(record.steam_id)
+            team_id = record.team_id if record.team_id is not None else 0
+            squad_id = record.squad_id if record.squad_id is not None else -1
+            player = self.roster.get(record.steam_id)
+            if player:
+                if player.team_id != team_id and player.team_id and team_id:
+                    self.events.emit(TeamChanged(self.id, player, player.team_id, team_id))
+                player.update(team_id=team_id, squad_id=squad_id, player_id=record.player_id,
+                              role=sys.intern(record.role) if record.role else None)
+                self.roster.rename(player, sys.intern(record.name))
+            else:
+                player = OnlinePlayer(steam_id=record.steam_id, name=sys.intern(record.name), team_id=team_id, squad_id=squad_id,
+                                      player_id=record.player_id, role=sys.intern(record.role) if record.role else "Unknown")
+                self.roster.add(player)
+                connected.append(player)
+        disconnected = self.roster.retain(ids)
+
+        if connected: logging.info('Inst %s: Connected: %s', self.id, ', '.join([player.name for player in connected]))
+        if disconnected: logging.info('Inst %s: Disconnected: %s', self.id, ', '.join([player.name for player in disconnected]))
 
         # Log players connecting and disconnecting
         messages = []
@@ -364,11 +618,12 @@ class ServerInstance(MapRotation):
             messages.append(f'{player.name} disconnected after {str(player.online_time())} minutes')
         if messages:
             logs.ServerLogs(self.id).add('joins', messages)
+        for player in connected:
+            self.events.emit(PlayerJoined(self.id, player))
+        for player in disconnected:
+            self.events.emit(PlayerLeft(self.id, player, player.online_time()))
 
-    def _parse_maps(self):
-        current_map = self.rcon.show_current_map()
-        next_map = self.rcon.show_next_map()
-        
+    async def _parse_maps(self, current_map, next_map):
         """
         Old response format example:
         'Current map is Logar Valley Skirmish v1, Next map is Gorodok AAS v2'
@@ -378,18 +633,9 @@ class ServerInstance(MapRotation):
         'Next level is Kohat, layer is Kohat RAAS v4'
         """
 
-        try:
-            res = re.match(r"Current map is (.+), Next map is (.+)", next_map).groups()
-        except:
-            # Try to read the current map
-            try: current_map = Map(re.match(r"Current level is (.+), layer is (.+)", current_map).group(2))
-            except: current_map = self.current_map
-            # Try to read the upcoming map
-            try: next_map = Map(re.match(r"Next level is (.+), layer is (.+)", next_map).group(2))
-            except: next_map = self.next_map
-        else:
-            current_map = Map(res[0])
-            next_map = Map(res[1])
+        (current_layer, next_layer) = self.parser.maps(current_map, next_map)
+        current_map = Map(current_layer) if current_layer else self.current_map
+        next_map = Map(next_layer) if next_layer else self.next_map
 
         logging.info('Inst %s: Current map is %s, next map is %s', self.id, current_map, next_map)
 
@@ -401,17 +647,20 @@ class ServerInstance(MapRotation):
         if self.current_map and current_map != self.current_map: # Map has changed
             self.is_transitioning = True
             message = f"Map changed from {self.current_map} to {current_map}."
+            duration = None
             if self.last_map_change:
-                message += f" The match lasted {str(int((datetime.now() - self.last_map_change).total_seconds() / 60))} minutes."
+                duration = int((datetime.now() - self.last_map_change).total_seconds() / 60)
+                message += f" The match lasted {str(duration)} minutes."
             else:
                 message += " Match duration is unknown."
             logging.info('Inst %s: %s', self.id, message)
             logs.ServerLogs(self.id).add('match', message)
             self.last_map_change = datetime.now()
+            self.events.emit(MapChanged(self.id, self.current_map, current_map, duration, self.last_map_change))
 
             if self.map_rotation:
                 try:
-                    next_map = self.map_changed(current_map)
+                    next_map = await self.map_changed(current_map)
                     logging.info('Inst %s: MAPROT: Next map will be %s', self.id, next_map)
                 except Exception as e:
                     logging.error('Inst %s: MAPROT: An error was raised while looking for next map: %s: %s', self.id, e.__class__.__name__, e)
@@ -419,9 +668,7 @@ class ServerInstance(MapRotation):
         if self.current_map != current_map: self.current_map = current_map
         if self.next_map != next_map: self.next_map = next_map
         
-    def _parse_squads(self):
-        res = self.rcon.list_squads()
-
+    def _parse_squads(self, res):
         """
         This is what the result from the server looks like:
 
@@ -443,43 +690,62 @@ class ServerInstance(MapRotation):
         Command, Infantry, HEAVY MG, RECON, Artillery
         """
 
-        lines = res.split("\n")
-        team_id = None
-
-        for line in lines:
-            if line.startswith("Team ID"):
-                try: re_res = re.search(r'Team ID: ([12]) \((.*)\)', line).groups()
-                except: continue
-                team_id = int(re_res[0])
-                team_faction = str(re_res[1])
-                # TODO: Currently the team info gets replaced without comparing old to new.
-                if team_id == 1: self.team1 = Team(team_id, team_faction)
-                elif team_id == 2: self.team2 = Team(team_id, team_faction)
-                
-            elif line.startswith("ID") and team_id:
-                try:
-                    re_res = re.search(r'ID: (\d*) \| Name: (.*) \| Size: (\d*) \| Locked: (True|False)( \| Creator Name: (.*) \| Creator Steam ID: (\d{17}))?', line).groups()
-                except:
-                    logging.error('Inst %s: Failed to parse squad line: %s', self.id, line)
-                else:
-                    data = dict(
-                        squad_id = int(re_res[0]),
-                        name = str(re_res[1]),
-                        #size = int(re_res[2]),
-                        player_ids = [player.steam_id for player in self.select(team_id=team_id, squad_id=int(re_res[0]))],
-                        locked = True if re_res[3] == "True" else False,
-                        creator_name = None,
-                        creator_steam_id = None,
-                    )
-                    if re_res[4]:
-                        data['creator_name'] = str(re_res[5])
-                        data['creator_steam_id'] = int(re_res[6])
-
-                    if team_id == 1: self.team1.set_squad(**data)
-                    elif team_id == 2: self.team2.set_squad(**data)
-            
-        self.team1.unassigned = [player.steam_id for player in self.select(team_id=1, squad_id=-1)]
-        self.team2.unassigned = [player.steam_id for player in self.select(team_id=2, squad_id=-1)]
+        old_squads = self._squads_by_key()
+        for team in self.parser.squads(res):
+            current = self.team1 if team.team_id == 1 else self.team2
+            # Teams are updated in place, unless the factions changed along with the map
+            if not current or not current.is_faction(team.faction):
+                current = Team(team.team_id, team.faction)
+                if team.team_id == 1: self.team1 = current
+                else: self.team2 = current
+            for squad in team.squads:
+                current.set_squad(
+                    squad_id = squad.squad_id,
+                    name = sys.intern(squad.name),
+                    player_ids = array('Q', [player.steam_id for player in self.select(team_id=team.team_id, squad_id=squad.squad_id)]),
+                    locked = squad.locked,
+                    creator_name = sys.intern(squad.creator_name) if squad.creator_name else None,
+                    creator_steam_id = squad.creator_steam_id,
+                )
+            current.retain_squads({squad.squad_id for squad in team.squads})
+
+        self.team1.unassigned = array('Q', [player.steam_id for player in self.select(team_id=1, squad_id=-1)])
+        self.team2.unassigned = array('Q', [player.steam_id for player in self.select(team_id=2, squad_id=-1)])
+
+        # Squads are only compared once they are known, else every squad would be created on startup
+        if old_squads is not None:
+            new_squads = self._squads_by_key()
+            for key, squad in new_squads.items():
+                if key not in old_squads:
+                    self.events.emit(SquadCreated(self.id, key[0], squad))
+            for key, squad in old_squads.items():
+                if key not in new_squads:
+                    self.events.emit(SquadDisbanded(self.id, key[0], squad))
+
+    def _squads_by_key(self):
+        """Return a dict of (team ID, squad ID, name, creator name) -> Squad, or None if the teams aren't known yet"""
+        if not self.team1 or not self.team2:
+            return None
+        return {(team.id, squad.id, squad.name, squad.creator_name): squad
+                for team in (self.team1, self.team2) for squad in team.squads}
+
+    def handle_chat(self, message):
+        """Emit a ChatMessage or Teamkill event for a chat message received from the server.
+
+        Parameters:
+            message (str) the message, ex. '[ChatAll] [SteamID:12345678901234567] [FP] Clan Member 1 : Hello world!'
+        """
+        match = TEAMKILL_RE.match(message)
+        if match:
+            (attacker_name, victim_name) = match.groups()
+            self.events.emit(Teamkill(self.id, attacker_name, victim_name, self.get_player(attacker_name),
+                                      self.get_player(victim_name), datetime.now()))
+            return
+        match = CHAT_RE.search(message)
+        if match:
+            (channel, steam_id, name, text) = match.groups()
+            steam_id = int(steam_id)
+            self.events.emit(ChatMessage(self.id, channel, steam_id, name, text, self.roster.get(steam_id), datetime.now()))
 
     def _get_player_score(self):
         # Need to know the query port...
@@ -489,11 +755,14 @@ class ServerInstance(MapRotation):
         if not isinstance(player, OnlinePlayer):
             player = self.get_player(player)
         if not player: return
-        self.players.remove(player)
-        self.ids.remove(player.steam_id)
+        self.roster.remove(player)
         logs.ServerLogs(self.id).add('joins', f'{player.name} was disconnected after {str(player.online_time())} minutes')
+        self.events.emit(PlayerLeft(self.id, player, player.online_time()))
 
 class OnlinePlayer():
+    # Without a __dict__ per player, the roster of a full server takes up a fraction of the memory
+    __slots__ = ('steam_id', 'name', 'team_id', 'squad_id', 'player_id', 'online_since', 'score', 'role')
+
     def __init__(self, steam_id: int, name: str, team_id: int, squad_id: int, player_id: int, online_since: datetime = None, score: int = 0, role: str = "Unknown"):
         self.steam_id = steam_id
         self.name = name
@@ -504,9 +773,11 @@ class OnlinePlayer():
         self.score = score
         self.role = role
 
-    def update(self, team_id: int = None, squad_id: int = None, score: int = None, role: str = None):
+    def update(self, team_id: int = None, squad_id: int = None, player_id: int = None, score: int = None, role: str = None):
+        # Names are indexed by the roster, change those through Roster.rename
         if team_id is not None: self.team_id = team_id
         if squad_id is not None: self.squad_id = squad_id
+        if player_id is not None: self.player_id = player_id
         if score is not None: self.score = score
         if role is not None: self.role = role
         return self
@@ -521,14 +792,18 @@ class OnlinePlayer():
         return int((datetime.now() - self.online_since).total_seconds() / 60)
 
 class Team():
+    __slots__ = ('id', 'faction', 'faction_short', 'division', 'division_type', 'squads', 'unassigned')
+
     def __init__(self, id: int, faction: str):
+        faction = sys.intern(faction)
         self.id = id
         self.faction = DIVISION_FACTIONS.get(faction, faction)
         self.faction_short = SHORT_TEAM_NAMES.get(self.faction, self.faction)
         self.division = faction if faction != self.faction else None
         self.division_type = DIVISION_TYPES.get(self.division, None)
         self.squads = []
-        self.unassigned = []
+        # Steam IDs of the players that aren't in a squad
+        self.unassigned = array('Q')
 
     def __len__(self):
         return sum([len(squad) for squad in self.squads]) + len(self.unassigned)
@@ -549,8 +824,7 @@ class Team():
             squad = None
         
         if squad: # There is a squad with this ID
-            squad = squad[0]
-            if squad.name != name or squad.creator_steam_id != creator_steam_id: # The previous squad was replaced
+            if squad.name != name or (creator_steam_id and squad.creator != creator_steam_id): # The previous squad was replaced
                 self.squads[i] = Squad(squad_id, name, player_ids, locked, creator_name, creator_steam_id)
             else: # This squad already existed before
                 self.squads[i].update(player_ids, locked)
@@ -558,13 +832,24 @@ class Team():
             squad = Squad(squad_id, name, player_ids, locked, creator_name, creator_steam_id)
             self.squads.append(squad)
 
+    def is_faction(self, faction: str):
+        """Whether the team is the given faction or division, as named by ListSquads"""
+        return (self.division or self.faction) == faction
+
+    def retain_squads(self, squad_ids):
+        """Remove the squads whose ID isn't in the given set"""
+        self.squads = [squad for squad in self.squads if squad.id in squad_ids]
+
 class Squad():
+    __slots__ = ('id', 'name', 'player_ids', 'locked', 'creator', 'creator_name')
+
     def __init__(self, id: int, name: str, player_ids: list, locked: bool, creator_name: str = None, creator_steam_id: str = None):
         self.id = id
         self.name = name
-        self.player_ids = player_ids
+        # Steam IDs of the members
+        self.player_ids = array('Q', player_ids)
         self.locked = locked
-        self.creator = creator_steam_id if creator_steam_id else self.player_ids[0]
+        self.creator = creator_steam_id if creator_steam_id else (self.player_ids[0] if self.player_ids else None)
         self.creator_name = creator_name
         """
         self.type = None
@@ -591,7 +876,7 @@ class Squad():
     def update(self, player_ids: list, locked: bool = None):
         old_player_ids = self.player_ids
 
-        self.player_ids = player_ids
+        self.player_ids = array('Q', player_ids)
         """self._update_type()"""
 
         if locked != None:
@@ -615,4 +900,7 @@ class ConnectionLost(Exception):
     pass
 class CacheNotFound(Exception):
     """Raised when no cache is found, usually when RCON is disconnected"""
+    pass
+class ServerUnreachable(CacheNotFound):
+    """Raised when the server of an instance is unreachable and is being reconnected in the background"""
     pass 
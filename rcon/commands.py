@@ -1,150 +1,276 @@
-from rcon.connection import RconConnection, RconError
-from ast import literal_eval
+import asyncio
+import time
+
+from rcon.connection import RconError
+from rcon.pool import RconPool
+from rcon.scheduler import PRIORITY_INTERACTIVE, PRIORITY_CONTROL, PRIORITY_POLLING, PRIORITY_BULK
 
 import logging
 
-class Rcon(RconConnection):
 
-    def _res_to_str(self, res):
-        res = literal_eval(res)
-        #print(len(res))
-        if not res: # An empty list was received
+# Seconds that the responses of read-only commands are reused for
+CACHE_TTL = 5
+# Commands whose responses are cached
+CACHED_COMMANDS = ("ListPlayers", "ListSquads", "ShowCurrentMap", "ShowNextMap")
+# Commands that don't change anything on the server, and thus don't invalidate the cache
+READ_ONLY_COMMANDS = CACHED_COMMANDS + ("AdminListDisconnectedPlayers", "ShowServerInfo", "AdminWarn", "AdminWarnById", "AdminBroadcast")
+# Priority class per command. Everything else is considered an interactive moderation action.
+COMMAND_PRIORITIES = {
+    "ListPlayers": PRIORITY_POLLING,
+    "ListSquads": PRIORITY_POLLING,
+    "ShowCurrentMap": PRIORITY_POLLING,
+    "ShowNextMap": PRIORITY_POLLING,
+    "AdminListDisconnectedPlayers": PRIORITY_POLLING,
+    "AdminChangeMap": PRIORITY_CONTROL,
+    "AdminChangeLayer": PRIORITY_CONTROL,
+    "AdminSetNextMap": PRIORITY_CONTROL,
+    "AdminSetNextLayer": PRIORITY_CONTROL,
+    "AdminEndMatch": PRIORITY_CONTROL,
+    "AdminRestartMatch": PRIORITY_CONTROL,
+}
+
+
+class Rcon(RconPool):
+    """RconPool with a method for each RCON command.
+
+    The responses of CACHED_COMMANDS are reused for cache_ttl seconds, and
+    concurrent requests for the same command share a single call. Any
+    command that may change the state of the server invalidates the cache.
+    With a cache_ttl of 0, calls are only shared while in flight.
+
+    Unless specified otherwise, commands are scheduled with the priority
+    class from COMMAND_PRIORITIES, and exec_many sends them as bulk.
+    """
+
+    def __init__(self, *args, cache_ttl=CACHE_TTL, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache_ttl = cache_ttl
+        # Command -> (expiry time, response)
+        self._cached = {}
+        # Command -> future of the call that is in flight
+        self._fetching = {}
+        # Incremented each time the cache is invalidated, so that calls in flight don't store outdated responses
+        self._cache_generation = 0
+
+    async def exec_command(self, command, priority=None):
+        if priority is None:
+            priority = COMMAND_PRIORITIES.get(command.split(" ", 1)[0], PRIORITY_INTERACTIVE)
+        res = await super().exec_command(command, priority)
+        if command.split(" ", 1)[0] not in READ_ONLY_COMMANDS:
+            self.invalidate_cache()
+        return res
+
+    def invalidate_cache(self):
+        """Forget all cached responses, so that the next requests get them from the server again."""
+        self._cached.clear()
+        self._fetching.clear()
+        self._cache_generation += 1
+
+    async def _exec_cached(self, command):
+        """Execute a read-only command, reusing its response if it was received less than cache_ttl seconds ago.
+        Concurrent calls for the same command share a single call to the server."""
+        cached = self._cached.get(command)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+        future = self._fetching.get(command)
+        if future is None:
+            future = self._fetching[command] = asyncio.ensure_future(self._fetch(command, self._cache_generation))
+        # Don't cancel the call for the others waiting on it when this caller gets cancelled
+        return await asyncio.shield(future)
+
+    async def _fetch(self, command, generation):
+        try:
+            res = await self._exec_checked(command)
+        finally:
+            if generation == self._cache_generation:
+                self._fetching.pop(command, None)
+        if generation == self._cache_generation and self.cache_ttl > 0:
+            self._cached[command] = (time.monotonic() + self.cache_ttl, res)
+        return res
+
+    async def stream_lines(self, command):
+        """Execute a read-only command, yielding lists of lines of its response as they arrive.
+        Cached responses and calls that are already in flight are used like with the other read-only commands."""
+        cached = self._cached.get(command)
+        if cached and cached[0] > time.monotonic():
+            yield cached[1].split("\n")
+            return
+        future = self._fetching.get(command)
+        if future is not None:
+            yield (await asyncio.shield(future)).split("\n")
+            return
+
+        generation = self._cache_generation
+        future = self._fetching[command] = asyncio.get_running_loop().create_future()
+        lines = []
+        try:
+            priority = COMMAND_PRIORITIES.get(command.split(" ", 1)[0], PRIORITY_INTERACTIVE)
+            async for batch in self.stream_command(command, priority):
+                # An error fits in the first line, so only that needs holding back
+                if not lines and batch and batch[0].startswith("ERROR: "):
+                    lines = batch
+                    continue
+                lines += batch
+                if not lines[0].startswith("ERROR: "):
+                    yield batch
+            res = self._check_response("\n".join(lines))
+        except BaseException as e:
+            if not future.done():
+                future.set_exception(e if isinstance(e, Exception) else RconError("Request was cancelled"))
+                future.exception()
+            raise
+        finally:
+            if generation == self._cache_generation and self._fetching.get(command) is future:
+                del self._fetching[command]
+        if generation == self._cache_generation and self.cache_ttl > 0:
+            self._cached[command] = (time.monotonic() + self.cache_ttl, res)
+        future.set_result(res)
+
+    def _check_response(self, res):
+        if not res:
             logging.warning('Empty response received from %s:%s', self.server, self.port)
             res = "Empty response received"
+        elif res.startswith("ERROR: "):
+            res = res.replace("ERROR: ", "")
+            logging.error('%s:%s returned error: %s', self.server, self.port, res)
+            raise RconCommandError(res)
         else:
-            res = b"".join(res).strip(b'\x00\x01')
-            res = res.decode('utf-8', errors='replace').replace('�', '')
-            if res.startswith("ERROR: "):
-                res = res.replace("ERROR: ", "")
-                logging.error('%s:%s returned error: %s', self.server, self.port, res)
-                raise RconCommandError(res)
-            else:
-                logging.info('%s:%s returned response: %s', self.server, self.port, res)
+            logging.info('%s:%s returned response: %s', self.server, self.port, res)
         return res
 
-    # PLAYERS
-    def list_players(self):
-        res = self.exec_command(f"ListPlayers")
-        res = self._res_to_str(res)
+    async def exec_many(self, commands, priority=PRIORITY_BULK):
+        """Execute a batch of RCON commands at once. The commands are pipelined
+        and spread over the pool, so they are not guaranteed to run in order.
+
+        Parameters:
+            commands (list) the RCON command strings
+            priority (int) priority class of the commands
+
+        Returns a list with, for each command in order, either its response
+        or the exception it raised
+        """
+        return await asyncio.gather(*[self._exec_checked(command, priority) for command in commands], return_exceptions=True)
+
+    async def _exec_checked(self, command, priority=None):
+        res = await self.exec_command(command, priority)
+        res = self._check_response(res)
         return res
-    def list_disconnected_players(self):
-        res = self.exec_command(f"AdminListDisconnectedPlayers")
-        res = self._res_to_str(res)
+
+    # PLAYERS
+    async def list_players(self):
+        return await self._exec_cached("ListPlayers")
+    async def list_disconnected_players(self):
+        res = await self.exec_command(f"AdminListDisconnectedPlayers")
+        res = self._check_response(res)
         return res
 
     # MODERATION
-    def warn(self, name_or_steam64id: str, reason: str):
-        res = self.exec_command(f"AdminWarn {name_or_steam64id} {reason}")
-        res = self._res_to_str(res)
+    async def warn(self, name_or_steam64id: str, reason: str):
+        res = await self.exec_command(f"AdminWarn {name_or_steam64id} {reason}")
+        res = self._check_response(res)
         return res
-    def warn_by_id(self, player_id: str, reason: str):
-        res = self.exec_command(f"AdminWarnById {player_id} {reason}")
-        res = self._res_to_str(res)
+    async def warn_by_id(self, player_id: str, reason: str):
+        res = await self.exec_command(f"AdminWarnById {player_id} {reason}")
+        res = self._check_response(res)
         return res
-    def kick(self, name_or_steam64id: str, reason: str):
-        res = self.exec_command(f"AdminKick {name_or_steam64id} {reason}")
-        res = self._res_to_str(res)
+    async def kick(self, name_or_steam64id: str, reason: str):
+        res = await self.exec_command(f"AdminKick {name_or_steam64id} {reason}")
+        res = self._check_response(res)
         return res
-    def kick_by_id(self, player_id: str, reason: str):
-        res = self.exec_command(f"AdminKickById {player_id} {reason}")
-        res = self._res_to_str(res)
+    async def kick_by_id(self, player_id: str, reason: str):
+        res = await self.exec_command(f"AdminKickById {player_id} {reason}")
+        res = self._check_response(res)
         return res
-    def ban(self, name_or_steam64id: str, length: str, reason: str):
-        res = self.exec_command(f"AdminBan {name_or_steam64id} {length} {reason}")
-        res = self._res_to_str(res)
+    async def ban(self, name_or_steam64id: str, length: str, reason: str):
+        res = await self.exec_command(f"AdminBan {name_or_steam64id} {length} {reason}")
+        res = self._check_response(res)
         return res
-    def ban_by_id(self, player_id: str, length: str, reason: str):
-        res = self.exec_command(f"AdminBanById {player_id} {length} {reason}")
-        res = self._res_to_str(res)
+    async def ban_by_id(self, player_id: str, length: str, reason: str):
+        res = await self.exec_command(f"AdminBanById {player_id} {length} {reason}")
+        res = self._check_response(res)
         return res
-    def broadcast(self, message: str):
-        res = self.exec_command(f"AdminBroadcast {message}")
-        res = self._res_to_str(res)
+    async def broadcast(self, message: str):
+        res = await self.exec_command(f"AdminBroadcast {message}")
+        res = self._check_response(res)
         return res
 
     # TEAMS
-    def demote_commander(self, name_or_steam64id: str):
-        res = self.exec_command(f"AdminDemoteCommander {name_or_steam64id}")
-        res = self._res_to_str(res)
+    async def demote_commander(self, name_or_steam64id: str):
+        res = await self.exec_command(f"AdminDemoteCommander {name_or_steam64id}")
+        res = self._check_response(res)
         return res
-    def demote_commander_by_id(self, player_id: str):
-        res = self.exec_command(f"AdminDemoteCommanderById {player_id}")
-        res = self._res_to_str(res)
+    async def demote_commander_by_id(self, player_id: str):
+        res = await self.exec_command(f"AdminDemoteCommanderById {player_id}")
+        res = self._check_response(res)
         return res
-    def remove_from_squad(self, name_or_steam64id: str):
-        res = self.exec_command(f"AdminRemovePlayerFromSquad {name_or_steam64id}")
-        res = self._res_to_str(res)
+    async def remove_from_squad(self, name_or_steam64id: str):
+        res = await self.exec_command(f"AdminRemovePlayerFromSquad {name_or_steam64id}")
+        res = self._check_response(res)
         return res
-    def remove_from_squad_by_id(self, player_id: str):
-        res = self.exec_command(f"AdminRemovePlayerFromSquadById {player_id}")
-        res = self._res_to_str(res)
+    async def remove_from_squad_by_id(self, player_id: str):
+        res = await self.exec_command(f"AdminRemovePlayerFromSquadById {player_id}")
+        res = self._check_response(res)
         return res
-    def change_team(self, name_or_steam64id: str):
-        res = self.exec_command(f"AdminForceTeamChange {name_or_steam64id}")
-        res = self._res_to_str(res)
+    async def change_team(self, name_or_steam64id: str):
+        res = await self.exec_command(f"AdminForceTeamChange {name_or_steam64id}")
+        res = self._check_response(res)
         return res
-    def change_team_by_id(self, player_id: str):
-        res = self.exec_command(f"AdminForceTeamChangeById {player_id}")
-        res = self._res_to_str(res)
+    async def change_team_by_id(self, player_id: str):
+        res = await self.exec_command(f"AdminForceTeamChangeById {player_id}")
+        res = self._check_response(res)
         return res
-    def disband_squad(self, team_1_or_2: str, squad_index: str):
-        res = self.exec_command(f"AdminDisbandSquad {team_1_or_2} {squad_index}")
-        res = self._res_to_str(res)
-        return res
-    def list_squads(self):
-        res = self.exec_command(f"ListSquads")
-        res = self._res_to_str(res)
+    async def disband_squad(self, team_1_or_2: str, squad_index: str):
+        res = await self.exec_command(f"AdminDisbandSquad {team_1_or_2} {squad_index}")
+        res = self._check_response(res)
         return res
+    async def list_squads(self):
+        return await self._exec_cached("ListSquads")
 
     # MATCHES
-    def end_match(self):
-        res = self.exec_command(f"AdminEndMatch")
-        res = self._res_to_str(res)
-        return res
-    def restart_match(self):
-        res = self.exec_command(f"AdminRestartMatch")
-        res = self._res_to_str(res)
-        return res
-    def switch_to_map(self, map_name: str):
-        res = self.exec_command(f"AdminChangeMap {map_name}")
-        res = self._res_to_str(res)
+    async def end_match(self):
+        res = await self.exec_command(f"AdminEndMatch")
+        res = self._check_response(res)
         return res
-    def set_next_map(self, map_name: str):
-        res = self.exec_command(f"AdminSetNextMap {map_name}")
-        res = self._res_to_str(res)
+    async def restart_match(self):
+        res = await self.exec_command(f"AdminRestartMatch")
+        res = self._check_response(res)
         return res
-    def show_current_map(self):
-        res = self.exec_command(f"ShowCurrentMap")
-        res = self._res_to_str(res)
+    async def switch_to_map(self, map_name: str):
+        res = await self.exec_command(f"AdminChangeMap {map_name}")
+        res = self._check_response(res)
         return res
-    def show_next_map(self):
-        res = self.exec_command(f"ShowNextMap")
-        res = self._res_to_str(res)
+    async def set_next_map(self, map_name: str):
+        res = await self.exec_command(f"AdminSetNextMap {map_name}")
+        res = self._check_response(res)
         return res
+    async def show_current_map(self):
+        return await self._exec_cached("ShowCurrentMap")
+    async def show_next_map(self):
+        return await self._exec_cached("ShowNextMap")
 
-    def set_next_layer(self, layer_name: str):
-        res = self.exec_command(f"AdminSetNextLayer {layer_name}")
-        res = self._res_to_str(res)
+    async def set_next_layer(self, layer_name: str):
+        res = await self.exec_command(f"AdminSetNextLayer {layer_name}")
+        res = self._check_response(res)
         return res
 
-    def switch_to_layer(self, layer_name: str):
-        res = self.exec_command(f"AdminChangeLayer {layer_name}")
-        res = self._res_to_str(res)
+    async def switch_to_layer(self, layer_name: str):
+        res = await self.exec_command(f"AdminChangeLayer {layer_name}")
+        res = self._check_response(res)
         return res
 
 
     # ADMINISTRATION
-    def set_max_player_limit(self, limit: str):
-        res = self.exec_command(f"AdminSetMaxNumPlayers {limit}")
-        res = self._res_to_str(res)
+    async def set_max_player_limit(self, limit: str):
+        res = await self.exec_command(f"AdminSetMaxNumPlayers {limit}")
+        res = self._check_response(res)
         return res
-    def change_password(self, password: str = ""):
-        res = self.exec_command(f"AdminSetServerPassword {password}")
-        res = self._res_to_str(res)
+    async def change_password(self, password: str = ""):
+        res = await self.exec_command(f"AdminSetServerPassword {password}")
+        res = self._check_response(res)
         return res
-    def set_clockspeed(self, percentage: float):
-        res = self.exec_command(f"AdminSlomo {str(percentage)}")
-        res = self._res_to_str(res)
+    async def set_clockspeed(self, percentage: float):
+        res = await self.exec_command(f"AdminSlomo {str(percentage)}")
+        res = self._check_response(res)
         return res
 
 
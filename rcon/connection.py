@@ -1,15 +1,19 @@
 # Copyright (C) 2013 Peter Rowlands
 """Source server RCON communications module"""
 
+import asyncio
+import codecs
+import collections
 import contextlib
 import itertools
 import re
 import struct
-import socket
-from datetime import datetime
+import time
 
 import logging
 
+from rcon import metrics
+
 
 # "Vanilla" RCON Packet types
 SERVERDATA_AUTH = 3
@@ -26,6 +30,24 @@ MULTIPACKET_STRING = 10
 # Special responses by the Squad server to indicate the end of a multipacket response.
 SPECIAL_MULTIPACKET_HEADER = b'\x00\x01\x00\x00\x00\x00\x00'
 SPECIAL_MULTIPACKET_BYTES = b'\x00\x00\x00\x01\x00\x00\x00'
+# Used to look for the special bytes inside a packet body without copying it
+SPECIAL_MULTIPACKET_HEADER_RE = re.compile(re.escape(SPECIAL_MULTIPACKET_HEADER))
+SPECIAL_MULTIPACKET_BYTES_RE = re.compile(re.escape(SPECIAL_MULTIPACKET_BYTES))
+
+# The header is made of three little-endian integers (4 bytes each).
+HEADER_STRUCT = struct.Struct('<3i')
+HEADER_SIZE = HEADER_STRUCT.size
+
+# Initial size of the receive buffer of a connection. It grows when a packet does not fit.
+RECV_BUFFER_SIZE = 65536
+# Minimum amount of free space to offer the transport to receive into
+RECV_BUFFER_MIN_FREE = 4096
+
+# Maximum amount of chat messages that are kept per connection. Older messages are dropped.
+CHAT_BUFFER_SIZE = 500
+
+# Seconds to wait for the server to answer a keepalive
+KEEPALIVE_TIMEOUT = 5
 
 
 class PlayerChat(object):
@@ -63,19 +85,249 @@ class RconPacket(object):
                            bytearray(self.body, 'utf-8'))
 
 
-@contextlib.contextmanager
-def get_managed_rcon_connection(*args, **kwargs):
-    """ Yields a managed RconConnection (closes its socket when leaving context). """
-    conn = RconConnection(*args, **kwargs)
-    yield conn
-    conn._sock.close()
+def decode_body(body):
+    """Decode a (concatenated) response body to a string.
+
+    Parameters:
+        body (bytes-like) the raw response body
+    """
+    # TODO(bsubei): different messages may have different encodings (ascii vs utf-8) based on the kinds of player
+    # names for commands like 'ListPlayers'. Keep an eye out for that bug.
+    return str(body, 'utf-8', errors='replace').strip('\x00\x01').replace('\ufffd', '')
+
+
+def append_body(body, part):
+    """Append a packet body to a bytearray, leaving out its null terminators.
+
+    Parameters:
+        body (bytearray) the response body so far
+        part (bytes-like) the body of the received packet
+    """
+    end = len(part)
+    while end and part[end - 1] == 0:
+        end -= 1
+    body += part[:end]
+
+
+class LineDecoder(object):
+    """Incrementally decodes response bodies into complete lines.
 
+    Multi-byte characters and lines that are split over several packets
+    are held back until the rest of them arrives.
+    """
 
-class RconConnection(object):
-    """RCON client to server connection"""
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self._partial = ''
 
-    def __init__(self, server, port=27015, password='', single_packet_mode=False, instance_id=None):
-        """Construct an RconConnection.
+    def feed(self, part, final=False):
+        """Decode the body of the next packet.
+
+        Parameters:
+            part (bytes-like) the body of the received packet
+            final (bool) whether this is the last part of the response
+
+        Returns a list of the lines that were completed (str)
+        """
+        end = len(part)
+        while end and part[end - 1] == 0:
+            end -= 1
+        text = self._partial + self._decoder.decode(part[:end], final).replace('\ufffd', '')
+        lines = text.split('\n')
+        self._partial = '' if final else lines.pop()
+        return [line.strip('\x00\x01') for line in lines]
+
+
+class RconFramer(object):
+    """Splits a stream of bytes into RCON packets.
+
+    Data is received straight into one preallocated buffer, and packet
+    bodies are handed out as memoryview slices of that buffer. A slice is
+    only valid until more data is received, so it should be consumed (or
+    copied) before awaiting anything else.
+    """
+
+    def __init__(self, size=RECV_BUFFER_SIZE):
+        self._buffer = bytearray(size)
+        self._view = memoryview(self._buffer)
+        # Received data that is yet to be framed lives in _buffer[_start:_end]
+        self._start = 0
+        self._end = 0
+
+    def __len__(self):
+        return self._end - self._start
+
+    def clear(self):
+        """Discard all data that has not been framed yet."""
+        self._start = self._end = 0
+
+    def get_buffer(self, sizehint=-1):
+        """Return a writable memoryview of the free space at the end of the buffer."""
+        if self._start == self._end:
+            self._start = self._end = 0
+        elif len(self._buffer) - self._end < RECV_BUFFER_MIN_FREE:
+            pending = self._end - self._start
+            if len(self._buffer) - pending < RECV_BUFFER_MIN_FREE:
+                # Not enough room left, even after compacting. Slices that were handed out may still be
+                # referenced, so we can't resize in place. Allocate a bigger buffer instead.
+                buffer = bytearray(len(self._buffer) * 2)
+                buffer[:pending] = self._view[self._start:self._end]
+                self._buffer = buffer
+                self._view = memoryview(buffer)
+            else:
+                self._view[:pending] = self._view[self._start:self._end]
+            self._start = 0
+            self._end = pending
+        return self._view[self._end:]
+
+    def buffer_updated(self, nbytes):
+        """Mark nbytes of the view returned by get_buffer() as received."""
+        self._end += nbytes
+
+    def next_frame(self, end_of_multipacket=False):
+        """Return the next packet as a (pkt_id, pkt_type, body) tuple, with body as a memoryview,
+        or None if the packet hasn't been fully received yet.
+
+        Parameters:
+            end_of_multipacket (bool) set to True when the special end-of-multipacket header is expected next.
+                If found, (-1, END_OF_MULTIPACKET, None) is returned.
+
+        Raises:
+            RconError if the received packet header is malformed
+        """
+        pending = self._end - self._start
+        if end_of_multipacket:
+            # The special multipacket header is 7 bytes long and never followed up by anything else.
+            marker_size = len(SPECIAL_MULTIPACKET_HEADER)
+            if pending < marker_size and SPECIAL_MULTIPACKET_HEADER.startswith(self._view[self._start:self._end]):
+                return None
+            if self._buffer.startswith(SPECIAL_MULTIPACKET_HEADER, self._start, self._end):
+                self._start += marker_size
+                return (-1, END_OF_MULTIPACKET, None)
+
+        if pending < HEADER_SIZE:
+            return None
+        (pkt_size, pkt_id, pkt_type) = HEADER_STRUCT.unpack_from(self._buffer, self._start)
+        if pkt_size < 8:
+            raise RconError('Received malformed packet header!')
+        # The size field does not count itself
+        frame_size = pkt_size + 4
+        if pending < frame_size:
+            return None
+        body = self._view[self._start + HEADER_SIZE:self._start + frame_size]
+        self._start += frame_size
+        return (pkt_id, pkt_type, body)
+
+
+class RconProtocol(asyncio.BufferedProtocol):
+    """Receives data from the transport straight into a RconFramer"""
+
+    def __init__(self, framer):
+        self.framer = framer
+        self.transport = None
+        self.at_eof = False
+        self._waiter = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def get_buffer(self, sizehint):
+        return self.framer.get_buffer(sizehint)
+
+    def buffer_updated(self, nbytes):
+        self.framer.buffer_updated(nbytes)
+        self._wakeup()
+
+    def eof_received(self):
+        self.at_eof = True
+        self._wakeup()
+        return False
+
+    def connection_lost(self, exc):
+        self.at_eof = True
+        self._wakeup()
+
+    def _wakeup(self):
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    async def wait_for_data(self):
+        """Wait until more data is received.
+
+            Raises:
+                RconEmptyHeaderError if the connection was closed before receiving anything
+                RconError if the connection was closed halfway through a packet
+        """
+        if self.at_eof:
+            if len(self.framer):
+                raise RconError('Received malformed packet header!')
+            raise RconEmptyHeaderError('Received empty packet header')
+        self._waiter = asyncio.get_running_loop().create_future()
+        try:
+            await self._waiter
+        finally:
+            self._waiter = None
+
+
+class PipelinedRequest(object):
+    """A command that is in flight on a pipelined connection"""
+
+    def __init__(self, cmd_pkt, chk_pkt):
+        self.cmd_pkt = cmd_pkt
+        self.chk_pkt = chk_pkt
+        self.body = bytearray()
+        self.future = asyncio.get_running_loop().create_future()
+
+    def append(self, part):
+        append_body(self.body, part)
+
+    def resolve(self):
+        if not self.future.done():
+            self.future.set_result(RconPacket(self.cmd_pkt.pkt_id, SERVERDATA_RESPONSE_VALUE,
+                                              decode_body(self.body)))
+
+    def fail(self, exc):
+        if not self.future.done():
+            self.future.set_exception(exc)
+
+
+class StreamingRequest(PipelinedRequest):
+    """A command in flight whose response is handed over line by line as packets arrive.
+
+    Each item in the queue is a list of lines, None once the response is
+    complete, or the exception the request failed with.
+    """
+
+    def __init__(self, cmd_pkt, chk_pkt):
+        super().__init__(cmd_pkt, chk_pkt)
+        self.queue = asyncio.Queue()
+        self._decoder = LineDecoder()
+
+    def append(self, part):
+        lines = self._decoder.feed(part)
+        if lines:
+            self.queue.put_nowait(lines)
+
+    def resolve(self):
+        if not self.future.done():
+            self.queue.put_nowait(self._decoder.feed(b'', final=True))
+            self.queue.put_nowait(None)
+            self.future.set_result(None)
+
+    def fail(self, exc):
+        if not self.future.done():
+            self.queue.put_nowait(exc)
+            self.future.set_exception(exc)
+            # Nobody may be waiting for the future itself
+            self.future.exception()
+
+
+class AsyncRconConnection(object):
+    """Asynchronous RCON client to server connection"""
+
+    def __init__(self, server, port=27015, password='', single_packet_mode=False, instance_id=None, timeout=10, receive_chat=True, pipelined=False, recorder=None, keepalive_interval=None, on_keepalive_failure=None):
+        """Construct an AsyncRconConnection. The connection is not opened
+        until connect() is awaited.
 
         Parameters:
             server (str) server hostname or IP address
@@ -83,6 +335,16 @@ class RconConnection(object):
             password (str) server RCON password
             single_packet_mode (bool) set to True for servers which do not hand 0-length SERVERDATA_RESPONSE_VALUE
                 requests (i.e. Factorio).
+            timeout (float) seconds to wait for the server before giving up on a connect or command
+            receive_chat (bool) set to False to discard chat messages streamed to this connection. Otherwise, the
+                connection is read from in the background so that chat is received as soon as it is sent.
+            pipelined (bool) set to True to allow multiple commands to be in flight at once. Responses are read by a
+                background task and matched to their command by packet ID.
+            recorder (WireRecorder) if set, all packets that are sent and received are recorded to it
+            keepalive_interval (float) if set, the server is probed with an empty packet after this many seconds
+                without receiving anything, and the connection is closed if it does not answer. It is reopened by
+                the next command. Requires the connection to be read from in the background.
+            on_keepalive_failure (function) is called with the exception when the server didn't answer a probe
 
         """
         self.id = instance_id
@@ -90,139 +352,368 @@ class RconConnection(object):
         self.port = port # Raises a ConnectionRefusedError when invalid
         self.password = password # Returns empty headers when invalid
         self.single_packet_mode = single_packet_mode
-        self._connect_sock()
-        logging.debug('New RCON connection created with %s:%s', self.server, self.port)
+        self.timeout = timeout
+        self.receive_chat = receive_chat
+        self.pipelined = pipelined
+        self.keepalive_interval = keepalive_interval
+        self.on_keepalive_failure = on_keepalive_failure
         self.pkt_id = itertools.count(1)
-        self._authenticate(password)
-        self.all_player_chat = list()
-
-    def _connect_sock(self):
+        self.metrics = metrics.registry.get(instance_id if instance_id is not None else f'{server}:{port}')
+        self.recorder = recorder
+        self._recorder_id = recorder.register() if recorder else None
+        self.all_player_chat = collections.deque(maxlen=CHAT_BUFFER_SIZE)
+        self._chat_subscribers = []
+        self._chat_tasks = set()
+
+        self._framer = None
+        self._protocol = None
+        # Only one command can be read from the stream at a time, unless pipelined
+        self._lock = asyncio.Lock()
+        # Squad streams chat at any time, so read packets in the background when we care about chat
+        self._read_in_background = (pipelined or receive_chat) and not single_packet_mode
+        # Only one command can be in flight at a time when reading in the background without pipelining
+        self._serial = asyncio.Lock()
+        # Pipelined requests by the packet IDs of both their command and check packet
+        self._pending = {}
+        self._read_task = None
+        self._keepalive_task = None
+        self._last_received = 0
+        # Incremented each time the socket is (re)opened
+        self._generation = 0
+
+    @property
+    def is_connected(self):
+        return (self._protocol is not None and not self._protocol.transport.is_closing()
+                and not self._protocol.at_eof)
+
+    async def connect(self):
+        """Open the connection and authenticate with the server."""
+        await self._connect_sock()
+        logging.debug('New RCON connection created with %s:%s', self.server, self.port)
+        await self._authenticate(self.password)
+        self._generation += 1
+        self._last_received = time.monotonic()
+        if self._read_in_background:
+            self._read_task = asyncio.create_task(self._read_packets())
+            if self.keepalive_interval and self._keepalive_task is None:
+                self._keepalive_task = asyncio.create_task(self._keep_alive())
+        return self
+
+    async def close(self):
+        """Close the connection, if open."""
+        if self._read_task is not None:
+            self._read_task.cancel()
+            self._read_task = None
+        if self._keepalive_task is not None:
+            self._keepalive_task.cancel()
+            self._keepalive_task = None
+        self._fail_pending(ConnectionResetError('RCON connection was closed'))
+        protocol = self._protocol
+        self._protocol = None
+        self._framer = None
+        if protocol is not None:
+            protocol.transport.close()
+
+    async def _connect_sock(self):
+        self._framer = RconFramer()
+        loop = asyncio.get_running_loop()
         try:
-            self._sock = socket.create_connection(address=(self.server, self.port), timeout=10)
-        except socket.timeout:
+            transport, self._protocol = await asyncio.wait_for(
+                loop.create_connection(lambda: RconProtocol(self._framer), self.server, self.port),
+                timeout=self.timeout)
+        except asyncio.TimeoutError:
             raise RconAuthError("Unknown host")
         except ConnectionRefusedError:
             raise RconAuthError("Invalid port")
         except OSError:
             raise RconAuthError("Invalid host")
 
-    def _authenticate(self, password):
+    async def _authenticate(self, password):
         """Authenticate with the server using the given password."""
         auth_pkt = RconPacket(next(self.pkt_id), SERVERDATA_AUTH, password)
-        self._send_pkt(auth_pkt)
+        await self._send_pkt(auth_pkt)
         # The server should respond with a SERVERDATA_RESPONSE_VALUE followed by SERVERDATA_AUTH_RESPONSE.
         # Note that some server types omit the initial SERVERDATA_RESPONSE_VALUE packet.
         # For Squad, neither of these are sent and you'll face an empty stream.
         try:
-            auth_resp = self.read_response(auth_pkt, skip_empty_headers=False)
-        except RconError:
+            auth_resp = await asyncio.wait_for(self.read_response(auth_pkt), timeout=self.timeout)
+        except (RconError, asyncio.TimeoutError):
             logging.warning('%s:%s refused RCON password %s', self.server, self.port, self.password)
             raise RconAuthError('Bad password')
         if auth_resp.pkt_type == SERVERDATA_RESPONSE_VALUE:
-            auth_resp = self.read_response()
+            auth_resp = await self.read_response()
         if auth_resp.pkt_type != SERVERDATA_AUTH_RESPONSE:
             raise RconError('Received invalid auth response packet')
         if auth_resp.pkt_id == -1:
             raise RconAuthError('Bad password')
         logging.debug('Logged in with RCON password at %s:%s', self.server, self.port)
 
-    def exec_command(self, command):
+    async def _reconnect(self):
+        self.metrics.reconnects += 1
+        await self.close()
+        await self.connect()
+
+    async def exec_command(self, command):
         """Execute the given RCON command.
 
         Parameters:
             command (str) the RCON command string (ex. "status")
 
-        Returns the response body
+        Returns the decoded response body (str)
         """
-        #print(f'\n============================\n\nExecuting "{command}"')
+        start = time.perf_counter()
+        try:
+            res = await self._exec_command(command)
+        except Exception:
+            self.metrics.record_command(command, time.perf_counter() - start, failed=True)
+            raise
+        self.metrics.record_command(command, time.perf_counter() - start)
+        return res
+
+    async def _exec_command(self, command):
+        if self._read_in_background:
+            if self.pipelined:
+                return await self._exec_pipelined(command)
+            async with self._serial:
+                return await self._exec_pipelined(command)
+        async with self._lock:
+            cmd_pkt = RconPacket(next(self.pkt_id), SERVERDATA_EXECCOMMAND, command)
+            try:
+                logging.info('Sending RCON command to %s:%s: %s', self.server, self.port, command)
+                resp = await asyncio.wait_for(self._exec_pkt(cmd_pkt), timeout=self.timeout)
+            except (OSError, asyncio.TimeoutError, RconEmptyHeaderError):
+                logging.warning('%s:%s raised OSError or RconEmptyHeaderError, creating new socket...', self.server, self.port)
+                await self._reconnect()
+                # Try again
+                resp = await asyncio.wait_for(self._exec_pkt(cmd_pkt), timeout=self.timeout)
+            except Exception as e:
+                await self.flush_socket()
+                raise e
+            return resp.body
+
+    async def _exec_pkt(self, cmd_pkt):
+        await self._send_pkt(cmd_pkt)
+        resp = await self.read_response(cmd_pkt, multi=True)
+        if self.single_packet_mode:
+            resp.body = decode_body(resp.body)
+        return resp
+
+    async def _exec_pipelined(self, command):
         cmd_pkt = RconPacket(next(self.pkt_id), SERVERDATA_EXECCOMMAND, command)
+        generation = self._generation
         try:
             logging.info('Sending RCON command to %s:%s: %s', self.server, self.port, command)
-            self._send_pkt(cmd_pkt)
-            resp = self.read_response(cmd_pkt, multi=True)
-        except (OSError, RconEmptyHeaderError):
-            logging.warn('%s:%s raised OSError or RconEmptyHeaderError, creating new socket...', self.server, self.port)
-            self._connect_sock()
-            self._authenticate(self.password)
+            resp = await asyncio.wait_for(self._exec_pkt_pipelined(cmd_pkt), timeout=self.timeout)
+        except (OSError, asyncio.TimeoutError, RconEmptyHeaderError):
+            logging.warning('%s:%s raised OSError or RconEmptyHeaderError, creating new socket...', self.server, self.port)
+            async with self._lock:
+                # Other requests that were in flight may have already reconnected
+                if generation == self._generation:
+                    await self._reconnect()
             # Try again
-            self._send_pkt(cmd_pkt)
-            resp = self.read_response(cmd_pkt, multi=True)
-        except Exception as e:
-            self.flush_socket()
-            raise e
+            resp = await asyncio.wait_for(self._exec_pkt_pipelined(cmd_pkt), timeout=self.timeout)
         return resp.body
 
-    def _send_pkt(self, pkt):
-        """Send one RCON packet over the connection.
+    async def stream_command(self, command):
+        """Execute the given RCON command, yielding its response as it arrives.
+
+        Parameters:
+            command (str) the RCON command string
+
+        Yields lists of complete lines (str). Without reading in the
+        background, the whole response is yielded at once.
+        """
+        if not self._read_in_background:
+            yield (await self.exec_command(command)).split('\n')
+            return
+        start = time.perf_counter()
+        failed = True
+        async with contextlib.AsyncExitStack() as stack:
+            if not self.pipelined:
+                await stack.enter_async_context(self._serial)
+            if not self.is_connected:
+                generation = self._generation
+                async with self._lock:
+                    if generation == self._generation:
+                        await self._reconnect()
+            cmd_pkt = RconPacket(next(self.pkt_id), SERVERDATA_EXECCOMMAND, command)
+            chk_pkt = RconPacket(next(self.pkt_id), SERVERDATA_RESPONSE_VALUE)
+            request = StreamingRequest(cmd_pkt, chk_pkt)
+            self._pending[cmd_pkt.pkt_id] = request
+            self._pending[chk_pkt.pkt_id] = request
+            try:
+                logging.info('Streaming RCON command from %s:%s: %s', self.server, self.port, command)
+                await self._send_pkt(cmd_pkt, chk_pkt)
+                while True:
+                    lines = await asyncio.wait_for(request.queue.get(), timeout=self.timeout)
+                    if lines is None:
+                        break
+                    if isinstance(lines, Exception):
+                        raise lines
+                    yield lines
+                failed = False
+            finally:
+                # When the caller stops early, keep the rest of the response from being reported as unknown
+                request.future.add_done_callback(lambda future: self._pending.pop(cmd_pkt.pkt_id, None))
+                request.future.add_done_callback(lambda future: self._pending.pop(chk_pkt.pkt_id, None))
+                self.metrics.record_command(command, time.perf_counter() - start, failed=failed)
+
+    async def _exec_pkt_pipelined(self, cmd_pkt):
+        # Like with _read_multi_response, the check packet tells us where the response ends
+        chk_pkt = RconPacket(next(self.pkt_id), SERVERDATA_RESPONSE_VALUE)
+        request = PipelinedRequest(cmd_pkt, chk_pkt)
+        self._pending[cmd_pkt.pkt_id] = request
+        self._pending[chk_pkt.pkt_id] = request
+        try:
+            await self._send_pkt(cmd_pkt, chk_pkt)
+            return await request.future
+        finally:
+            self._pending.pop(cmd_pkt.pkt_id, None)
+            self._pending.pop(chk_pkt.pkt_id, None)
+
+    async def _keep_alive(self):
+        """Probe the server whenever it has been quiet for a while, to detect half-open connections.
+
+        The probe is a single empty SERVERDATA_RESPONSE_VALUE packet, the same packet that marks the end of a
+        command. Squad mirrors it without executing or logging anything. When it goes unanswered the connection is
+        closed and on_keepalive_failure is called, reconnecting is left to whoever uses the connection next.
+        """
+        while True:
+            idle = time.monotonic() - self._last_received
+            if idle < self.keepalive_interval:
+                await asyncio.sleep(self.keepalive_interval - idle)
+                continue
+            chk_pkt = RconPacket(next(self.pkt_id), SERVERDATA_RESPONSE_VALUE)
+            request = PipelinedRequest(chk_pkt, chk_pkt)
+            self._pending[chk_pkt.pkt_id] = request
+            try:
+                await self._send_pkt(chk_pkt)
+                await asyncio.wait_for(request.future, timeout=KEEPALIVE_TIMEOUT)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.warning('%s:%s did not answer keepalive, closing the connection: %s: %s',
+                                self.server, self.port, e.__class__.__name__, e)
+                self._fail_pending(e)
+                if self._protocol is not None:
+                    self._protocol.transport.close()
+                if self.on_keepalive_failure:
+                    self.on_keepalive_failure(e)
+                # Nothing is left to probe until the connection is reopened, which starts a new keepalive
+                return
+            finally:
+                self._pending.pop(chk_pkt.pkt_id, None)
+
+    async def _read_packets(self):
+        """Keep reading packets and hand them to the request they belong to.
+        Chat packets are handled by _recv_pkt as soon as they arrive."""
+        # The request of which the check packet was mirrored, which only has its end-of-multipacket left
+        closing = None
+        expect_end = False
+        try:
+            while True:
+                pkt = await self._recv_pkt(end_of_multipacket=expect_end)
+                if closing and (expect_end or pkt.pkt_id != closing.chk_pkt.pkt_id):
+                    closing.resolve()
+                    closing = None
+                    expect_end = False
+                if pkt.pkt_type == END_OF_MULTIPACKET:
+                    continue
+
+                request = self._pending.get(pkt.pkt_id)
+                if request is None:
+                    logging.warning('%s:%s sent a response for unknown packet ID %s', self.server, self.port, pkt.pkt_id)
+                    continue
+                if pkt.pkt_type != SERVERDATA_RESPONSE_VALUE:
+                    request.fail(RconError('Received unexpected RCON packet type'))
+                elif pkt.pkt_id == request.chk_pkt.pkt_id:
+                    # NOTE(bsubei): for Squad servers, the mirrored check packet is followed by an empty body response
+                    # and a special 7-byte packet (sometimes included with the next chat message).
+                    if closing is request:
+                        expect_end = True
+                    else:
+                        closing = request
+                else:
+                    request.append(pkt.body)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.warning('%s:%s stopped reading responses: %s: %s', self.server, self.port, e.__class__.__name__, e)
+            self._fail_pending(e)
+            if self._protocol is not None:
+                self._protocol.transport.close()
+
+    def _fail_pending(self, exc):
+        for request in list(self._pending.values()):
+            request.fail(exc)
+
+    async def _send_pkt(self, *pkts):
+        """Send one or more RCON packets over the connection.
 
             Raises:
                 RconSizeError if the size of the specified packet is > 4096 bytes
-                RconError if the received packet header is malformed
+                ConnectionResetError if the connection is not open
         """
-        if pkt.size() > 4096:
-            raise RconSizeError('pkt_size > 4096 bytes')
-        data = pkt.pack()
-        self._sock.sendall(data)
-
-    def _recv_pkt(self, skip_empty_headers=True):
-        """Read one RCON packet"""
-        # The header is made of three little-endian integers (8 bytes each).
-        HEADER_SIZE = struct.calcsize('<3i')
-        for i in range(5):
-            # Skip empty packets and try again.
-            header = self._sock.recv(HEADER_SIZE)
-            #print("\nheader:", header)
-            if len(header) != 0 or skip_empty_headers:
-                break
-        if len(header) == 0:
-            raise RconEmptyHeaderError('Received empty packet header')
+        for pkt in pkts:
+            if pkt.size() > 4096:
+                raise RconSizeError('pkt_size > 4096 bytes')
+        if not self.is_connected:
+            raise ConnectionResetError('RCON connection is not open')
+        data = b''.join(pkt.pack() for pkt in pkts)
+        self._protocol.transport.write(data)
+        if self.recorder:
+            for pkt in pkts:
+                self.recorder.record_sent(self._recorder_id, pkt.pkt_id, pkt.pkt_type, pkt.body.encode('utf-8') + b'\x00\x00')
+        self.metrics.record_sent(len(pkts), len(data))
+
+    async def _recv_pkt(self, end_of_multipacket=False):
+        """Read one RCON packet. Its body is a memoryview that is only valid until the next read.
 
-        # We got a weird packet here! If it's the special multipacket header, there is nothing left to read for
-        # this packet. Otherwise, it's a malformed packet header.
-        if header == SPECIAL_MULTIPACKET_HEADER:
-            #print("packet header is SPECIAL_MULTIPACKET_HEADER")
-            return RconPacket(-1, END_OF_MULTIPACKET, '')
-        if len(header) != HEADER_SIZE:
-            raise RconError('Received malformed packet header!')
-        
-        # Use the given packet size to read the body of the packet.
-        (pkt_size, pkt_id, pkt_type) = struct.unpack('<3i', header)
-        #print("size,id,type:",pkt_size, pkt_id, pkt_type)
-
-        bytes_left = pkt_size - 8
-        body = b""
-        while bytes_left > 0:
-            recved_body = self._sock.recv(bytes_left)
-            #print("bytes received: %s/%s" % (len(recved_body), bytes_left))
-            bytes_left -= len(recved_body)
-            body += recved_body
-        #print("body:", body)
-
-        # NOTE(bsubei): chat packets may come at any point. Just store them and continue with the normal response.
-        # In this case we recursively call _recv_pkt until we get a non-chat packet.
-        if pkt_type == SQUAD_CHAT_STREAM:
-            #print("packet is SQUAD_CHAT_STREAM")
-            self.add_chat_message(body.strip(b'\x00\x01').decode('utf-8'))
-            return self._recv_pkt()
-        # NOTE(bsubei): sometimes the end of multipacket response comes attached with the chat message (and the chat
-        # message has the wrong packet type). This was observed on Squad version b-17.0.13.23847.
-        # e.g. packet body: b'\x00\x00\x00\x01\x00\x00\x00[ChatAll] this is example chat\x00\x00'.
-        if SPECIAL_MULTIPACKET_BYTES in body:
-            #print('Found multipacket response inside a chat message! Using chat and discarding the rest!')
-            self.add_chat_message(body.strip(b'\x00\x01').decode('utf-8'))
-            return RconPacket(-1, END_OF_MULTIPACKET, '')
-
-        #print("returning normal packet")
-        return RconPacket(pkt_id, pkt_type, body)
-
-    def read_response(self, request=None, multi=False, skip_empty_headers=True):
+        Parameters:
+            end_of_multipacket (bool) set to True when the special end-of-multipacket header is expected next
+        """
+        while True:
+            if self._protocol is None:
+                raise RconEmptyHeaderError('Received empty packet header')
+            frame = self._framer.next_frame(end_of_multipacket)
+            if frame is None:
+                await self._protocol.wait_for_data()
+                continue
+            (pkt_id, pkt_type, body) = frame
+            self._last_received = time.monotonic()
+            if self.recorder:
+                self.recorder.record_received(self._recorder_id, pkt_id, pkt_type, body if body is not None else b'')
+
+            # We got a weird packet here! If it's the special multipacket header, there is nothing left to read for
+            # this packet.
+            if pkt_type == END_OF_MULTIPACKET:
+                self.metrics.record_received(len(SPECIAL_MULTIPACKET_HEADER))
+                return RconPacket(-1, END_OF_MULTIPACKET, '')
+            self.metrics.record_received(HEADER_SIZE + len(body))
+
+            # NOTE(bsubei): chat packets may come at any point. Just store them and continue with the normal response.
+            # In this case we keep reading until we get a non-chat packet.
+            if pkt_type == SQUAD_CHAT_STREAM:
+                self.metrics.chat_packets += 1
+                self.add_chat_message(str(body, 'utf-8', errors='replace').strip('\x00\x01'))
+                continue
+            # NOTE(bsubei): sometimes the end of multipacket response comes attached with the chat message (and the chat
+            # message has the wrong packet type). This was observed on Squad version b-17.0.13.23847.
+            # e.g. packet body: b'\x00\x00\x00\x01\x00\x00\x00[ChatAll] this is example chat\x00\x00'.
+            if SPECIAL_MULTIPACKET_BYTES_RE.search(body):
+                self.add_chat_message(str(body, 'utf-8', errors='replace').strip('\x00\x01'))
+                return RconPacket(-1, END_OF_MULTIPACKET, '')
+
+            return RconPacket(pkt_id, pkt_type, body)
+
+    async def read_response(self, request=None, multi=False):
         """Return the next response packet.
 
         Parameters:
             request (RconPacket) if request is provided, read_response() will check that the response ID matches the
                 specified request ID
             multi (bool) set to True if read_response() should check for a multi packet response. If the current
-                RconConnection has single_packet_mode enabled, this parameter is ignored.
+                AsyncRconConnection has single_packet_mode enabled, this parameter is ignored.
 
         Raises:
             RconError if an error occurred while receiving the server response
@@ -233,9 +724,9 @@ class RconConnection(object):
             if not request:
                 raise ValueError('Must specify a request packet in order to'
                                  ' read a multi-packet response')
-            response = self._read_multi_response(request)
+            response = await self._read_multi_response(request)
         else:
-            response = self._recv_pkt(skip_empty_headers)
+            response = await self._recv_pkt()
         if (not self.single_packet_mode and
                 response.pkt_type not in (SERVERDATA_RESPONSE_VALUE, SERVERDATA_AUTH_RESPONSE)):
             raise RconError('Recieved unexpected RCON packet type')
@@ -243,30 +734,23 @@ class RconConnection(object):
             raise RconError(f'Response ID does not match request ID')
         return response
 
-    def _read_multi_response(self, req_pkt):
+    async def _read_multi_response(self, req_pkt):
         """Return concatenated multi-packet response."""
-        #print("reading multi-packet")
         chk_pkt = RconPacket(next(self.pkt_id), SERVERDATA_RESPONSE_VALUE)
-        #print("send:", self.pkt_id)
-        self._send_pkt(chk_pkt)
+        await self._send_pkt(chk_pkt)
         # According to the Valve wiki, a server will mirror a
         # SERVERDATA_RESPONSE_VALUE packet and then send an additional response
         # packet with an empty body. So we should concatenate any packets until
         # we receive a response that matches the ID in chk_pkt
-        body_parts = []
-        # TODO(bsubei): different messages may have different encodings (ascii vs utf-8) based on the kinds of player
-        # names for commands like 'ListPlayers'. Keep an eye out for that bug.
-        #print("entering loop")
+        body = bytearray()
         while True:
-            response = self._recv_pkt()
+            response = await self._recv_pkt()
             if response.pkt_type == MULTIPACKET_STRING:
-                if SPECIAL_MULTIPACKET_HEADER in response.body:
+                match = SPECIAL_MULTIPACKET_HEADER_RE.search(response.body)
+                if match:
                     # Since we don't know the size of the response beforehand, the end-of-multipacket may be included inside the response.
-                    #print("found end-of-multipacket response")
-                    new_body = response.body.split(SPECIAL_MULTIPACKET_HEADER)[0]
-                    body_parts.append(new_body)
-                    return RconPacket(req_pkt.pkt_id, SERVERDATA_RESPONSE_VALUE,
-                          ''.join(str(body_parts)))
+                    append_body(body, response.body[:match.start()])
+                    return RconPacket(req_pkt.pkt_id, SERVERDATA_RESPONSE_VALUE, decode_body(body))
             else:
                 if response.pkt_type != SERVERDATA_RESPONSE_VALUE:
                     raise RconError('Received unexpected RCON packet type')
@@ -274,42 +758,66 @@ class RconConnection(object):
                     break
                 elif response.pkt_id != req_pkt.pkt_id:
                     raise RconError('Response ID does not match request ID')
-            #print("body:", response.body)
-            body_parts.append(response.body)
-        #print("exiting loop")
+            append_body(body, response.body)
         # NOTE(bsubei): for Squad servers, end of multipacket is signalled by an empty body response and a special
         # 7-byte packet (sometimes included with the next chat message).
-        empty_response = self._recv_pkt()
-        if empty_response.pkt_type != SERVERDATA_RESPONSE_VALUE and empty_response.pkt_id != response.pkt_id:
-            raise RconError('Expected empty response after multipacket')
-        end_of_multipacket = self._recv_pkt()
-        if (end_of_multipacket.pkt_type != END_OF_MULTIPACKET and
-                SPECIAL_MULTIPACKET_BYTES not in end_of_multipacket.body):
-            raise RconError('Expected end-of-multipacket response not received!')
+        empty_response = await self._recv_pkt()
+        if empty_response.pkt_type != END_OF_MULTIPACKET:
+            if empty_response.pkt_type != SERVERDATA_RESPONSE_VALUE and empty_response.pkt_id != response.pkt_id:
+                raise RconError('Expected empty response after multipacket')
+            end_of_multipacket = await self._recv_pkt(end_of_multipacket=True)
+            if (end_of_multipacket.pkt_type != END_OF_MULTIPACKET and
+                    not SPECIAL_MULTIPACKET_BYTES_RE.search(end_of_multipacket.body)):
+                raise RconError('Expected end-of-multipacket response not received!')
 
         # Return the packet.
-        return RconPacket(req_pkt.pkt_id, SERVERDATA_RESPONSE_VALUE,
-                          ''.join(str(body_parts)))
+        return RconPacket(req_pkt.pkt_id, SERVERDATA_RESPONSE_VALUE, decode_body(body))
 
-    def flush_socket(self):
-        for i in range(5):
-            res = self._sock.recv(4096)
-            if res == b'':
-                break
+    async def flush_socket(self):
+        """Discard any data that has been received but not read."""
+        if self._framer is not None:
+            self._framer.clear()
 
     def get_player_chat(self):
-        """ Returns the stored player chat objects. """
-        return self.all_player_chat
+        """ Returns the most recent chat messages. """
+        return list(self.all_player_chat)
 
     def add_chat_message(self, message):
+        if not self.receive_chat:
+            return self.all_player_chat
         message = message.strip('\x00')
         logging.info('Logging new chat message: %s', message)
         self.all_player_chat.append(message)
+        for callback in self._chat_subscribers:
+            task = asyncio.create_task(self._notify_chat_subscriber(callback, message))
+            # Keep a reference to the task until it's done
+            self._chat_tasks.add(task)
+            task.add_done_callback(self._chat_tasks.discard)
         return self.all_player_chat
 
+    async def _notify_chat_subscriber(self, callback, message):
+        try:
+            await callback(message)
+        except Exception as e:
+            logging.exception('Inst %s: Chat subscriber raised an exception: %s: %s', self.id, e.__class__.__name__, e)
+
+    def subscribe_chat(self, callback):
+        """Call the given coroutine function with each new chat message.
+
+        Parameters:
+            callback (coroutine function) is called with the message (str) as only argument
+        """
+        if callback not in self._chat_subscribers:
+            self._chat_subscribers.append(callback)
+
+    def unsubscribe_chat(self, callback):
+        """Stop calling the given coroutine function with new chat messages."""
+        if callback in self._chat_subscribers:
+            self._chat_subscribers.remove(callback)
+
     def clear_player_chat(self):
-        """ Clears the player chat objects (becomes an empty dict). """
-        self.all_player_chat = list()
+        """ Clears the stored chat messages. """
+        self.all_player_chat.clear()
 
 
 
@@ -0,0 +1,108 @@
+"""Typed events of what happens on the servers, and the bus they are published on.
+
+Events are emitted by the ServerInstances while they update, and by the
+Cache when a chat message comes in. Subscribers are called with the
+event as only argument, each in its own task, so that a slow or failing
+subscriber doesn't hold up the update or the other subscribers.
+"""
+
+import asyncio
+from datetime import datetime
+from typing import NamedTuple, Optional, Any
+
+import logging
+
+
+class PlayerJoined(NamedTuple):
+    instance_id: int
+    player: Any
+
+class PlayerLeft(NamedTuple):
+    instance_id: int
+    player: Any
+    # Minutes the player was online for
+    online_time: int
+
+class TeamChanged(NamedTuple):
+    instance_id: int
+    player: Any
+    old_team_id: int
+    new_team_id: int
+
+class SquadCreated(NamedTuple):
+    instance_id: int
+    team_id: int
+    squad: Any
+
+class SquadDisbanded(NamedTuple):
+    instance_id: int
+    team_id: int
+    squad: Any
+
+class MapChanged(NamedTuple):
+    instance_id: int
+    old_map: Any
+    new_map: Any
+    # Minutes the previous match lasted, or None if it is unknown
+    duration: Optional[int]
+    timestamp: datetime
+
+class Teamkill(NamedTuple):
+    instance_id: int
+    attacker_name: str
+    victim_name: str
+    # The OnlinePlayers, or None if they couldn't be found
+    attacker: Any
+    victim: Any
+    timestamp: datetime
+
+class ChatMessage(NamedTuple):
+    instance_id: int
+    # ChatAll, ChatTeam, ChatSquad or ChatAdmin
+    channel: str
+    steam_id: int
+    name: str
+    message: str
+    # The OnlinePlayer, or None if they couldn't be found
+    player: Any
+    timestamp: datetime
+
+
+class EventBus(object):
+    """Delivers events to the coroutine functions subscribed to their type."""
+
+    def __init__(self):
+        # Event type -> list of callbacks
+        self._subscribers = {}
+        self._tasks = set()
+
+    def subscribe(self, event_type, callback):
+        """Call the given coroutine function with each event of the given type.
+
+        Parameters:
+            event_type (type) one of the event classes in this module
+            callback (coroutine function) is called with the event as only argument
+        """
+        callbacks = self._subscribers.setdefault(event_type, [])
+        if callback not in callbacks:
+            callbacks.append(callback)
+
+    def unsubscribe(self, event_type, callback):
+        callbacks = self._subscribers.get(event_type, [])
+        if callback in callbacks:
+            callbacks.remove(callback)
+
+    def emit(self, event):
+        """Schedule the subscribers of the event's type. Subscribers start in the order events were emitted."""
+        for callback in self._subscribers.get(type(event), ()):
+            task = asyncio.create_task(self._notify(callback, event))
+            # Keep a reference to the task until it's done
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _notify(self, callback, event):
+        try:
+            await callback(event)
+        except Exception as e:
+            logging.exception('Inst %s: %s subscriber raised an exception: %s: %s',
+                              event.instance_id, type(event).__name__, e.__class__.__name__, e)
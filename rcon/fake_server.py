@@ -0,0 +1,243 @@
+"""Local stand-in for the RCON server of a Squad server.
+
+Speaks the Source RCON auth handshake and reproduces Squad's multipacket
+quirks, so that the client can be exercised and benchmarked without a
+live game server.
+
+    server = await FakeSquadServer(password='secret', players=80).start()
+    rcon = Rcon('127.0.0.1', server.port, 'secret')
+"""
+
+import asyncio
+import time
+
+import logging
+
+from rcon.connection import (
+    SERVERDATA_AUTH, SERVERDATA_AUTH_RESPONSE, SERVERDATA_EXECCOMMAND, SERVERDATA_RESPONSE_VALUE,
+    SQUAD_CHAT_STREAM, SPECIAL_MULTIPACKET_HEADER, HEADER_STRUCT
+)
+
+
+# Maximum size of a response body before the server splits it up into multiple packets
+MAX_BODY_SIZE = 4096
+
+TEAM_FACTIONS = {1: "US 1st Cavalry Regiment", 2: "RU 49th Combined Arms Army"}
+SQUAD_SIZE = 9
+CURRENT_LAYER = "Yehorivka RAAS v3"
+NEXT_LAYER = "Kohat RAAS v4"
+
+
+def pack_packet(pkt_id, pkt_type, body=b''):
+    """Pack a RCON packet the way the server sends it"""
+    return HEADER_STRUCT.pack(len(body) + 10, pkt_id, pkt_type) + body + b'\x00\x00'
+
+
+class FakePlayer(object):
+    def __init__(self, player_id, steam_id, name, team_id, squad_id, is_leader=False, role="Rifleman"):
+        self.player_id = player_id
+        self.steam_id = steam_id
+        self.name = name
+        self.team_id = team_id
+        self.squad_id = squad_id
+        self.is_leader = is_leader
+        self.role = role
+
+
+def create_players(amount):
+    """Create a list of synthetic players, split over two teams and filling up squads.
+    Every tenth player isn't in a squad."""
+    players = []
+    squad_members = {}
+    for i in range(amount):
+        team_id = i % 2 + 1
+        if i % 10 == 9:
+            squad_id = None
+        else:
+            squad_id = len([p for p in players if p.team_id == team_id and p.squad_id]) // SQUAD_SIZE + 1
+        is_leader = squad_id is not None and (team_id, squad_id) not in squad_members
+        squad_members.setdefault((team_id, squad_id), []).append(i)
+        role = ("USA" if team_id == 1 else "RUS") + ("_SL_01" if is_leader else "_Rifleman_01")
+        players.append(FakePlayer(i, 76561198000000000 + i, f"Player {i}", team_id, squad_id, is_leader, role))
+    return players
+
+
+class FakeSquadServer(object):
+    """An asyncio TCP server that behaves like the RCON server of Squad.
+
+    Parameters:
+        password (str) the RCON password
+        players (int) amount of synthetic players that are online
+        latency (float) seconds to wait before answering each packet
+        chunk_size (int) if set, responses are written in chunks of this many bytes, forcing the client to put
+            packets back together
+        chat_in_responses (bool) set to True to interleave a chat packet with every multipacket response
+        disconnect_after (int) if set, connections are dropped after receiving this many commands
+    """
+
+    def __init__(self, password='', players=0, latency=0, chunk_size=None, chat_in_responses=False, disconnect_after=None):
+        self.password = password
+        self.players = create_players(players)
+        self.latency = latency
+        self.chunk_size = chunk_size
+        self.chat_in_responses = chat_in_responses
+        self.disconnect_after = disconnect_after
+
+        self.current_layer = CURRENT_LAYER
+        self.next_layer = NEXT_LAYER
+        # Every command that was received, in order
+        self.received = []
+        self.commands = {
+            "ListPlayers": self.list_players,
+            "ListSquads": self.list_squads,
+            "ShowCurrentMap": self.show_current_map,
+            "ShowNextMap": self.show_next_map,
+            "AdminSetNextLayer": self.set_next_layer,
+        }
+
+        self._server = None
+        self._writers = set()
+        self._handlers = set()
+
+    @property
+    def port(self):
+        return self._server.sockets[0].getsockname()[1]
+
+    async def start(self, host='127.0.0.1', port=0):
+        self._server = await asyncio.start_server(self._handle, host, port)
+        return self
+
+    async def close(self):
+        if self._server:
+            self._server.close()
+        for task in list(self._handlers):
+            task.cancel()
+        await asyncio.gather(*self._handlers, return_exceptions=True)
+        if self._server:
+            await self._server.wait_closed()
+            self._server = None
+
+    def drop_connections(self):
+        """Close all client connections."""
+        for writer in list(self._writers):
+            writer.close()
+        self._writers.clear()
+
+    def send_chat(self, message):
+        """Stream a chat message to all authenticated connections."""
+        data = pack_packet(0, SQUAD_CHAT_STREAM, message.encode('utf-8'))
+        for writer in self._writers:
+            writer.write(data)
+
+    # RESPONSES
+
+    def list_players(self, args=""):
+        lines = ["----- Active Players -----"]
+        for p in self.players:
+            squad_id = p.squad_id if p.squad_id else "N/A"
+            lines.append(f"ID: {p.player_id} | SteamID: {p.steam_id} | Name: {p.name} | Team ID: {p.team_id} | "
+                         f"Squad ID: {squad_id} | Is Leader: {p.is_leader} | Role: {p.role}")
+        lines.append("")
+        lines.append("----- Recently Disconnected Players [Max of 15] -----")
+        return "\n".join(lines)
+
+    def list_squads(self, args=""):
+        lines = ["----- Active Squads -----"]
+        for team_id, faction in TEAM_FACTIONS.items():
+            lines.append(f"Team ID: {team_id} ({faction})")
+            squads = {}
+            for p in self.players:
+                if p.team_id == team_id and p.squad_id:
+                    squads.setdefault(p.squad_id, []).append(p)
+            for squad_id, members in sorted(squads.items()):
+                leader = members[0]
+                lines.append(f"ID: {squad_id} | Name: Squad {squad_id} | Size: {len(members)} | Locked: False | "
+                             f"Creator Name: {leader.name} | Creator Steam ID: {leader.steam_id}")
+        return "\n".join(lines)
+
+    def show_current_map(self, args=""):
+        return f"Current level is {self.current_layer.split(' ')[0]}, layer is {self.current_layer}"
+
+    def show_next_map(self, args=""):
+        return f"Next level is {self.next_layer.split(' ')[0]}, layer is {self.next_layer}"
+
+    def set_next_layer(self, args=""):
+        self.next_layer = args
+        return f"Set next layer to {args}"
+
+    def execute(self, command):
+        verb, _, args = command.partition(" ")
+        handler = self.commands.get(verb)
+        if handler:
+            return handler(args)
+        return ""
+
+    # PROTOCOL
+
+    async def _handle(self, reader, writer):
+        # Replies are written in order by a separate task, each after the configured latency
+        replies = asyncio.Queue()
+        sender = asyncio.create_task(self._send_replies(writer, replies))
+        self._handlers.add(asyncio.current_task())
+        amount = 0
+        try:
+            while True:
+                header = await reader.readexactly(HEADER_STRUCT.size)
+                (pkt_size, pkt_id, pkt_type) = HEADER_STRUCT.unpack(header)
+                body = (await reader.readexactly(pkt_size - 8)).rstrip(b'\x00').decode('utf-8')
+                due = time.monotonic() + self.latency
+
+                if pkt_type == SERVERDATA_AUTH:
+                    if body == self.password:
+                        replies.put_nowait((due, pack_packet(pkt_id, SERVERDATA_RESPONSE_VALUE)
+                                                 + pack_packet(pkt_id, SERVERDATA_AUTH_RESPONSE)))
+                        self._writers.add(writer)
+                    else:
+                        # Squad doesn't respond to a bad password at all
+                        logging.debug('Fake server: refused password %s', body)
+
+                elif writer not in self._writers:
+                    break
+
+                elif pkt_type == SERVERDATA_EXECCOMMAND:
+                    amount += 1
+                    self.received.append(body)
+                    if self.disconnect_after and amount > self.disconnect_after:
+                        break
+                    replies.put_nowait((due, self._pack_response(pkt_id, self.execute(body))))
+
+                elif pkt_type == SERVERDATA_RESPONSE_VALUE:
+                    # The client marks the end of a multipacket response with an empty response packet. Squad mirrors
+                    # it, then sends an empty response followed by the special multipacket header.
+                    replies.put_nowait((due, pack_packet(pkt_id, SERVERDATA_RESPONSE_VALUE)
+                                             + pack_packet(pkt_id, SERVERDATA_RESPONSE_VALUE)
+                                             + SPECIAL_MULTIPACKET_HEADER))
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self._handlers.discard(asyncio.current_task())
+            self._writers.discard(writer)
+            sender.cancel()
+            writer.close()
+
+    def _pack_response(self, pkt_id, response):
+        body = response.encode('utf-8')
+        packets = [pack_packet(pkt_id, SERVERDATA_RESPONSE_VALUE, body[i:i + MAX_BODY_SIZE])
+                   for i in range(0, len(body), MAX_BODY_SIZE)] or [pack_packet(pkt_id, SERVERDATA_RESPONSE_VALUE)]
+        if self.chat_in_responses:
+            chat = pack_packet(0, SQUAD_CHAT_STREAM, b'[ChatAll] [SteamID:76561198000000000] Player 0 : hello')
+            packets.insert(len(packets) // 2 + 1, chat)
+        return b''.join(packets)
+
+    async def _send_replies(self, writer, replies):
+        while True:
+            (due, data) = await replies.get()
+            delay = due - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if self.chunk_size:
+                for i in range(0, len(data), self.chunk_size):
+                    writer.write(data[i:i + self.chunk_size])
+                    await writer.drain()
+            else:
+                writer.write(data)
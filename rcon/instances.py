@@ -2,7 +2,7 @@ import sqlite3
 import discord
 from discord import guild
 from discord.ext import commands
-from rcon.connection import RconConnection
+from rcon.connection import AsyncRconConnection
 from rcon.permissions import *
 
 
@@ -86,16 +86,20 @@ cur.execute('CREATE TABLE IF NOT EXISTS permissions(instance_id INT, user_id INT
 db.commit()
 
 
-def add_instance(name: str, address: str, port: int, password: str, owner_id: int, game: str, default_perms: int = 0, uses_custom_rotation: int = 0):
+async def add_instance(name: str, address: str, port: int, password: str, owner_id: int, game: str, default_perms: int = 0, uses_custom_rotation: int = 0):
     # Look for already existing instances that use this address.
     cur.execute('SELECT * FROM instances WHERE address = ? AND port = ?', (address, port))
     if cur.fetchone():
         raise commands.BadArgument("A server with this address has already been registered")
 
     # Open and close a connection to see whether this server can be connected
-    # to. The RconConnection class will raise a RconAuthError otherwise.
-    rcon = RconConnection(address, port, password)
-    rcon._sock.close()
+    # to. The AsyncRconConnection class will raise a RconAuthError otherwise.
+    rcon = AsyncRconConnection(address, port, password)
+    try:
+        await rcon.connect()
+    finally:
+        # The transport stays open when authenticating fails or times out
+        await rcon.close()
 
     # The instance can now be added. But first we
     # need to create a new unique ID for this instance.
@@ -110,7 +114,7 @@ def add_instance(name: str, address: str, port: int, password: str, owner_id: in
 
     return Instance(instance_id)
 
-def edit_instance(inst_id: int, name: str, address: str, port: int, password: str, game: str):
+async def edit_instance(inst_id: int, name: str, address: str, port: int, password: str, game: str):
     # Look for already existing instances that use this address.
     cur.execute('SELECT * FROM instances WHERE address = ? AND port = ? AND instance_id != ?', (address, port, inst_id))
     if cur.fetchone():
@@ -118,7 +122,7 @@ def edit_instance(inst_id: int, name: str, address: str, port: int, password: st
 
     # Now we have all parameters we can edit the instance in the database.
     inst = Instance(inst_id)
-    inst.set_credentials(address, port, password)
+    await inst.set_credentials(address, port, password)
     inst.set_name(name)
     inst.set_game(game)
     
@@ -194,10 +198,14 @@ class Instance:
         cur.execute(f'UPDATE instances SET {header} = ? WHERE instance_id = ?', (value, self.id))
         db.commit()
 
-    def set_credentials(self, address: str, port: int, password: str):
+    async def set_credentials(self, address: str, port: int, password: str):
         # Check whether host and port are valid
-        rcon = RconConnection(address, port, password)
-        rcon._sock.close()
+        rcon = AsyncRconConnection(address, port, password)
+        try:
+            await rcon.connect()
+        finally:
+            # The transport stays open when authenticating fails or times out
+            await rcon.close()
 
         cur.execute(f'UPDATE instances SET address = ? WHERE instance_id = ?', (address, self.id))
         cur.execute(f'UPDATE instances SET port = ? WHERE instance_id = ?', (port, self.id))
@@ -0,0 +1,136 @@
+"""In-memory metrics of the RCON connections"""
+
+import bisect
+
+# Upper bounds of the latency histogram buckets in seconds, from 1ms up to about a minute.
+# Each bucket is 2^(1/4) times as large as the previous one, so percentiles are accurate to within ~19%.
+HISTOGRAM_BUCKETS = tuple(0.001 * 2 ** (i / 4) for i in range(64))
+
+
+class Histogram(object):
+    """Latency histogram with fixed, exponentially sized buckets"""
+
+    def __init__(self):
+        self.counts = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, value):
+        self.counts[bisect.bisect_left(HISTOGRAM_BUCKETS, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, percentile):
+        """Return the upper bound of the bucket the given percentile (0-100) falls in"""
+        if not self.count:
+            return 0.0
+        target = self.count * percentile / 100
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= target:
+                break
+        if i >= len(HISTOGRAM_BUCKETS):
+            return self.max
+        return min(HISTOGRAM_BUCKETS[i], self.max)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+
+class ServerMetrics(object):
+    """Metrics of all RCON connections to a single server"""
+
+    def __init__(self, name):
+        self.name = name
+        # Latency per command verb, ex. "ListPlayers"
+        self.commands = {}
+        self.errors = {}
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.packets_in = 0
+        self.packets_out = 0
+        self.chat_packets = 0
+        self.reconnects = 0
+        # Time spent waiting for a free slot, and the most commands ever waiting, per priority class
+        self.queue_waits = {}
+        self.queue_depths = {}
+        # Duration of the jobs of the instance's worker, see rcon.workers
+        self.worker_jobs = Histogram()
+        self.worker_failures = 0
+        self.worker_restarts = 0
+        self.worker_dropped = 0
+        self.worker_backlog = 0
+
+    def record_command(self, command, seconds, failed=False):
+        verb = command.split(" ", 1)[0]
+        histogram = self.commands.get(verb)
+        if histogram is None:
+            histogram = self.commands[verb] = Histogram()
+        histogram.record(seconds)
+        if failed:
+            self.errors[verb] = self.errors.get(verb, 0) + 1
+
+    def record_queue_wait(self, priority, seconds):
+        histogram = self.queue_waits.get(priority)
+        if histogram is None:
+            histogram = self.queue_waits[priority] = Histogram()
+        histogram.record(seconds)
+
+    def record_queue_depth(self, priority, depth):
+        if depth > self.queue_depths.get(priority, 0):
+            self.queue_depths[priority] = depth
+
+    def record_worker_job(self, seconds, failed=False):
+        self.worker_jobs.record(seconds)
+        if failed:
+            self.worker_failures += 1
+
+    def record_worker_backlog(self, backlog):
+        if backlog > self.worker_backlog:
+            self.worker_backlog = backlog
+
+    def record_worker_dropped(self):
+        self.worker_dropped += 1
+
+    def record_sent(self, amount, size):
+        self.packets_out += amount
+        self.bytes_out += size
+
+    def record_received(self, size):
+        self.packets_in += 1
+        self.bytes_in += size
+
+    @property
+    def total(self):
+        """Histogram of all commands combined"""
+        histogram = Histogram()
+        for other in self.commands.values():
+            histogram.counts = [a + b for a, b in zip(histogram.counts, other.counts)]
+            histogram.count += other.count
+            histogram.total += other.total
+            histogram.max = max(histogram.max, other.max)
+        return histogram
+
+
+class MetricsRegistry(object):
+    """Keeps the metrics of every server, by instance ID or address"""
+
+    def __init__(self):
+        self.servers = {}
+
+    def get(self, name):
+        metrics = self.servers.get(name)
+        if metrics is None:
+            metrics = self.servers[name] = ServerMetrics(name)
+        return metrics
+
+    def clear(self):
+        self.servers.clear()
+
+
+registry = MetricsRegistry()
@@ -0,0 +1,209 @@
+"""Parsers that turn the text responses of the RCON commands into records.
+
+All patterns are compiled once and match a whole response in a single
+pass. Where Squad has changed a response over time, a ResponseParser
+remembers which format a server uses, so that the other formats aren't
+tried again on every poll. Only when some lines don't match the cached
+format are the lines parsed one by one, to detect the new format and log
+what couldn't be parsed.
+"""
+
+import re
+from typing import NamedTuple, Optional, List
+
+import logging
+
+
+DISCONNECTED_HEADER = "----- Recently Disconnected Players [Max of 15] -----"
+
+# Squad v2.12 and later
+PLAYER_RE = re.compile(r'^ID: (\d+) \| SteamID: (\d{17}|N/A) \| Name: (.*?) \| Team ID: (\d+|N/A) \| Squad ID: (\d+|N/A) \| Is Leader: (True|False) \| Role: (.*)$', re.M)
+PLAYER_RE_LEGACY = re.compile(r'^ID: (\d+) \| SteamID: (\d{17}|N/A) \| Name: (.*?) \| Team ID: (\d+|N/A) \| Squad ID: (\d+|N/A)$', re.M)
+DISCONNECTED_PLAYER_RE = re.compile(r'^ID: (\d+) \| SteamID: (\d{17}|N/A) \| Since Disconnect: (\d+)m\.(\d+)s \| Name: (.*)$', re.M)
+
+TEAM_RE = re.compile(r'^Team ID: ([12]) \((.*)\)$', re.M)
+SQUAD_RE = re.compile(r'^ID: (\d+) \| Name: (.*?) \| Size: (\d+) \| Locked: (True|False) \| Creator Name: (.*) \| Creator Steam ID: (\d{17})$', re.M)
+SQUAD_RE_LEGACY = re.compile(r'^ID: (\d+) \| Name: (.*?) \| Size: (\d+) \| Locked: (True|False)$', re.M)
+
+PLAYER_FORMATS = (PLAYER_RE, PLAYER_RE_LEGACY)
+SQUAD_FORMATS = (SQUAD_RE, SQUAD_RE_LEGACY)
+
+CURRENT_MAP_RE = re.compile(r'Current level is (.+), layer is (.+)')
+NEXT_MAP_RE = re.compile(r'Next level is (.+), layer is (.+)')
+# Before Squad v2.0 ShowNextMap responded with both maps at once
+MAPS_RE_LEGACY = re.compile(r'Current map is (.+), Next map is (.+)')
+
+# Chat messages, ex. '[ChatAll] [SteamID:12345678901234567] [FP] Clan Member 1 : Hello world!'
+CHAT_RE = re.compile(r'\[(.+)\] \[SteamID:(\d{17})\] (.*) : (.*)')
+# '[ChatAdmin] ASQKillDeathRuleset : Player S.T.A.L.K.E.R%s Team Killed Player NUKE'
+TEAMKILL_RE = re.compile(r'\[ChatAdmin\] ASQKillDeathRuleset : Player (.*) Team Killed Player (.*)')
+
+MAP_FORMAT_LEVEL = "level"
+MAP_FORMAT_LEGACY = "legacy"
+
+
+class PlayerRecord(NamedTuple):
+    player_id: int
+    steam_id: int
+    name: str
+    team_id: Optional[int]
+    squad_id: Optional[int]
+    is_leader: bool = False
+    role: Optional[str] = None
+
+class DisconnectedPlayerRecord(NamedTuple):
+    player_id: int
+    steam_id: int
+    name: str
+    since_disconnect: int
+
+class SquadRecord(NamedTuple):
+    squad_id: int
+    name: str
+    size: int
+    locked: bool
+    creator_name: Optional[str] = None
+    creator_steam_id: Optional[int] = None
+
+class TeamRecord(NamedTuple):
+    team_id: int
+    faction: str
+    squads: List[SquadRecord]
+
+
+def _count_rows(text):
+    """Return the amount of lines starting with "ID: " """
+    return text.count("\nID: ") + text.startswith("ID: ")
+
+
+def _player_record(row):
+    team_id = int(row[3]) if row[3] != "N/A" else None
+    squad_id = int(row[4]) if row[4] != "N/A" else None
+    if len(row) == 7:
+        return PlayerRecord(int(row[0]), int(row[1]), row[2], team_id, squad_id, row[5] == "True", row[6])
+    return PlayerRecord(int(row[0]), int(row[1]), row[2], team_id, squad_id)
+
+
+def _squad_record(row):
+    if len(row) == 6:
+        return SquadRecord(int(row[0]), row[1], int(row[2]), row[3] == "True", row[4], int(row[5]))
+    return SquadRecord(int(row[0]), row[1], int(row[2]), row[3] == "True")
+
+
+class ResponseParser(object):
+    """Parses the responses of a single server, caching which response formats it uses.
+
+    Parameters:
+        instance_id (int) ID of the instance, for logging
+    """
+
+    def __init__(self, instance_id=None):
+        self.id = instance_id
+        # Index of the detected format in PLAYER_FORMATS and SQUAD_FORMATS, or None if not detected yet
+        self.player_format = None
+        self.squad_format = None
+        self.disconnected_format = None
+        self.map_format = None
+
+    def _rows(self, formats, attr, text, name):
+        """Return the groups of every "ID: " line in the text, matched against the cached format"""
+        index = getattr(self, attr)
+        expected = _count_rows(text)
+        if index is not None:
+            rows = formats[index].findall(text)
+            if len(rows) == expected:
+                return rows
+
+        # Not detected yet, or the server switched formats after an update
+        rows = []
+        for line in text.splitlines():
+            if not line.startswith("ID: "):
+                continue
+            for i, pattern in enumerate(formats):
+                match = pattern.fullmatch(line)
+                if match:
+                    if i != getattr(self, attr):
+                        logging.info('Inst %s: Detected %s format %s', self.id, name, i)
+                        setattr(self, attr, i)
+                    rows.append(match.groups())
+                    break
+            else:
+                logging.error('Inst %s: Could not parse %s line: %s', self.id, name, line)
+        return rows
+
+    def players(self, res):
+        """Parse the response of ListPlayers.
+
+        Returns a tuple with a list of PlayerRecords that are online and a
+        list of DisconnectedPlayerRecords of players that recently left.
+        Players without a SteamID are left out.
+        """
+        online, _, disconnected = res.partition(DISCONNECTED_HEADER)
+        rows = self._rows(PLAYER_FORMATS, 'player_format', online, "player")
+        players = [_player_record(row) for row in rows if row[1] != "N/A"]
+        return players, self.disconnected_players(disconnected)
+
+    async def stream_players(self, batches):
+        """Parse the response of ListPlayers while it is being received.
+
+        Parameters:
+            batches (async iterator) yields lists of complete lines, see Rcon.stream_lines
+
+        Returns the same as players()
+        """
+        players = []
+        disconnected = []
+        in_disconnected = False
+        async for lines in batches:
+            text = "\n".join(lines)
+            if not in_disconnected:
+                online, header, text = text.partition(DISCONNECTED_HEADER)
+                rows = self._rows(PLAYER_FORMATS, 'player_format', online.strip("\n"), "player")
+                players += [_player_record(row) for row in rows if row[1] != "N/A"]
+                in_disconnected = bool(header)
+            if in_disconnected:
+                disconnected.append(text)
+        return players, self.disconnected_players("\n".join(disconnected))
+
+    def disconnected_players(self, res):
+        """Parse the response of AdminListDisconnectedPlayers, or the
+        disconnected section of ListPlayers, into DisconnectedPlayerRecords"""
+        rows = self._rows((DISCONNECTED_PLAYER_RE,), 'disconnected_format', res, "disconnected player")
+        return [DisconnectedPlayerRecord(int(player_id), int(steam_id), name, int(minutes) * 60 + int(seconds))
+                for (player_id, steam_id, minutes, seconds, name) in rows if steam_id != "N/A"]
+
+    def squads(self, res):
+        """Parse the response of ListSquads into a list of TeamRecords"""
+        teams = []
+        headers = list(TEAM_RE.finditer(res))
+        for i, header in enumerate(headers):
+            end = headers[i + 1].start() if i + 1 < len(headers) else len(res)
+            rows = self._rows(SQUAD_FORMATS, 'squad_format', res[header.end():end].strip("\n"), "squad")
+            teams.append(TeamRecord(int(header.group(1)), header.group(2), [_squad_record(row) for row in rows]))
+        return teams
+
+    def maps(self, current_map, next_map):
+        """Parse the responses of ShowCurrentMap and ShowNextMap.
+
+        Returns a tuple with the current and next layer, either being None
+        if it could not be read.
+        """
+        if self.map_format != MAP_FORMAT_LEGACY:
+            current_match = CURRENT_MAP_RE.match(current_map)
+            next_match = NEXT_MAP_RE.match(next_map)
+            if current_match or next_match:
+                self.map_format = MAP_FORMAT_LEVEL
+                return (current_match.group(2) if current_match else None,
+                        next_match.group(2) if next_match else None)
+
+        legacy_match = MAPS_RE_LEGACY.match(next_map)
+        if legacy_match:
+            self.map_format = MAP_FORMAT_LEGACY
+            return legacy_match.groups()
+        if self.map_format == MAP_FORMAT_LEGACY:
+            # The server may have been updated since the format was detected
+            self.map_format = None
+            return self.maps(current_map, next_map)
+        # Neither format matches, detect it again next time
+        self.map_format = None
+        return None, None
@@ -0,0 +1,96 @@
+"""Decides how often each instance is polled, based on how much is happening on it"""
+
+import collections
+import time
+from datetime import datetime
+
+
+# Seconds between polls of a server without players
+POLL_INTERVAL_EMPTY = 180
+# Seconds between polls of a server that is seeding, ie. has less than LIVE_PLAYERS players
+POLL_INTERVAL_SEEDING = 60
+SEEDING_PLAYERS = 1
+# Seconds between polls of a server that is live
+POLL_INTERVAL_LIVE = 30
+LIVE_PLAYERS = 20
+# Seconds between polls of a server that is (nearly) full
+POLL_INTERVAL_BUSY = 15
+BUSY_PLAYERS = 80
+# Seconds between polls while people are chatting or running commands on an instance
+POLL_INTERVAL_ACTIVE = 10
+
+# Chat messages within CHAT_WINDOW seconds that make an instance active
+ACTIVE_CHAT_MESSAGES = 5
+CHAT_WINDOW = 60
+# Seconds after a command during which an instance is active
+COMMAND_WINDOW = 5 * 60
+
+# While the map is transitioning, the interval starts here and doubles every poll, up to the maximum
+POLL_INTERVAL_TRANSITION = 5
+POLL_INTERVAL_TRANSITION_MAX = 60
+
+
+class PollScheduler(object):
+    """Picks the interval at which each instance is polled.
+
+    Empty servers are polled every few minutes and full servers every few
+    seconds. Instances where people are chatting or running commands are
+    polled more often, and instances that are changing maps back off
+    until the new layer has loaded.
+
+    Parameters:
+        last_used (dict) instance ID -> time.monotonic() of the last command, see Cache.touch
+    """
+
+    def __init__(self, last_used=None):
+        self.last_used = last_used if last_used is not None else {}
+        # Instance ID -> times of recent chat messages
+        self._chat = {}
+        # Instance ID -> amount of polls in a row that found the map transitioning
+        self._transition_polls = {}
+
+    def record_chat(self, instance_id):
+        times = self._chat.get(instance_id)
+        if times is None:
+            times = self._chat[instance_id] = collections.deque(maxlen=ACTIVE_CHAT_MESSAGES)
+        times.append(time.monotonic())
+
+    def record_poll(self, inst):
+        """Keep track of the state the instance was in after being polled"""
+        if inst.is_transitioning:
+            self._transition_polls[inst.id] = self._transition_polls.get(inst.id, 0) + 1
+        else:
+            self._transition_polls.pop(inst.id, None)
+
+    def is_active(self, instance_id):
+        now = time.monotonic()
+        if now - self.last_used.get(instance_id, float('-inf')) < COMMAND_WINDOW:
+            return True
+        times = self._chat.get(instance_id)
+        return bool(times) and len(times) == ACTIVE_CHAT_MESSAGES and now - times[0] < CHAT_WINDOW
+
+    def interval(self, inst):
+        """Return the amount of seconds between polls of the instance"""
+        if inst.is_transitioning:
+            polls = self._transition_polls.get(inst.id, 0)
+            return min(POLL_INTERVAL_TRANSITION * 2 ** polls, POLL_INTERVAL_TRANSITION_MAX)
+
+        players = len(inst.roster)
+        if players >= BUSY_PLAYERS: interval = POLL_INTERVAL_BUSY
+        elif players >= LIVE_PLAYERS: interval = POLL_INTERVAL_LIVE
+        elif players >= SEEDING_PLAYERS: interval = POLL_INTERVAL_SEEDING
+        else: interval = POLL_INTERVAL_EMPTY
+
+        if self.is_active(inst.id):
+            interval = min(interval, POLL_INTERVAL_ACTIVE)
+        return interval
+
+    def is_due(self, inst):
+        """Whether the instance should be polled now. Updates for other reasons, like commands, count as polls too."""
+        if inst.last_updated is None:
+            return True
+        return (datetime.now() - inst.last_updated).total_seconds() >= self.interval(inst)
+
+    def forget(self, instance_id):
+        self._chat.pop(instance_id, None)
+        self._transition_polls.pop(instance_id, None)
@@ -0,0 +1,238 @@
+"""Pool of RCON connections to a single server"""
+
+import asyncio
+import contextlib
+import time
+
+import logging
+
+from rcon import metrics
+from rcon.connection import AsyncRconConnection, RconAuthError, RconEmptyHeaderError
+from rcon.scheduler import CommandScheduler, PRIORITY_INTERACTIVE
+from rcon.supervisor import RconCircuitOpenError
+
+
+# Maximum amount of connections that are opened to a single server
+POOL_SIZE = 3
+# Maximum amount of commands in flight on a single pipelined connection
+PIPELINE_DEPTH = 4
+# Seconds after which an idle, non-primary connection is closed
+POOL_IDLE_TIMEOUT = 300
+# Seconds between checks for idle or broken connections
+POOL_REAP_INTERVAL = 60
+# Seconds of silence after which the primary connection is probed
+KEEPALIVE_INTERVAL = 30
+
+
+class RconPool(object):
+    """A bounded pool of authenticated RCON connections to one server.
+
+    The first connection is the primary connection. It is never reaped and
+    is the only connection that stores chat messages, since the server
+    streams chat to every connection that is open. Extra connections are
+    opened on demand when all others are busy, up to the pool size.
+
+    When pipelined, each connection carries up to PIPELINE_DEPTH commands
+    at once before another connection is opened. Once all of them are busy,
+    commands wait for a free slot by priority class, see CommandScheduler.
+
+    When given a CircuitBreaker, connection failures are reported to it and
+    commands fail immediately while its circuit is not closed. Keepalive
+    probes that go unanswered count as failures too.
+
+    When given a WireRecorder, all connections record their traffic to it.
+    The recorder is closed along with the pool.
+    """
+
+    def __init__(self, server, port=27015, password='', instance_id=None, size=POOL_SIZE, idle_timeout=POOL_IDLE_TIMEOUT, pipelined=False, breaker=None, recorder=None, keepalive_interval=KEEPALIVE_INTERVAL):
+        self.id = instance_id
+        self.server = server
+        self.port = port
+        self.password = password
+        self.size = max(1, size)
+        self.idle_timeout = idle_timeout
+        self.pipelined = pipelined
+        self.depth = PIPELINE_DEPTH if pipelined else 1
+        self.breaker = breaker
+        self.recorder = recorder
+        self.keepalive_interval = keepalive_interval
+
+        self._primary = None
+        self._connections = []
+        # Amount of commands that are in flight per connection
+        self._in_flight = {}
+        self.metrics = metrics.registry.get(instance_id if instance_id is not None else f'{server}:{port}')
+        self._slots = CommandScheduler(self.size * self.depth, self.metrics)
+        self._opening = asyncio.Lock()
+        self._reaper = None
+        self._chat_subscribers = []
+
+    @property
+    def is_connected(self):
+        return self._primary is not None and self._primary.is_connected
+
+    @property
+    def is_available(self):
+        """Whether commands can be sent, without waiting for a circuit breaker to close"""
+        return self.breaker is None or self.breaker.is_closed
+
+    async def connect(self):
+        """Open and authenticate the primary connection."""
+        self._primary = await self._open_connection(receive_chat=True)
+        for callback in self._chat_subscribers:
+            self._primary.subscribe_chat(callback)
+        if self._reaper is None:
+            self._reaper = asyncio.create_task(self._reap_connections())
+        return self
+
+    async def close(self):
+        """Close all connections in the pool."""
+        if self._reaper is not None:
+            self._reaper.cancel()
+            self._reaper = None
+        connections = self._connections
+        self._connections = []
+        self._in_flight = {}
+        self._primary = None
+        for conn in connections:
+            await conn.close()
+        if self.recorder:
+            self.recorder.close()
+
+    def _create_connection(self, receive_chat=False):
+        # Only the primary connection is kept alive, others are reaped when idle anyway
+        return AsyncRconConnection(self.server, self.port, self.password, instance_id=self.id,
+                                   receive_chat=receive_chat, pipelined=self.pipelined, recorder=self.recorder,
+                                   keepalive_interval=self.keepalive_interval if receive_chat else None,
+                                   on_keepalive_failure=self._on_keepalive_failure)
+
+    def _on_keepalive_failure(self, exc):
+        # The connection closed itself, the next command reopens it or the supervisor takes over
+        if self.breaker:
+            self.breaker.record_failure(exc)
+
+    async def _open_connection(self, receive_chat=False):
+        conn = self._create_connection(receive_chat)
+        await conn.connect()
+        conn.last_used = time.monotonic()
+        self._connections.append(conn)
+        self._in_flight[conn] = 0
+        logging.info('Inst %s: Opened RCON connection %s/%s', self.id, len(self._connections), self.size)
+        return conn
+
+    async def _discard_connection(self, conn):
+        if conn in self._connections:
+            self._connections.remove(conn)
+            del self._in_flight[conn]
+        await conn.close()
+
+    def _pick_connection(self):
+        # Prefer the primary connection so that chat keeps being read from it.
+        # It reconnects by itself, so it is never discarded.
+        if self._primary is not None and self._in_flight[self._primary] < self.depth:
+            return self._primary
+        available = [conn for conn in self._connections if self._in_flight[conn] < self.depth and conn.is_connected]
+        if available:
+            return min(available, key=lambda conn: self._in_flight[conn])
+        return None
+
+    async def acquire(self, priority=PRIORITY_INTERACTIVE):
+        """Check out a connection, waiting for one to free up if the pool is exhausted.
+        The most urgent priority class is served first."""
+        await self._slots.acquire(priority)
+        try:
+            conn = self._pick_connection()
+            if conn is None:
+                async with self._opening:
+                    conn = self._pick_connection()
+                    if conn is None:
+                        for dead in [c for c in self._connections if not c.is_connected and not self._in_flight[c]]:
+                            if dead is not self._primary:
+                                await self._discard_connection(dead)
+                        conn = await self._open_connection()
+            self._in_flight[conn] += 1
+            return conn
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, conn):
+        """Check a connection back in."""
+        conn.last_used = time.monotonic()
+        if conn in self._in_flight:
+            self._in_flight[conn] -= 1
+        self._slots.release()
+
+    @contextlib.asynccontextmanager
+    async def connection(self, priority=PRIORITY_INTERACTIVE):
+        """Yields a checked out connection and checks it back in afterwards."""
+        conn = await self.acquire(priority)
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    async def exec_command(self, command, priority=PRIORITY_INTERACTIVE):
+        """Execute the given RCON command on any free connection."""
+        if not self.is_available:
+            raise RconCircuitOpenError('Server is unreachable: %s' % self.breaker.last_error)
+        try:
+            async with self.connection(priority) as conn:
+                res = await conn.exec_command(command)
+        except (OSError, asyncio.TimeoutError, RconAuthError, RconEmptyHeaderError) as e:
+            if self.breaker:
+                self.breaker.record_failure(e)
+            raise
+        if self.breaker:
+            self.breaker.record_success()
+        return res
+
+    async def stream_command(self, command, priority=PRIORITY_INTERACTIVE):
+        """Execute the given RCON command on any free connection, yielding lists of
+        lines of its response as they arrive."""
+        if not self.is_available:
+            raise RconCircuitOpenError('Server is unreachable: %s' % self.breaker.last_error)
+        try:
+            async with self.connection(priority) as conn:
+                async for lines in conn.stream_command(command):
+                    yield lines
+        except (OSError, asyncio.TimeoutError, RconAuthError, RconEmptyHeaderError) as e:
+            if self.breaker:
+                self.breaker.record_failure(e)
+            raise
+        if self.breaker:
+            self.breaker.record_success()
+
+    async def _reap_connections(self):
+        while True:
+            await asyncio.sleep(POOL_REAP_INTERVAL)
+            now = time.monotonic()
+            for conn in list(self._connections):
+                if conn is self._primary or conn not in self._connections or self._in_flight[conn]:
+                    continue
+                if not conn.is_connected or now - conn.last_used > self.idle_timeout:
+                    await self._discard_connection(conn)
+                    logging.info('Inst %s: Closed idle RCON connection, %s/%s remaining', self.id, len(self._connections), self.size)
+
+    def get_player_chat(self):
+        """ Returns the most recent chat messages. """
+        return self._primary.get_player_chat() if self._primary else []
+
+    def clear_player_chat(self):
+        """ Clears the stored chat messages. """
+        if self._primary:
+            self._primary.clear_player_chat()
+
+    def subscribe_chat(self, callback):
+        """Call the given coroutine function with each chat message received by the primary connection."""
+        if callback not in self._chat_subscribers:
+            self._chat_subscribers.append(callback)
+        if self._primary:
+            self._primary.subscribe_chat(callback)
+
+    def unsubscribe_chat(self, callback):
+        """Stop calling the given coroutine function with new chat messages."""
+        if callback in self._chat_subscribers:
+            self._chat_subscribers.remove(callback)
+        if self._primary:
+            self._primary.unsubscribe_chat(callback)
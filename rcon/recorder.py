@@ -0,0 +1,216 @@
+"""Record RCON traffic to a file and replay it later.
+
+A capture is an append-only file of records. Each record consists of a
+RECORD_STRUCT header followed by the packet body:
+
+    timestamp (double), direction (byte), connection (ushort),
+    pkt_id (int), pkt_type (int), body size (uint)
+
+Replaying a capture feeds the received packets back to a connection in
+the order they were recorded, each time the client sends the packets it
+sent back then. As long as the same commands are executed in the same
+order, the client behaves exactly like it did against the live server.
+"""
+
+import asyncio
+import collections
+import struct
+import time
+from pathlib import Path
+
+from rcon.connection import (
+    AsyncRconConnection, RconFramer, RconProtocol,
+    SERVERDATA_AUTH, END_OF_MULTIPACKET, SPECIAL_MULTIPACKET_HEADER, HEADER_STRUCT
+)
+from rcon.commands import Rcon
+
+
+RECORD_STRUCT = struct.Struct('<dBHiiI')
+
+# Seconds after which recorded packets are flushed to the capture file
+FLUSH_INTERVAL = 1
+
+DIRECTION_SENT = 0
+DIRECTION_RECEIVED = 1
+
+
+def capture_path(directory, instance_id):
+    """Return a new capture file path for a recording session of an instance, ex. "captures/1-20240131-235959.rcap".
+    Every session gets its own file, since connection IDs are only unique within a session."""
+    timestamp = time.strftime('%Y%m%d-%H%M%S')
+    path = Path(directory) / f'{instance_id}-{timestamp}.rcap'
+    suffix = 1
+    while path.exists():
+        suffix += 1
+        path = Path(directory) / f'{instance_id}-{timestamp}-{suffix}.rcap'
+    return path
+
+
+def capture_instance_id(path):
+    """Return the instance ID a capture file was recorded for, from its name"""
+    return int(Path(path).stem.split('-', 1)[0])
+
+
+class WireRecorder(object):
+    """Writes all packets sent and received by one or more connections to a capture file.
+
+    Parameters:
+        path (str) path of the capture file, see capture_path
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'ab')
+        self._connections = 0
+        self._flushed = time.monotonic()
+
+    def register(self):
+        """Return a new ID for a connection that is being recorded"""
+        self._connections += 1
+        return self._connections
+
+    def record(self, direction, connection, pkt_id, pkt_type, body=b''):
+        if self._file is None:
+            return
+        if pkt_type == SERVERDATA_AUTH and direction == DIRECTION_SENT:
+            # Never store passwords
+            body = b''
+        self._file.write(RECORD_STRUCT.pack(time.time(), direction, connection, pkt_id, pkt_type, len(body)))
+        self._file.write(body)
+        # Flush every now and then, so that the capture can be read while the bot is running
+        now = time.monotonic()
+        if now - self._flushed >= FLUSH_INTERVAL:
+            self._file.flush()
+            self._flushed = now
+
+    def record_sent(self, connection, pkt_id, pkt_type, body=b''):
+        self.record(DIRECTION_SENT, connection, pkt_id, pkt_type, body)
+
+    def record_received(self, connection, pkt_id, pkt_type, body=b''):
+        self.record(DIRECTION_RECEIVED, connection, pkt_id, pkt_type, body)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class CaptureRecord(object):
+    def __init__(self, timestamp, direction, connection, pkt_id, pkt_type, body):
+        self.timestamp = timestamp
+        self.direction = direction
+        self.connection = connection
+        self.pkt_id = pkt_id
+        self.pkt_type = pkt_type
+        self.body = body
+
+    def pack(self):
+        """Return the packet the way it went over the wire"""
+        if self.pkt_type == END_OF_MULTIPACKET:
+            return SPECIAL_MULTIPACKET_HEADER
+        return HEADER_STRUCT.pack(len(self.body) + 8, self.pkt_id, self.pkt_type) + self.body
+
+
+def read_capture(path):
+    """Read all records of a capture file.
+
+    Returns a dict with, for each recorded connection, a list of its CaptureRecords
+    """
+    connections = collections.defaultdict(list)
+    with open(path, 'rb') as f:
+        data = f.read()
+    offset = 0
+    while offset + RECORD_STRUCT.size <= len(data):
+        (timestamp, direction, connection, pkt_id, pkt_type, size) = RECORD_STRUCT.unpack_from(data, offset)
+        offset += RECORD_STRUCT.size
+        body = data[offset:offset + size]
+        offset += size
+        connections[connection].append(CaptureRecord(timestamp, direction, connection, pkt_id, pkt_type, body))
+    return dict(connections)
+
+
+class ReplayTransport(asyncio.Transport):
+    """Transport that answers the packets written to it with the packets that
+    were received in response to them in a capture."""
+
+    def __init__(self, protocol, records):
+        super().__init__()
+        self._protocol = protocol
+        # Shared with the connection, so that a reconnect continues where the last transport left off
+        self._records = records
+        self._closing = False
+        self._loop = asyncio.get_running_loop()
+        protocol.connection_made(self)
+        # Chat may have been received before anything was sent
+        self._release()
+
+    def write(self, data):
+        # Skip over the packets the client sent
+        offset = 0
+        while offset < len(data):
+            (pkt_size, pkt_id, pkt_type) = HEADER_STRUCT.unpack_from(data, offset)
+            offset += pkt_size + 4
+            if self._records and self._records[0].direction == DIRECTION_SENT:
+                self._records.popleft()
+        if not self._records:
+            # The capture ran out, end the connection like the server would have
+            self.close()
+        self._release()
+
+    def _release(self):
+        """Feed the received packets up until the next sent packet to the protocol"""
+        data = []
+        while self._records and self._records[0].direction == DIRECTION_RECEIVED:
+            data.append(self._records.popleft().pack())
+        if data:
+            self._loop.call_soon(self._feed, b''.join(data))
+
+    def _feed(self, data):
+        while data and not self._closing:
+            buffer = self._protocol.get_buffer(len(data))
+            size = min(len(buffer), len(data))
+            buffer[:size] = data[:size]
+            self._protocol.buffer_updated(size)
+            data = data[size:]
+
+    def is_closing(self):
+        return self._closing
+
+    def close(self):
+        if not self._closing:
+            self._closing = True
+            self._loop.call_soon(self._protocol.connection_lost, None)
+
+
+class ReplayConnection(AsyncRconConnection):
+    """Connection that replays the records of a single captured connection"""
+
+    def __init__(self, records, **kwargs):
+        super().__init__('replay', 0, **kwargs)
+        self.records = collections.deque(records)
+
+    async def _connect_sock(self):
+        self._framer = RconFramer()
+        self._protocol = RconProtocol(self._framer)
+        ReplayTransport(self._protocol, self.records)
+
+
+class ReplayRcon(Rcon):
+    """Rcon pool that replays a capture file instead of connecting to a server.
+    Each connection that is opened replays the next recorded connection.
+
+    Parameters:
+        path (str) path of the capture file
+    """
+
+    def __init__(self, path, instance_id=None, pipelined=True, **kwargs):
+        # Every command should reach the capture, like it did when it was recorded
+        kwargs.setdefault('cache_ttl', 0)
+        super().__init__('replay', 0, instance_id=instance_id, pipelined=pipelined, **kwargs)
+        self.captured = collections.deque(read_capture(path).values())
+
+    def _create_connection(self, receive_chat=False):
+        if not self.captured:
+            raise ConnectionRefusedError('No recorded connections left to replay')
+        return ReplayConnection(self.captured.popleft(), instance_id=self.id,
+                                receive_chat=receive_chat, pipelined=self.pipelined)
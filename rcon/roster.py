@@ -0,0 +1,220 @@
+"""Indexed collection of the players that are online on a server"""
+
+import re
+import sys
+import unicodedata
+
+
+# Clan tags in front of a name, ex. "[FP] ", "(WTH)" or "=7Cav= "
+CLAN_TAG_RE = re.compile(r'^\s*(?:[\[\(\{<|=][^\]\)\}>|=]{1,10}[\]\)\}>|=]\s*)+')
+NON_ALPHANUMERIC_RE = re.compile(r'[\W_]+')
+
+# Scores of the different kinds of matches of NameIndex.search
+SCORE_EXACT = 1.0
+SCORE_PREFIX = 0.9
+SCORE_SUBSTRING = 0.8
+# Trigram similarity is scaled to stay below substring matches
+SCORE_TRIGRAM = 0.75
+# Minimum score of names that are merely similar, equivalent to the 0.6 cutoff of difflib that was used before
+SIMILAR_NAME_CUTOFF = SCORE_TRIGRAM * 0.6
+
+
+def normalize_name(name):
+    """Casefold a name and strip accents, whitespace and punctuation"""
+    name = unicodedata.normalize('NFKD', name.casefold())
+    name = ''.join(c for c in name if not unicodedata.combining(c))
+    return NON_ALPHANUMERIC_RE.sub('', name)
+
+
+def strip_clan_tag(name):
+    return CLAN_TAG_RE.sub('', name)
+
+
+def trigrams(key):
+    padded = f"${key}$"
+    # Most trigrams are shared by many names, across all servers
+    return {sys.intern(padded[i:i + 3]) for i in range(len(padded) - 2)}
+
+
+class NameIndex(object):
+    """Fuzzy lookup of players by name.
+
+    Names are normalized with and without their clan tag. Candidates are
+    found through a trigram index and ranked by exact, prefix, substring
+    and finally trigram similarity.
+    """
+
+    def __init__(self):
+        # Steam ID -> (player, normalized name, normalized name without clan tag, amount of trigrams).
+        # The trigrams themselves are only kept in the inverted index, they're cheap to compute again.
+        self.entries = {}
+        # Trigram -> steam ID, or list of steam IDs if more than one name has it. Most trigrams belong to
+        # a single name, and lists take a fraction of the memory of sets. Players leave rarely enough
+        # for removing them from a list to be cheap still.
+        self.trigrams = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, player):
+        self.remove(player.steam_id)
+        full = normalize_name(player.name)
+        stripped = normalize_name(strip_clan_tag(player.name)) or full
+        if stripped == full:
+            stripped = full
+        grams = trigrams(full) | trigrams(stripped)
+        self.entries[player.steam_id] = (player, full, stripped, len(grams))
+        for gram in grams:
+            steam_ids = self.trigrams.get(gram)
+            if steam_ids is None:
+                self.trigrams[gram] = player.steam_id
+            elif type(steam_ids) is list:
+                steam_ids.append(player.steam_id)
+            else:
+                self.trigrams[gram] = [steam_ids, player.steam_id]
+
+    def remove(self, steam_id):
+        entry = self.entries.pop(steam_id, None)
+        if entry is None:
+            return
+        for gram in trigrams(entry[1]) | trigrams(entry[2]):
+            steam_ids = self.trigrams.get(gram)
+            if steam_ids == steam_id:
+                del self.trigrams[gram]
+            elif type(steam_ids) is list and steam_id in steam_ids:
+                steam_ids.remove(steam_id)
+                if len(steam_ids) == 1:
+                    self.trigrams[gram] = steam_ids[0]
+
+    def search(self, query, limit=5, cutoff=0.3):
+        """Find the players whose name best matches the query.
+
+        Parameters:
+            query (str) (part of) a player name
+            limit (int) maximum amount of results
+            cutoff (float) minimum score between 0 and 1
+
+        Returns a list of (score, player) tuples, best match first
+        """
+        key = normalize_name(query)
+        if not key:
+            return []
+        query_grams = trigrams(key)
+        # Steam ID -> amount of trigrams shared with the query
+        shared = {}
+        for gram in query_grams:
+            steam_ids = self.trigrams.get(gram)
+            if steam_ids is None:
+                continue
+            if type(steam_ids) is not list:
+                steam_ids = (steam_ids,)
+            for steam_id in steam_ids:
+                shared[steam_id] = shared.get(steam_id, 0) + 1
+        if len(key) < 3:
+            # Too short to share trigrams with names it is a part of
+            candidates = self.entries.keys()
+        else:
+            candidates = shared.keys()
+
+        results = []
+        for steam_id in candidates:
+            (player, full, stripped, gram_count) = self.entries[steam_id]
+            if key == full or key == stripped:
+                score = SCORE_EXACT
+            elif full.startswith(key) or stripped.startswith(key):
+                score = SCORE_PREFIX + 0.1 * len(key) / len(full)
+            elif key in full:
+                score = SCORE_SUBSTRING + 0.1 * len(key) / len(full)
+            else:
+                score = SCORE_TRIGRAM * 2 * shared.get(steam_id, 0) / (len(query_grams) + gram_count)
+            if score >= cutoff:
+                results.append((score, player))
+        results.sort(key=lambda result: result[0], reverse=True)
+        return results[:limit]
+
+
+class Roster(object):
+    """Keeps the online players of a server by steam ID.
+
+    Teams and squads keep the steam IDs of their members themselves, see
+    rcon.cache.Team, so the roster has no indexes of its own for them.
+    Lookups by anything but steam ID go over the players of the server,
+    which are few enough for that to take microseconds. The name index is
+    only built once it is searched, and kept in sync from then on. Change
+    the names of players through rename so that it stays in sync.
+    """
+
+    def __init__(self):
+        # Steam ID -> player, in the order the players were added
+        self.by_steam_id = {}
+        self._names = None
+
+    def __len__(self):
+        return len(self.by_steam_id)
+
+    def __iter__(self):
+        return iter(list(self.by_steam_id.values()))
+
+    def __contains__(self, steam_id):
+        return steam_id in self.by_steam_id
+
+    @property
+    def players(self):
+        return list(self.by_steam_id.values())
+
+    @property
+    def names(self):
+        """The NameIndex of the players, built when first used"""
+        if self._names is None:
+            self._names = NameIndex()
+            for player in self.by_steam_id.values():
+                self._names.add(player)
+        return self._names
+
+    def get(self, steam_id):
+        return self.by_steam_id.get(steam_id)
+
+    def add(self, player):
+        self.by_steam_id[player.steam_id] = player
+        if self._names is not None:
+            self._names.add(player)
+
+    def remove(self, player):
+        if self.by_steam_id.get(player.steam_id) is not player:
+            return
+        del self.by_steam_id[player.steam_id]
+        if self._names is not None:
+            self._names.remove(player.steam_id)
+
+    def rename(self, player, name):
+        """Change the name of a player in the roster"""
+        if player.name == name:
+            return
+        player.name = name
+        # Normalizing names is the expensive part, only do it for the names that changed
+        if self._names is not None and self.by_steam_id.get(player.steam_id) is player:
+            self._names.add(player)
+
+    def retain(self, steam_ids):
+        """Remove all players that aren't in the given set of steam IDs.
+
+        Returns a list of the removed players
+        """
+        removed = [player for steam_id, player in self.by_steam_id.items() if steam_id not in steam_ids]
+        for player in removed:
+            self.remove(player)
+        return removed
+
+    def select(self, steam_id=None, name=None, team_id=None, squad_id=None, player_id=None):
+        """Return a list of the players matching all given criteria"""
+        if steam_id is not None:
+            player = self.by_steam_id.get(steam_id)
+            pool = [player] if player else []
+        else:
+            pool = self.players
+
+        if pool and name is not None: pool = [player for player in pool if player.name == name]
+        if pool and team_id is not None: pool = [player for player in pool if player.team_id == team_id]
+        if pool and squad_id is not None: pool = [player for player in pool if player.squad_id == squad_id]
+        if pool and player_id is not None: pool = [player for player in pool if player.player_id == player_id]
+        return pool
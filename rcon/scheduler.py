@@ -0,0 +1,99 @@
+"""Priority scheduling of the commands sent to a single server"""
+
+import asyncio
+import collections
+import time
+
+
+# Priority classes, most urgent first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_CONTROL = 1
+PRIORITY_POLLING = 2
+PRIORITY_BULK = 3
+
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_CONTROL: "control",
+    PRIORITY_POLLING: "polling",
+    PRIORITY_BULK: "bulk",
+}
+
+# Seconds of waiting after which a request is treated as one class more urgent, so that polling and bulk
+# commands can't be starved by each other. Nothing is ever promoted above PRIORITY_CONTROL, so interactive
+# commands always go first.
+AGING_INTERVAL = 2
+
+
+class CommandScheduler(object):
+    """Hands out a fixed amount of slots to commands, most urgent priority class first.
+
+    Within a class, commands are served in the order they arrived. Waiting
+    commands are promoted one class for every AGING_INTERVAL seconds they
+    wait, up to PRIORITY_CONTROL.
+
+    Parameters:
+        slots (int) amount of commands that may be in flight at once
+        metrics (ServerMetrics) if set, queue depths and waiting times are recorded to it
+    """
+
+    def __init__(self, slots, metrics=None):
+        self.slots = slots
+        self.metrics = metrics
+        self._free = slots
+        # Per priority class, a queue of (enqueue time, future)
+        self._queues = {priority: collections.deque() for priority in PRIORITY_NAMES}
+
+    @property
+    def depths(self):
+        """Amount of commands waiting, per priority class"""
+        return {priority: len(queue) for priority, queue in self._queues.items()}
+
+    async def acquire(self, priority=PRIORITY_INTERACTIVE):
+        """Wait for a free slot"""
+        if self._free > 0 and not any(self._queues.values()):
+            self._free -= 1
+            self._record(priority, 0)
+            return
+        queue = self._queues[priority]
+        queued = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        entry = (queued, future)
+        queue.append(entry)
+        if self.metrics:
+            self.metrics.record_queue_depth(PRIORITY_NAMES[priority], len(queue))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed to us right before being cancelled, pass it on
+                self.release()
+            else:
+                queue.remove(entry)
+            raise
+        self._record(priority, time.monotonic() - queued)
+
+    def release(self):
+        """Free up a slot, handing it to the next command in line"""
+        entry = self._next()
+        if entry is None:
+            self._free += 1
+        else:
+            entry[1].set_result(None)
+
+    def _next(self):
+        now = time.monotonic()
+        best = None
+        for priority, queue in self._queues.items():
+            if not queue:
+                continue
+            queued = queue[0][0]
+            effective = priority
+            if priority > PRIORITY_CONTROL:
+                effective = max(PRIORITY_CONTROL, priority - int((now - queued) / AGING_INTERVAL))
+            if best is None or (effective, queued) < best[0]:
+                best = ((effective, queued), queue)
+        return best[1].popleft() if best else None
+
+    def _record(self, priority, seconds):
+        if self.metrics:
+            self.metrics.record_queue_wait(PRIORITY_NAMES[priority], seconds)
@@ -0,0 +1,165 @@
+"""Keeps track of the health of a server and reconnects it in the background"""
+
+import asyncio
+import random
+import time
+
+import logging
+
+from rcon.connection import RconError
+
+
+# Commands are sent as usual
+CIRCUIT_CLOSED = "closed"
+# The server is considered unreachable, commands fail immediately
+CIRCUIT_OPEN = "open"
+# A reconnect attempt is being made
+CIRCUIT_HALF_OPEN = "half-open"
+
+# Consecutive connection failures after which the circuit opens
+FAILURE_THRESHOLD = 3
+# Seconds to wait before the first reconnect attempt. Doubles after every failed attempt.
+BACKOFF_BASE = 5
+# Maximum amount of seconds to wait inbetween reconnect attempts
+BACKOFF_MAX = 600
+
+
+class CircuitBreaker(object):
+    """Circuit breaker with jittered exponential backoff.
+
+    Connection failures are counted while the circuit is closed. Once
+    FAILURE_THRESHOLD is reached, the circuit opens and stays open until
+    the backoff has passed and a reconnect attempt (half-open) succeeds.
+    """
+
+    def __init__(self, failure_threshold=FAILURE_THRESHOLD, base_delay=BACKOFF_BASE, max_delay=BACKOFF_MAX, on_trip=None):
+        self.failure_threshold = failure_threshold
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.on_trip = on_trip
+
+        self.state = CIRCUIT_CLOSED
+        self.failures = 0
+        # Amount of times the circuit opened in a row
+        self.trips = 0
+        self.retry_at = 0
+        self.last_error = None
+
+    @property
+    def is_closed(self):
+        return self.state == CIRCUIT_CLOSED
+
+    @property
+    def retry_in(self):
+        """Seconds left until a reconnect may be attempted"""
+        if self.state != CIRCUIT_OPEN:
+            return 0
+        return max(0, self.retry_at - time.monotonic())
+
+    def record_success(self):
+        self.state = CIRCUIT_CLOSED
+        self.failures = 0
+        self.trips = 0
+        self.last_error = None
+
+    def record_failure(self, exc=None):
+        if self.state == CIRCUIT_OPEN:
+            # Concurrent commands failing on the same outage shouldn't extend the backoff
+            return
+        self.failures += 1
+        self.last_error = exc
+        if self.state == CIRCUIT_HALF_OPEN or self.failures >= self.failure_threshold:
+            self.trip(exc)
+
+    def trip(self, exc=None):
+        """Open the circuit, regardless of the amount of failures."""
+        delay = min(self.max_delay, self.base_delay * 2 ** self.trips)
+        # Spread out the attempts of servers that went down at the same time
+        delay = random.uniform(delay / 2, delay)
+        self.state = CIRCUIT_OPEN
+        self.trips += 1
+        self.retry_at = time.monotonic() + delay
+        if exc is not None:
+            self.last_error = exc
+        if self.on_trip:
+            self.on_trip()
+
+    def half_open(self):
+        self.state = CIRCUIT_HALF_OPEN
+
+    def __str__(self):
+        if self.state == CIRCUIT_OPEN:
+            return "Unreachable, retrying in %ss" % round(self.retry_in)
+        elif self.state == CIRCUIT_HALF_OPEN:
+            return "Reconnecting..."
+        return "Connected"
+
+
+class Supervisor(object):
+    """Reconnects an instance in the background whenever its circuit opens.
+
+    Parameters:
+        instance_id (int) the ID of the supervised instance
+        reconnect (coroutine function) reconnects the instance, raising an exception when it fails
+    """
+
+    def __init__(self, instance_id, reconnect):
+        self.id = instance_id
+        self._reconnect = reconnect
+        self._down = asyncio.Event()
+        self._task = None
+        self.breaker = CircuitBreaker(on_trip=self._on_trip)
+
+    @property
+    def is_running(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if not self.is_running:
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._down.clear()
+        self.breaker.record_success()
+
+    def mark_up(self):
+        self._down.clear()
+        self.breaker.record_success()
+        self.start()
+
+    def mark_down(self, exc=None):
+        self.breaker.trip(exc)
+        self.start()
+
+    def _on_trip(self):
+        logging.warning('Inst %s: Server is unreachable, retrying in %ss: %s',
+                        self.id, round(self.breaker.retry_in), self.breaker.last_error)
+        self._down.set()
+
+    async def _run(self):
+        while True:
+            await self._down.wait()
+            await asyncio.sleep(self.breaker.retry_in)
+            self.breaker.half_open()
+            logging.info('Inst %s: Attempting to reconnect...', self.id)
+            try:
+                await self._reconnect()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.breaker.record_failure(e)
+            else:
+                logging.info('Inst %s: Reconnected', self.id)
+                self._down.clear()
+                self.breaker.record_success()
+
+    def __str__(self):
+        return str(self.breaker)
+
+
+class RconCircuitOpenError(RconError):
+    """Raised when a command is sent to a server that is considered unreachable"""
+    pass
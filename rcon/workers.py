@@ -0,0 +1,176 @@
+"""Background work of each instance, isolated in its own task"""
+
+import asyncio
+import random
+import time
+
+import logging
+
+from rcon import metrics
+
+
+# Seconds inbetween the periodic runs of a worker
+WORKER_INTERVAL = 5
+# Seconds after which a single job is cancelled, so that it can't hold up the worker forever
+JOB_TIMEOUT = 120
+# Maximum amount of jobs waiting per instance. Jobs submitted while the queue is full are dropped.
+QUEUE_SIZE = 100
+# Seconds to wait after a failed periodic or regular job. Doubles for every failure in a row.
+BACKOFF_BASE = 1
+BACKOFF_MAX = 60
+
+
+class InstanceWorker(object):
+    """Runs the periodic work of a single instance, plus any jobs submitted to it, in tasks of its own.
+
+    Jobs run one at a time, so a slow server or a rate limited channel only
+    delays the work of its own instance. Urgent jobs, like forwarding chat
+    messages, run from a second task so that they don't wait for the
+    periodic work. Failed jobs are logged, and the periodic and regular
+    jobs back off after failures. The tasks are restarted should they ever
+    stop unexpectedly.
+
+    Parameters:
+        instance_id (int) the ID of the instance
+        work (coroutine function) is called with the instance ID every interval
+        interval (float) seconds inbetween calls of work
+    """
+
+    def __init__(self, instance_id, work, interval=WORKER_INTERVAL):
+        self.id = instance_id
+        self.work = work
+        self.interval = interval
+        self.metrics = metrics.registry.get(instance_id)
+        # Failures in a row of the periodic and regular jobs. Urgent jobs don't count.
+        self.failures = 0
+        self._queue = asyncio.Queue(QUEUE_SIZE)
+        self._urgent = asyncio.Queue(QUEUE_SIZE)
+        # Name of the loop -> its task
+        self._tasks = {}
+
+    @property
+    def is_running(self):
+        return len(self._tasks) == 2 and not any(task.done() for task in self._tasks.values())
+
+    @property
+    def backlog(self):
+        return self._queue.qsize() + self._urgent.qsize()
+
+    def start(self):
+        for run in (self._run, self._run_urgent):
+            task = self._tasks.get(run.__name__)
+            if task is None or task.done():
+                task = self._tasks[run.__name__] = asyncio.create_task(run())
+                task.add_done_callback(self._on_done)
+
+    def stop(self):
+        tasks, self._tasks = self._tasks, {}
+        for task in tasks.values():
+            task.cancel()
+
+    def submit(self, job, urgent=False):
+        """Queue a coroutine function to be called without arguments. Returns False if the queue is full.
+
+        Parameters:
+            job (coroutine function) the job to run
+            urgent (bool) run the job as soon as possible, instead of after the periodic work
+        """
+        try:
+            (self._urgent if urgent else self._queue).put_nowait(job)
+        except asyncio.QueueFull:
+            self.metrics.record_worker_dropped()
+            logging.warning('Inst %s: Worker has %s jobs waiting, dropping %s', self.id, self.backlog, job)
+            return False
+        self.metrics.record_worker_backlog(self.backlog)
+        return True
+
+    async def _run(self):
+        while True:
+            next_run = time.monotonic() + self.interval
+            await self._backoff(await self._call(self.work, self.id))
+            while True:
+                remaining = next_run - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    job = await asyncio.wait_for(self._queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                await self._backoff(await self._call(job))
+
+    async def _run_urgent(self):
+        # Urgent jobs never back off, a failed one shouldn't hold up the next
+        while True:
+            job = await self._urgent.get()
+            await self._call(job)
+
+    async def _call(self, job, *args):
+        """Run a job, returning whether it succeeded"""
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(job(*args), JOB_TIMEOUT)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.metrics.record_worker_job(time.monotonic() - start, failed=True)
+            logging.exception('Inst %s: Worker job failed: %s: %s', self.id, e.__class__.__name__, e)
+            return False
+        self.metrics.record_worker_job(time.monotonic() - start)
+        return True
+
+    async def _backoff(self, succeeded):
+        """Delay the next periodic or regular job after a failed one"""
+        if succeeded:
+            self.failures = 0
+            return
+        self.failures += 1
+        delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (self.failures - 1))
+        logging.info('Inst %s: Worker continuing in %ss', self.id, delay)
+        await asyncio.sleep(random.uniform(delay / 2, delay))
+
+    def _on_done(self, task):
+        if task not in self._tasks.values() or task.cancelled():
+            return
+        e = task.exception()
+        logging.error('Inst %s: Worker stopped unexpectedly, restarting: %s: %s', self.id, e.__class__.__name__, e)
+        self.metrics.worker_restarts += 1
+        self.start()
+
+
+class InstanceWorkers(object):
+    """Keeps an InstanceWorker running for every instance that needs one.
+
+    Parameters:
+        work (coroutine function) is called with the instance ID every interval, see InstanceWorker
+        interval (float) seconds inbetween calls of work
+    """
+
+    def __init__(self, work, interval=WORKER_INTERVAL):
+        self.work = work
+        self.interval = interval
+        self.workers = {}
+
+    def get(self, instance_id):
+        """Return the worker of an instance, starting it if needed"""
+        worker = self.workers.get(instance_id)
+        if worker is None:
+            worker = self.workers[instance_id] = InstanceWorker(instance_id, self.work, self.interval)
+        worker.start()
+        return worker
+
+    def submit(self, instance_id, job, urgent=False):
+        return self.get(instance_id).submit(job, urgent)
+
+    def sync(self, instance_ids):
+        """Make sure exactly the given instances have a running worker"""
+        instance_ids = set(instance_ids)
+        for instance_id in list(self.workers):
+            if instance_id not in instance_ids:
+                self.workers.pop(instance_id).stop()
+        for instance_id in instance_ids:
+            self.get(instance_id)
+
+    def stop(self):
+        for worker in self.workers.values():
+            worker.stop()
+        self.workers.clear()